@@ -0,0 +1,162 @@
+"""Benchmark of the multi-worker serving mode with a simulated model.
+
+Runs the same evaluation workload with 1..N worker processes, each one with its
+own `OwaspWorkflow` (as with `uvicorn --workers N`), and reports throughput,
+latency and the number of model calls for the per-process `memory` cache and
+the node-wide `sqlite` cache.
+
+Usage (from the repository root):
+    uv run python -m scripts.benchmark_workers --workers 1,2,4,8 --backend sqlite
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+CONFIG_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "src", "configs", "configs.json"
+)
+
+
+def build_snippet(variant: int, functions: int = 20) -> str:
+    """Synthetic Python module, unique per variant."""
+    body = [f"import os\n\nVARIANT = {variant}\n"]
+    for index in range(functions):
+        body.append(
+            f"def handler_{index}(request):\n"
+            f"    value = request.args.get('v{index}')\n"
+            f"    return os.popen('echo ' + value + '{variant}').read()\n"
+        )
+    return "\n".join(body)
+
+
+def run_worker(
+    config_path, jobs, results, ready, model_calls, model_latency, concurrency
+):
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    from src.workflow import OwaspWorkflow
+
+    workflow = OwaspWorkflow(config_path)
+
+    def simulated_model(agent):
+        def run_inference(code_snippet: str) -> dict:
+            with model_calls.get_lock():
+                model_calls.value += 1
+            time.sleep(model_latency)
+            return {
+                "owasp_name": agent.owasp_name,
+                "response": "```yaml\nvulnerabilities_detected: []\n```",
+                "pass": True,
+                "metrics": {"latencyMs": model_latency * 1000},
+            }
+
+        return run_inference
+
+    for agent in workflow.agents.values():
+        agent.run_inference = simulated_model(agent)
+    ready.put(os.getpid())
+
+    async def consume():
+        loop = asyncio.get_running_loop()
+        while True:
+            variant = await loop.run_in_executor(None, jobs.get)
+            if variant is None:
+                return
+            started = time.perf_counter()
+            await workflow.run_async_inference(build_snippet(variant))
+            results.put(time.perf_counter() - started)
+
+    async def main():
+        await asyncio.gather(*(consume() for _ in range(concurrency)))
+
+    asyncio.run(main())
+
+
+def run_benchmark(workers: int, backend: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        config = json.load(open(CONFIG_PATH))
+        config["cache"] = {
+            **config.get("cache", {}),
+            "backend": backend,
+            "path": os.path.join(directory, "cache.db"),
+            "max_entries": 100_000,
+            "poll_seconds": 0.02,
+        }
+        config_path = os.path.join(directory, "configs.json")
+        with open(config_path, "w") as file:
+            json.dump(config, file)
+
+        context = multiprocessing.get_context("spawn")
+        jobs, results, ready = context.Queue(), context.Queue(), context.Queue()
+        model_calls = context.Value("i", 0)
+        processes = [
+            context.Process(
+                target=run_worker,
+                args=(
+                    config_path,
+                    jobs,
+                    results,
+                    ready,
+                    model_calls,
+                    args.model_latency,
+                    args.concurrency,
+                ),
+            )
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        # Only measure once every worker finished importing and building agents
+        for _ in range(workers):
+            ready.get()
+        started = time.perf_counter()
+        for index in range(args.requests):
+            jobs.put(index % args.distinct)
+        for _ in range(workers * args.concurrency):
+            jobs.put(None)
+        latencies = [results.get() for _ in range(args.requests)]
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+
+    latencies.sort()
+    return {
+        "workers": workers,
+        "backend": backend,
+        "throughput_rps": round(args.requests / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        "model_calls": model_calls.value,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4", help="Comma separated counts")
+    parser.add_argument("--backend", default="sqlite,memory")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--distinct", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--model-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(
+        f"{'backend':<8} {'workers':>7} {'rps':>8} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'model calls':>12}"
+    )
+    for backend in args.backend.split(","):
+        for workers in [int(value) for value in args.workers.split(",")]:
+            row = run_benchmark(workers, backend, args)
+            print(
+                f"{row['backend']:<8} {row['workers']:>7} {row['throughput_rps']:>8} "
+                f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['model_calls']:>12}"
+            )
+
+
+if __name__ == "__main__":
+    main()
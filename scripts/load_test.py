@@ -0,0 +1,570 @@
+"""End-to-end HTTP load test of the API with a capacity report.
+
+Starts the app (`uvicorn src.app:app`) wired to a stub model server
+(`scripts/stub_openai_server.py`) and to a local JWKS that signs the tokens of
+simulated developers, then replays /evaluate traffic with mixed code sizes,
+exact and near duplicates. Concurrency ramps up stage by stage, each stage
+runs closed-loop clients (one commit in flight per client) and samples the
+app CPU, the event loop lag, the model calls in flight and the lane queues.
+The report gives the maximum sustainable throughput under the RNF1 SLO (a
+commit analyzed in under 30 s), latency percentiles per stage and the stage
+where each resource saturated.
+
+Usage (from the repository root):
+    uv run python -m scripts.load_test --stages 1,4,16,64,256 --stage-seconds 30
+    uv run python -m scripts.load_test --model-latency 2 --app-workers 4 \\
+        --duplicate-rate 0.3 --output capacity.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CONFIG_PATH = os.path.join(ROOT, "src", "configs", "configs.json")
+AUDIENCE = "https://antman.load-test"
+DOMAIN = "load-test.local"
+KEY_ID = "load-test"
+STARTUP_TIMEOUT_SECONDS = 120
+MONITOR_INTERVAL_SECONDS = 1.0
+# A resource is saturated past these
+LOOP_LAG_LIMIT_MS = 100
+CPU_LIMIT_CORES = 0.85
+TEMPLATES = (
+    "def {name}(request):\n"
+    "    value = request.args.get('{field}')\n"
+    "    query = 'SELECT * FROM {table} WHERE {field} = ' + value\n"
+    "    return db.execute(query).fetchall()\n",
+    "def {name}(items):\n"
+    "    total = 0\n"
+    "    for item in items:\n"
+    "        total += item.{field} * {number}\n"
+    "    return total\n",
+    "def {name}(path):\n"
+    "    with open(path) as handle:\n"
+    "        data = handle.read()\n"
+    "    return hashlib.md5(data.encode()).hexdigest()\n",
+    "class {title}:\n"
+    "    def __init__(self, {field}):\n"
+    "        self.{field} = {field}\n"
+    "\n"
+    "    def render(self):\n"
+    "        return '<p>' + self.{field} + '</p>'\n",
+    "def {name}(user, {field}):\n"
+    "    if user.is_admin or {field} == {number}:\n"
+    "        return {table}.objects.all()\n"
+    "    return {table}.objects.filter(owner=user)\n",
+)
+WORDS = (
+    "user account order invoice token session report item price stock "
+    "payment profile record audit cart ticket".split()
+)
+
+
+class JwksStub:
+    """Local JWKS endpoint and the RSA key that signs the load test tokens."""
+
+    def __init__(self):
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.key.public_key()))
+        body = json.dumps(
+            {"keys": [{**jwk, "kid": KEY_ID, "alg": "RS256", "use": "sig"}]}
+        ).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/.well-known/jwks.json"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def token(self, subject: str, scope: str = "openid", ttl: int = 86400) -> str:
+        now = int(time.time())
+        claims = {
+            "sub": subject,
+            "scope": scope,
+            "iss": f"https://{DOMAIN}/",
+            "aud": AUDIENCE,
+            "iat": now,
+            "exp": now + ttl,
+        }
+        return jwt.encode(claims, self.key, algorithm="RS256", headers={"kid": KEY_ID})
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+class Workload:
+    """Random /evaluate requests of a team of developers.
+
+    Sizes are `lines:weight` pairs. A share of the requests resends a snippet
+    already sent (`duplicate_rate`, as re-runs of a hook on the same commit) or
+    one with a single line changed (`near_duplicate_rate`).
+    """
+
+    def __init__(
+        self,
+        tokens: list,
+        sizes: list,
+        duplicate_rate: float,
+        near_duplicate_rate: float,
+        seed: int,
+        history_size: int = 500,
+    ):
+        self.tokens = tokens
+        self.sizes = sizes
+        self.duplicate_rate = duplicate_rate
+        self.near_duplicate_rate = near_duplicate_rate
+        self.random = random.Random(seed)
+        self.history = []
+        self.history_size = history_size
+        self.counters = Counter()
+
+    def _snippet(self, lines: int) -> str:
+        parts, count = [], 0
+        while count < lines:
+            part = self.random.choice(TEMPLATES).format(
+                name=f"{self.random.choice(WORDS)}_{uuid.uuid4().hex[:8]}",
+                title=f"{self.random.choice(WORDS).title()}{uuid.uuid4().hex[:6]}",
+                field=self.random.choice(WORDS),
+                table=self.random.choice(WORDS),
+                number=self.random.randint(1, 1000),
+            )
+            parts.append(part)
+            count += part.count("\n") + 1
+        return "\n".join(parts)
+
+    def next_request(self) -> tuple[str, dict]:
+        draw = self.random.random()
+        if self.history and draw < self.duplicate_rate:
+            kind, code = "duplicate", self.random.choice(self.history)
+        elif self.history and draw < self.duplicate_rate + self.near_duplicate_rate:
+            kind = "near_duplicate"
+            lines = self.random.choice(self.history).split("\n")
+            index = self.random.randrange(len(lines))
+            lines[index] += f"  # {uuid.uuid4().hex[:6]}"
+            code = "\n".join(lines)
+        else:
+            kind = "unique"
+            weights = [weight for _, weight in self.sizes]
+            lines = self.random.choices(self.sizes, weights)[0][0]
+            code = self._snippet(lines)
+            self.history.append(code)
+            if len(self.history) > self.history_size:
+                self.history.pop(0)
+        self.counters[kind] += 1
+        body = {
+            "code": code,
+            "path": f"app/{self.random.choice(WORDS)}.py",
+            "repository": f"repo-{self.random.randint(1, 20)}",
+        }
+        return self.random.choice(self.tokens), body
+
+
+def to_ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, ratio: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def process_tree_cpu(pid: int) -> tuple[float, float]:
+    """CPU seconds and resident MB of a process and its children (Linux)."""
+    ticks, page_mb = os.sysconf("SC_CLK_TCK"), os.sysconf("SC_PAGE_SIZE") / 2**20
+    cpu = rss = 0.0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # Fields after the command: state, ppid, ... utime (12), stime (13)
+        if int(entry) == pid or int(fields[1]) == pid:
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            rss += int(fields[21]) * page_mb
+    return cpu, rss
+
+
+def lane_capacity(config: dict) -> int:
+    """Model calls the default lane can run at once in one app worker."""
+    lanes = config["lanes"]
+    lane = lanes["lanes"][lanes["default"]]
+    shared = lanes["total_concurrency"] - sum(
+        other.get("reserved", 0) for other in lanes["lanes"].values()
+    )
+    capacity = lane.get("reserved", 0) + shared
+    return min(capacity, lane.get("max_concurrency") or capacity)
+
+
+def build_config(directory: str, model_url: str) -> str:
+    """Copy of the service configuration with every rule on the stub model."""
+    with open(CONFIG_PATH) as file:
+        config = json.load(file)
+    for rule in config["rules"].values():
+        rule["model_config"] = {
+            **rule.get("model_config", {}),
+            "model_id": "stub",
+            "client_args": {"api_key": "load-test", "base_url": f"{model_url}/v1"},
+        }
+    # Nothing is recorded nor warmed during a load test
+    config.get("model_replay", {})["mode"] = "live"
+    config.get("prefetch", {}).pop("warming", None)
+    path = os.path.join(directory, "configs.json")
+    with open(path, "w") as file:
+        json.dump(config, file)
+    return path
+
+
+def start_process(command: list, directory: str, env: dict, log_path: str):
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        command, cwd=directory, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, process) -> None:
+    deadline = time.perf_counter() + STARTUP_TIMEOUT_SECONDS
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            if (await client.get(url, timeout=2)).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not start in {STARTUP_TIMEOUT_SECONDS} s")
+
+
+class Monitor:
+    """Samples the resources of the app every second during a stage."""
+
+    def __init__(self, client, app_url, model_url, app_pid, admin_token):
+        self.client = client
+        self.app_url = app_url
+        self.model_url = model_url
+        self.app_pid = app_pid
+        self.headers = {"Authorization": f"Bearer {admin_token}"}
+        self.loop_lags, self.in_flight, self.queued, self.rss = [], [], [], []
+
+    async def run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            try:
+                # The root endpoint does no work, its latency is the loop lag
+                await self.client.get(f"{self.app_url}/", timeout=10)
+                self.loop_lags.append((time.perf_counter() - started) * 1000)
+                stats = (await self.client.get(f"{self.model_url}/stats")).json()
+                self.in_flight.append(stats["max_in_flight"])
+                lanes = (
+                    await self.client.get(f"{self.app_url}/lanes", headers=self.headers)
+                ).json()
+                self.queued.append(
+                    sum(lane["queued"] for lane in lanes["lanes"].values())
+                )
+            except (httpx.HTTPError, KeyError, ValueError):
+                pass
+            self.rss.append(process_tree_cpu(self.app_pid)[1])
+            await asyncio.sleep(
+                max(0, MONITOR_INTERVAL_SECONDS - (time.perf_counter() - started))
+            )
+
+
+async def run_stage(client, workload, monitor, concurrency: int, args) -> dict:
+    latencies, statuses = [], Counter()
+    deadline = time.perf_counter() + args.stage_seconds
+
+    async def developer():
+        while time.perf_counter() < deadline:
+            token, body = workload.next_request()
+            started = time.perf_counter()
+            try:
+                response = await client.post(
+                    f"{monitor.app_url}/evaluate",
+                    json=body,
+                    headers={"Authorization": f"Bearer {token}"},
+                    timeout=args.request_timeout,
+                )
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            statuses[status] += 1
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            elif status == 503:
+                # A hook backs off when the service sheds load
+                await asyncio.sleep(1)
+
+    calls_before = (await client.get(f"{monitor.model_url}/stats")).json()["requests"]
+    app_cpu_before = process_tree_cpu(monitor.app_pid)[0]
+    own_cpu_before = time.process_time()
+    started = time.perf_counter()
+    task = asyncio.create_task(monitor.run())
+    await asyncio.gather(*(developer() for _ in range(concurrency)))
+    task.cancel()
+    elapsed = time.perf_counter() - started
+    calls = (await client.get(f"{monitor.model_url}/stats")).json()["requests"]
+
+    requests = sum(statuses.values())
+    errors = {str(status): n for status, n in statuses.items() if status != 200}
+    p95 = percentile(latencies, 0.95)
+    error_rate = sum(errors.values()) / requests if requests else 0.0
+    stage = {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 1),
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(error_rate, 4),
+        "rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": to_ms(percentile(latencies, 0.5)),
+        "p90_ms": to_ms(percentile(latencies, 0.9)),
+        "p95_ms": to_ms(p95),
+        "p99_ms": to_ms(percentile(latencies, 0.99)),
+        "max_ms": to_ms(max(latencies, default=None)),
+        "model_calls": calls - calls_before,
+        "model_max_in_flight": max(monitor.in_flight, default=0),
+        "lane_queued_max": max(monitor.queued, default=0),
+        "lane_queued_mean": round(
+            sum(monitor.queued) / len(monitor.queued) if monitor.queued else 0, 1
+        ),
+        "loop_lag_p95_ms": round(percentile(monitor.loop_lags, 0.95) or 0, 1),
+        "app_cpu_cores": round(
+            (process_tree_cpu(monitor.app_pid)[0] - app_cpu_before) / elapsed, 2
+        ),
+        "app_rss_mb": round(max(monitor.rss, default=0), 1),
+        "generator_cpu_cores": round(
+            (time.process_time() - own_cpu_before) / elapsed, 2
+        ),
+    }
+    stage["meets_slo"] = bool(
+        latencies
+        and percentile(latencies, args.slo_percentile / 100) <= args.slo_seconds
+        and error_rate <= args.max_error_rate
+    )
+    return stage
+
+
+def saturation(stages: list, slots: int, app_workers: int) -> dict:
+    """First stage (by concurrency) where each resource reached its limit."""
+    checks = {
+        "event_loop": lambda s: s["loop_lag_p95_ms"] >= LOOP_LAG_LIMIT_MS,
+        # A worker uses one core at most, the machine may have fewer
+        "app_cpu": lambda s: s["app_cpu_cores"]
+        >= CPU_LIMIT_CORES * min(app_workers, os.cpu_count() or 1),
+        "model_slots": lambda s: s["model_max_in_flight"] >= slots * app_workers,
+        "lane_queue": lambda s: s["lane_queued_mean"] >= 1,
+        "admission": lambda s: s["errors"].get("503", 0) > 0,
+        "latency_slo": lambda s: not s["meets_slo"],
+        # Past this the generator, not the app, limits the results
+        "load_generator": lambda s: s["generator_cpu_cores"] >= CPU_LIMIT_CORES,
+    }
+    return {
+        resource: next((s["concurrency"] for s in stages if check(s)), None)
+        for resource, check in checks.items()
+    }
+
+
+def print_stage(stage: dict) -> None:
+    print(
+        f"{stage['concurrency']:>6} {stage['rps']:>8} {stage['p50_ms'] or '-':>9} "
+        f"{stage['p95_ms'] or '-':>9} {stage['p99_ms'] or '-':>9} "
+        f"{stage['error_rate']:>7} {stage['app_cpu_cores']:>5} "
+        f"{stage['loop_lag_p95_ms']:>8} {stage['model_max_in_flight']:>6} "
+        f"{stage['lane_queued_mean']:>7} {'yes' if stage['meets_slo'] else 'no':>4}",
+        flush=True,
+    )
+
+
+async def run(args) -> dict:
+    directory = tempfile.mkdtemp(prefix="load-test-")
+    jwks = JwksStub()
+    model_port, app_port = free_port(), free_port()
+    model_url = f"http://127.0.0.1:{model_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    config_path = build_config(directory, model_url)
+    with open(config_path) as file:
+        slots = lane_capacity(json.load(file))
+    env = {
+        **os.environ,
+        "PYTHONPATH": ROOT,
+        "CONFIG_PATH": config_path,
+        "OPENAI_API_KEY": "load-test",
+        "AUTH0_DOMAIN": DOMAIN,
+        "AUTH0_AUDIENCE": AUDIENCE,
+        "AUTH0_ISSUER": f"https://{DOMAIN}/",
+        "AUTH0_ALGORITHMS": "RS256",
+        "AUTH0_JWKS_URL": jwks.url,
+    }
+    model = start_process(
+        [
+            sys.executable,
+            "-m",
+            "scripts.stub_openai_server",
+            "--port",
+            str(model_port),
+            "--latency",
+            str(args.model_latency),
+            "--jitter",
+            str(args.model_jitter),
+        ],
+        ROOT,
+        env,
+        os.path.join(directory, "model.log"),
+    )
+    app = start_process(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "src.app:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(app_port),
+            "--workers",
+            str(args.app_workers),
+            "--log-level",
+            "warning",
+        ],
+        directory,
+        env,
+        os.path.join(directory, "app.log"),
+    )
+    tokens = [jwks.token(f"developer-{index}") for index in range(args.developers)]
+    workload = Workload(
+        tokens,
+        [
+            (int(lines), float(weight))
+            for lines, weight in (size.split(":") for size in args.sizes.split(","))
+        ],
+        args.duplicate_rate,
+        args.near_duplicate_rate,
+        args.seed,
+    )
+    stages = []
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    try:
+        async with httpx.AsyncClient(limits=limits) as client:
+            await wait_ready(client, f"{model_url}/stats", model)
+            await wait_ready(client, f"{app_url}/", app)
+            monitor_args = (client, app_url, model_url, app.pid, jwks.token("load"))
+            print(f"Logs in {directory}")
+            print(
+                f"{'conc':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+                f"{'errors':>7} {'cpu':>5} {'lag ms':>8} {'model':>6} "
+                f"{'queued':>7} {'slo':>4}"
+            )
+            for concurrency in [int(value) for value in args.stages.split(",")]:
+                monitor = Monitor(*monitor_args)
+                stage = await run_stage(client, workload, monitor, concurrency, args)
+                stages.append(stage)
+                print_stage(stage)
+                if not stage["meets_slo"] and not args.keep_going:
+                    break
+    finally:
+        for process in (app, model):
+            process.terminate()
+        for process in (app, model):
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        jwks.close()
+
+    sustainable = [stage for stage in stages if stage["meets_slo"]]
+    best = max(sustainable, key=lambda stage: stage["rps"], default=None)
+    return {
+        "slo": {
+            "seconds": args.slo_seconds,
+            "percentile": args.slo_percentile,
+            "max_error_rate": args.max_error_rate,
+        },
+        "workload": {
+            "developers": args.developers,
+            "sizes": args.sizes,
+            "model_latency": args.model_latency,
+            "app_workers": args.app_workers,
+            "requests": dict(workload.counters),
+        },
+        "max_sustainable_rps": best["rps"] if best else None,
+        "max_sustainable_concurrency": best["concurrency"] if best else None,
+        "saturation": saturation(stages, slots, args.app_workers),
+        "stages": stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stages", default="1,2,4,8,16,32,64,128,256")
+    parser.add_argument("--stage-seconds", type=float, default=30)
+    parser.add_argument("--developers", type=int, default=300)
+    parser.add_argument(
+        "--sizes", default="20:0.6,120:0.3,600:0.1", help="Lines:weight pairs"
+    )
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--near-duplicate-rate", type=float, default=0.1)
+    parser.add_argument("--model-latency", type=float, default=1.0)
+    parser.add_argument("--model-jitter", type=float, default=0.3)
+    parser.add_argument("--app-workers", type=int, default=1)
+    parser.add_argument("--slo-seconds", type=float, default=30)
+    parser.add_argument("--slo-percentile", type=float, default=95)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument(
+        "--keep-going", action="store_true", help="Continue past the SLO breach"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Path of the JSON report")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(
+        f"\nMax sustainable: {report['max_sustainable_rps']} rps at concurrency "
+        f"{report['max_sustainable_concurrency']} (p{args.slo_percentile:g} <= "
+        f"{args.slo_seconds:g} s, errors <= {args.max_error_rate:.0%})"
+    )
+    print("Saturation (first concurrency at the limit):")
+    for resource, concurrency in report["saturation"].items():
+        print(f"  {resource:<15} {concurrency if concurrency else '-'}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
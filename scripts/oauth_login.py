@@ -4,13 +4,16 @@ OAuth2.0 + PKCE Authentication Script
 Etapa 1: Preparación PKCE y estructura base
 """
 
+import argparse
 import base64
 import hashlib
 import json
 import os
 import secrets
+import sys
 import threading
 import time
+from contextlib import contextmanager, redirect_stdout
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Dict, Optional
@@ -23,6 +26,17 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel, Field
 
+try:
+    import fcntl
+except ImportError:  # Windows, sin bloqueo entre procesos
+    fcntl = None
+
+# Con menos de este margen el token se renueva antes de usarlo
+REFRESH_MARGIN_SECONDS = 60
+# Con menos de este margen se usa el token y se renueva en segundo plano
+PROACTIVE_REFRESH_SECONDS = 600
+TOKEN_REQUEST_TIMEOUT_SECONDS = 10
+
 
 class PKCEParams(BaseModel):
     """Parámetros para el flujo PKCE"""
@@ -166,23 +180,45 @@ class TokenStorage:
         # Establecer permisos restrictivos (solo el usuario puede leer/escribir)
         os.chmod(self.config_dir, 0o700)
 
-    def save_tokens(self, tokens: TokenResponse) -> None:
-        """Guarda los tokens de forma segura"""
+        self.lock_file = self.config_dir / "tokens.lock"
+
+    def save_tokens(
+        self, tokens: TokenResponse, requested_at: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Guarda los tokens de forma segura
+
+        Args:
+            tokens: Respuesta del endpoint de tokens
+            requested_at: Momento en que se pidieron los tokens, la expiración
+                se cuenta desde ahí para no sobreestimarla
+
+        Si la respuesta no trae refresh token (sin rotación) se conserva el
+        guardado. El archivo se reemplaza de forma atómica, así otro proceso
+        nunca lee un archivo a medio escribir.
+        """
+        saved_at = time.time()
+        refresh_token = tokens.refresh_token
+        if refresh_token is None:
+            refresh_token = (self.load_tokens() or {}).get("refresh_token")
         token_data = {
             "access_token": tokens.access_token,
-            "refresh_token": tokens.refresh_token,
+            "refresh_token": refresh_token,
             "expires_in": tokens.expires_in,
             "token_type": tokens.token_type,
             "scope": tokens.scope,
-            "saved_at": secrets.token_hex(16),  # timestamp ofuscado para validación
+            "saved_at": saved_at,
+            "expires_at": (requested_at or saved_at) + tokens.expires_in,
         }
 
-        with open(self.token_file, "w") as f:
+        # Permisos restrictivos desde la creación del archivo
+        temporary = self.token_file.with_suffix(".tmp")
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w") as f:
             json.dump(token_data, f, indent=2)
-
-        # Establecer permisos restrictivos en el archivo
-        os.chmod(self.token_file, 0o600)
+        os.replace(temporary, self.token_file)
         print(f"✓ Tokens guardados en: {self.token_file}")
+        return token_data
 
     def load_tokens(self) -> Optional[Dict[str, Any]]:
         """Carga los tokens guardados"""
@@ -196,6 +232,32 @@ class TokenStorage:
             print(f"⚠ Error cargando tokens: {e}")
             return None
 
+    @staticmethod
+    def seconds_left(token_data: Dict[str, Any]) -> float:
+        """Segundos de vida del access token, 0 si no se sabe (archivos antiguos)"""
+        expires_at = token_data.get("expires_at")
+        if not isinstance(expires_at, (int, float)):
+            return 0
+        return expires_at - time.time()
+
+    @contextmanager
+    def refresh_lock(self):
+        """
+        Bloqueo entre procesos durante una renovación
+
+        Con rotación de refresh tokens, dos hooks que renuevan a la vez con el
+        mismo refresh token hacen que Auth0 revoque la familia completa.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_file, "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
     def clear_tokens(self) -> None:
         """Elimina los tokens guardados"""
         if self.token_file.exists():
@@ -213,6 +275,7 @@ class OAuth2PKCEFlow:
         self.authorization_code: Optional[str] = None
         self.callback_received = threading.Event()
         self.callback_error: Optional[str] = None
+        self.refresh_thread: Optional[threading.Thread] = None
 
     def build_authorization_url(self) -> str:
         """Construye la URL de autorización con parámetros PKCE"""
@@ -374,7 +437,12 @@ class OAuth2PKCEFlow:
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
         print("🔄 Intercambiando código por tokens...")
-        response = requests.post(token_url, data=token_data, headers=headers)
+        response = requests.post(
+            token_url,
+            data=token_data,
+            headers=headers,
+            timeout=TOKEN_REQUEST_TIMEOUT_SECONDS,
+        )
 
         if response.status_code != 200:
             error_msg = f"Error obteniendo tokens: {response.status_code}"
@@ -391,6 +459,120 @@ class OAuth2PKCEFlow:
 
         return TokenResponse(**token_json)
 
+    def refresh_tokens(self, refresh_token: str) -> Optional[TokenResponse]:
+        """
+        Obtiene tokens nuevos con el grant refresh_token
+
+        Retorna None si Auth0 rechaza el refresh token (revocado o vencido),
+        en ese caso solo queda el flujo con navegador. Los errores de red se
+        propagan, un refresh token válido no debe descartarse por ellos.
+        """
+        token_url = f"https://{self.config.domain}/oauth/token"
+        token_data = {
+            "grant_type": "refresh_token",
+            "client_id": self.config.client_id,
+            "refresh_token": refresh_token,
+        }
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+        response = requests.post(
+            token_url,
+            data=token_data,
+            headers=headers,
+            timeout=TOKEN_REQUEST_TIMEOUT_SECONDS,
+        )
+        if response.status_code in (400, 401, 403):
+            print(f"⚠ Refresh token rechazado: {response.status_code}")
+            return None
+        response.raise_for_status()
+        return TokenResponse(**response.json())
+
+    def _refresh_stored_tokens(self, min_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        Renueva los tokens guardados si les quedan menos de `min_seconds`
+
+        Bajo el bloqueo se vuelven a leer los tokens: si otro proceso ya los
+        renovó se usan esos sin llamar a Auth0.
+        """
+        with self.storage.refresh_lock():
+            token_data = self.storage.load_tokens()
+            if not token_data:
+                return None
+            if self.storage.seconds_left(token_data) > min_seconds:
+                return token_data
+            refresh_token = token_data.get("refresh_token")
+            if not refresh_token:
+                return None
+            requested_at = time.time()
+            tokens = self.refresh_tokens(refresh_token)
+            if tokens is None:
+                return None
+            print("✓ Tokens renovados con refresh token")
+            return self.storage.save_tokens(tokens, requested_at)
+
+    def _refresh_in_background(self) -> None:
+        def run():
+            try:
+                self._refresh_stored_tokens(PROACTIVE_REFRESH_SECONDS)
+            except Exception as e:
+                # El token actual sigue siendo válido, se reintenta en el próximo uso.
+                # A stderr: stdout puede llevar la salida del proceso
+                print(
+                    f"⚠ No se pudieron renovar los tokens en segundo plano: {e}",
+                    file=sys.stderr,
+                )
+
+        # No es daemon: el proceso espera a que termine antes de salir, mientras
+        # tanto el hook ya usa el token vigente
+        self.refresh_thread = threading.Thread(target=run, name="token-refresh")
+        self.refresh_thread.start()
+
+    def get_access_token(
+        self, interactive: bool = True, background_refresh: bool = True
+    ) -> Optional[str]:
+        """
+        Access token válido, por el camino más barato posible
+
+        1. Token guardado con más de PROACTIVE_REFRESH_SECONDS de vida: se usa
+           sin tocar la red.
+        2. Token cerca de expirar pero con más de REFRESH_MARGIN_SECONDS: se
+           usa y se renueva en segundo plano. Con `background_refresh=False`
+           se renueva antes de retornar, y si falla se usa el vigente.
+        3. Token vencido o sin expiración conocida: se renueva con el refresh
+           token antes de usarlo.
+        4. Solo si no hay forma de renovar se abre el flujo con navegador (y
+           su servidor de callback), salvo con `interactive=False`.
+        """
+        token_data = self.storage.load_tokens()
+        if token_data:
+            seconds_left = self.storage.seconds_left(token_data)
+            if seconds_left > PROACTIVE_REFRESH_SECONDS:
+                return token_data["access_token"]
+            min_seconds = REFRESH_MARGIN_SECONDS
+            if seconds_left > REFRESH_MARGIN_SECONDS and token_data.get(
+                "refresh_token"
+            ):
+                if background_refresh:
+                    self._refresh_in_background()
+                    return token_data["access_token"]
+                min_seconds = PROACTIVE_REFRESH_SECONDS
+            try:
+                refreshed = self._refresh_stored_tokens(min_seconds)
+            except requests.exceptions.RequestException as e:
+                print(f"⚠ Error renovando tokens: {e}")
+                refreshed = None
+            if refreshed:
+                return refreshed["access_token"]
+            if seconds_left > REFRESH_MARGIN_SECONDS:
+                return token_data["access_token"]
+
+        if not interactive:
+            return None
+        if not self.run_authentication_flow():
+            return None
+        token_data = self.storage.load_tokens()
+        return token_data["access_token"] if token_data else None
+
     def test_api_connection(self, access_token: str) -> bool:
         """Prueba la conexión con la API usando el access token"""
         # Esta es una prueba básica - ajustar según tu API
@@ -452,10 +634,11 @@ class OAuth2PKCEFlow:
                 return False
 
             # Paso 5: Intercambiar código por tokens
+            requested_at = time.time()
             tokens = self.exchange_code_for_tokens(self.authorization_code)
 
             # Paso 6: Guardar tokens
-            self.storage.save_tokens(tokens)
+            self.storage.save_tokens(tokens, requested_at)
 
             # Paso 7: Probar conexión con API
             self.test_api_connection(tokens.access_token)
@@ -470,6 +653,36 @@ class OAuth2PKCEFlow:
 
 def main():
     """Función principal para testing"""
+    parser = argparse.ArgumentParser(description="Autenticación OAuth2.0 + PKCE")
+    parser.add_argument(
+        "--token",
+        action="store_true",
+        help="Imprime solo un access token válido (para el pre-commit hook)",
+    )
+    parser.add_argument(
+        "--login",
+        action="store_true",
+        help="Fuerza el flujo con navegador aunque haya tokens guardados",
+    )
+    args = parser.parse_args()
+
+    if args.token:
+        # Los mensajes van a stderr, stdout lleva solo el token. La renovación
+        # es síncrona: un hilo que siguiera después del bloque escribiría en
+        # stdout junto al token
+        with redirect_stdout(sys.stderr):
+            try:
+                access_token = OAuth2PKCEFlow(
+                    Auth0Config.load_from_env()
+                ).get_access_token(background_refresh=False)
+            except ValueError as e:
+                print(f"❌ Error de configuración: {e}")
+                access_token = None
+        if not access_token:
+            sys.exit(1)
+        print(access_token)
+        return
+
     try:
         # Cargar configuración desde variables de entorno
         config = Auth0Config.load_from_env()
@@ -489,15 +702,14 @@ def main():
     # Crear instancia del flujo OAuth
     oauth_flow = OAuth2PKCEFlow(config)
 
-    # Verificar si ya tenemos tokens válidos
+    # Verificar si ya tenemos tokens válidos, o renovables sin navegador
     existing_tokens = oauth_flow.storage.load_tokens()
-    if existing_tokens:
+    if existing_tokens and not args.login:
         print("🔍 Tokens existentes encontrados")
-        # Aquí podrías implementar lógica para verificar si el access token aún es válido
-        # Por ahora, procedemos con nueva autenticación
-
-    # Ejecutar flujo completo de autenticación
-    success = oauth_flow.run_authentication_flow()
+        success = oauth_flow.get_access_token() is not None
+    else:
+        # Ejecutar flujo completo de autenticación
+        success = oauth_flow.run_authentication_flow()
 
     if success:
         print("\n✅ Proceso completado exitosamente")
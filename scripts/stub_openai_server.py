@@ -0,0 +1,124 @@
+"""Stub of an OpenAI compatible chat completions endpoint.
+
+Answers every request with a streamed "no vulnerabilities" response after a
+configurable latency, and fails a share of them, so backend pools can be
+exercised locally without a real model. `GET /stats` counts the requests and
+the peak of requests in flight since the previous read.
+
+Usage (from the repository root):
+    uv run python -m scripts.stub_openai_server --port 8101 --latency 0.2
+    uv run python -m scripts.stub_openai_server --port 8102 --latency 1 --error-rate 0.5
+
+Then point the backends of a rule to them, e.g.
+    {"model_id": "stub", "client_args": {"base_url": "http://localhost:8101/v1"}}
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+RESPONSE = "```yaml\nvulnerabilities_detected: []\n```"
+
+
+def build_app(
+    latency: float,
+    error_rate: float,
+    response: str = RESPONSE,
+    jitter: float = 0.0,
+) -> FastAPI:
+    app = FastAPI()
+    stats = {"requests": 0, "in_flight": 0, "max_in_flight": 0}
+
+    @app.get("/stats")
+    async def get_stats():
+        current = dict(stats)
+        stats["max_in_flight"] = stats["in_flight"]
+        return current
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            # The latency varies by up to `jitter` of itself
+            await asyncio.sleep(latency * (1 + random.uniform(-jitter, jitter)))
+        finally:
+            stats["in_flight"] -= 1
+        if random.random() < error_rate:
+            return JSONResponse(
+                status_code=503,
+                content={"error": {"message": "stub failure", "type": "server_error"}},
+            )
+        created, model = int(time.time()), body.get("model", "stub")
+        prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+        completion_tokens = len(response) // 4
+
+        def chunk(choices: list, **extra) -> str:
+            payload = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices,
+                **extra,
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        def events():
+            yield chunk(
+                [
+                    {
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": response},
+                        "finish_reason": None,
+                    }
+                ]
+            )
+            yield chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            yield chunk(
+                [],
+                usage={
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            )
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument(
+        "--latency", type=float, default=0.2, help="Seconds before answering"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of requests failing"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Relative variation of the latency"
+    )
+    args = parser.parse_args()
+    uvicorn.run(
+        build_app(args.latency, args.error_rate, jitter=args.jitter),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Script used to shed load before the backlog of model calls grows unbounded"""
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+# Constants
+CHARS_PER_TOKEN = 4
+DEFAULT_LANE_SHARES = {"interactive": 1.0, "ci": 0.8, "bulk": 0.5, "prefetch": 0.25}
+
+
+class OverloadedError(Exception):
+    """Raised when a request does not fit in the backlog."""
+
+    def __init__(self, retry_after: int, reason: str):
+        self.retry_after = retry_after
+        super().__init__(f"Service overloaded ({reason}), retry in {retry_after}s")
+
+
+class AdmissionTicket:
+    """Cost of an admitted request, returned to the backlog once it finishes."""
+
+    def __init__(self, controller: "AdmissionController", lane: str, calls, tokens):
+        self.controller = controller
+        self.lane = lane
+        self.calls = calls
+        self.tokens = tokens
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """Admission control with a backlog bounded in estimated tokens and rule calls.
+
+    A request is admitted only if its estimated cost fits in the backlog left
+    for its lane (`lane_shares` of the limits, so bulk work is shed before
+    interactive work), and if the backlog ahead of it drains within
+    `max_wait_seconds`. Otherwise it is shed with a `retry_after` computed from
+    the measured drain rate, which keeps the latency of the admitted requests
+    stable instead of queueing everyone until they time out.
+    """
+
+    def __init__(
+        self,
+        max_backlog_tokens: int = 200_000,
+        max_backlog_calls: int = 200,
+        max_wait_seconds: Optional[float] = 30,
+        lane_shares: Optional[dict] = None,
+        rate_window_seconds: float = 60,
+        default_retry_after: int = 5,
+        max_retry_after: int = 120,
+    ):
+        self.max_backlog_tokens = max_backlog_tokens
+        self.max_backlog_calls = max_backlog_calls
+        self.max_wait_seconds = max_wait_seconds
+        self.lane_shares = lane_shares or DEFAULT_LANE_SHARES
+        self.rate_window_seconds = rate_window_seconds
+        self.default_retry_after = default_retry_after
+        self.max_retry_after = max_retry_after
+        self.backlog_tokens = 0
+        self.backlog_calls = 0
+        self.admitted = {}
+        self.shed = {}
+        self._completions = deque()
+        self._lock = threading.Lock()
+
+    def admit(self, lane: str, calls: int, tokens: int) -> AdmissionTicket:
+        """Reserve room for a request or raise OverloadedError."""
+        share = self.lane_shares.get(lane, 1.0)
+        with self._lock:
+            rate = self._drain_rate()
+            reason = None
+            if self.backlog_calls + calls > self.max_backlog_calls * share:
+                reason = "rule call backlog full"
+            elif self.backlog_tokens + tokens > self.max_backlog_tokens * share:
+                reason = "token backlog full"
+            elif (
+                self.max_wait_seconds is not None
+                and rate
+                and self.backlog_tokens / rate > self.max_wait_seconds
+            ):
+                reason = "backlog wait too long"
+            # An idle service always admits, whatever the request size
+            if reason is not None and self.backlog_calls > 0:
+                self.shed[lane] = self.shed.get(lane, 0) + 1
+                raise OverloadedError(self._retry_after(tokens, share, rate), reason)
+            self.backlog_calls += calls
+            self.backlog_tokens += tokens
+            self.admitted[lane] = self.admitted.get(lane, 0) + 1
+        return AdmissionTicket(self, lane, calls, tokens)
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        with self._lock:
+            self.backlog_calls -= ticket.calls
+            self.backlog_tokens -= ticket.tokens
+            self._completions.append((time.monotonic(), ticket.tokens))
+
+    def _drain_rate(self) -> Optional[float]:
+        """Tokens per second completed over the recent window."""
+        now = time.monotonic()
+        while (
+            self._completions
+            and now - self._completions[0][0] > self.rate_window_seconds
+        ):
+            self._completions.popleft()
+        if not self._completions:
+            return None
+        elapsed = max(now - self._completions[0][0], 1.0)
+        return sum(tokens for _, tokens in self._completions) / elapsed
+
+    def _retry_after(self, tokens: int, share: float, rate: Optional[float]) -> int:
+        """Seconds until the backlog drained enough for the request to fit."""
+        if not rate:
+            return self.default_retry_after
+        excess = self.backlog_tokens + tokens - self.max_backlog_tokens * share
+        if self.max_wait_seconds is not None:
+            excess = max(excess, self.backlog_tokens - self.max_wait_seconds * rate)
+        return min(max(math.ceil(excess / rate), 1), self.max_retry_after)
+
+    def stats(self) -> dict:
+        with self._lock:
+            rate = self._drain_rate()
+            return {
+                "backlog_tokens": self.backlog_tokens,
+                "backlog_calls": self.backlog_calls,
+                "max_backlog_tokens": self.max_backlog_tokens,
+                "max_backlog_calls": self.max_backlog_calls,
+                "drain_tokens_per_second": round(rate, 1) if rate else None,
+                "admitted": dict(self.admitted),
+                "shed": dict(self.shed),
+            }
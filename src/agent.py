@@ -1,11 +1,18 @@
 """Agent script to analyze code againt OWASP top 10"""
 
 import asyncio
+import logging
 import os
+from typing import Callable, Optional
 
 from strands import Agent
 from strands.models import Model
 
+from .findings import split_findings
+from .minify import MinifiedCode
+
+logger = logging.getLogger(__name__)
+
 
 class OwaspAgent:
     """Base class for OWASP agents."""
@@ -16,36 +23,88 @@ class OwaspAgent:
         system_prompt: str,
         user_prompt_template: str,
         owasp_name: str,
+        prompt_selector: Optional[Callable[[str], str]] = None,
+        minifier: Optional[Callable[[str], MinifiedCode]] = None,
     ):
-        self.agent = Agent(
-            model=model,
-            system_prompt=system_prompt,
-            callback_handler=None,
-        )
+        self.model = model
+        self.system_prompt = system_prompt
         self.user_prompt_template = user_prompt_template
         self.owasp_name = owasp_name
+        # Builds the system prompt from the code, the full prompt when None
+        self.prompt_selector = prompt_selector
+        # Shrinks the code sent to the model, findings are mapped back
+        self.minifier = minifier
 
     def run_inference(self, code_snippet: str) -> dict:
         """Function to run the agent inference on a given code snippet."""
         # Log action start
-        print(f"Starting run for agent: {self.owasp_name}")
+        logger.debug("Starting rule call", extra={"rule": self.owasp_name})
+        minified = self.minifier(code_snippet) if self.minifier else None
+        if minified is not None:
+            code_snippet = minified.text
         # 1. Format the user inputs
         user_prompt = self.user_prompt_template.format(
             code_snippet=code_snippet,
             owasp_name=self.owasp_name,
         ).strip()
-        # Call the inference
-        response = self.agent(user_prompt)
+        # Call the inference on a fresh agent, so concurrent calls don't share
+        # (and keep growing) the same conversation history
+        agent = Agent(
+            model=self.model,
+            system_prompt=(
+                self.system_prompt
+                if self.prompt_selector is None
+                else self.prompt_selector(code_snippet)
+            ),
+            callback_handler=None,
+        )
+        response = agent(user_prompt)
+        text = str(response)
         # Process output metrics
         usage_metrics = {
             **response.metrics.accumulated_usage,
             "latencyMs": round(sum(response.metrics.cycle_durations) * 1000, 0),
         }
+        if minified is not None:
+            # Lines of the minified code back to the lines of the snippet
+            text = minified.remap(text)
+            usage_metrics.update(minified.metrics())
         # Prepare the payload
         payload = {
             "owasp_name": self.owasp_name,
-            "response": str(response),
-            "pass": "suggested_fix:" not in str(response),
+            "response": text,
+            "pass": self.is_pass(text),
             "metrics": usage_metrics,
         }
+        logger.info(
+            "Rule call finished",
+            extra={
+                "rule": self.owasp_name,
+                "pass": payload["pass"],
+                "latency_ms": usage_metrics["latencyMs"],
+                "input_tokens": usage_metrics.get("inputTokens"),
+                "output_tokens": usage_metrics.get("outputTokens"),
+            },
+        )
         return payload
+
+    @staticmethod
+    def is_pass(response: str) -> bool:
+        """Whether a response reports no vulnerabilities."""
+        return "suggested_fix:" not in response
+
+
+class OwaspVerdictAgent(OwaspAgent):
+    """Agent that only answers the vulnerable lines, without description nor fix.
+
+    Used for the fast first phase: output tokens dominate the latency, so the
+    verdict runs with a small `max_tokens` and the full explanation is only
+    generated for the failing rules.
+    """
+
+    @staticmethod
+    def is_pass(response: str) -> bool:
+        blocks = split_findings(response)
+        if blocks is None:
+            return "line:" not in response
+        return not blocks
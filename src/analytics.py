@@ -0,0 +1,213 @@
+"""Script used to maintain the analytics rollups for the AppSec dashboard"""
+
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from .findings import split_findings
+
+# Constants
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rule_daily_rollup (
+    day TEXT NOT NULL,
+    rule TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    user TEXT NOT NULL,
+    evaluations INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    vulnerabilities INTEGER NOT NULL DEFAULT 0,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, rule, repository, user)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS evaluation_daily_rollup (
+    day TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    user TEXT NOT NULL,
+    evaluations INTEGER NOT NULL DEFAULT 0,
+    passed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, repository, user)
+) WITHOUT ROWID;
+"""
+RULE_UPSERT = """
+INSERT INTO rule_daily_rollup (
+    day, rule, repository, user, evaluations, failures, vulnerabilities,
+    input_tokens, output_tokens, total_tokens, latency_ms
+) VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, rule, repository, user) DO UPDATE SET
+    evaluations = evaluations + 1,
+    failures = failures + excluded.failures,
+    vulnerabilities = vulnerabilities + excluded.vulnerabilities,
+    input_tokens = input_tokens + excluded.input_tokens,
+    output_tokens = output_tokens + excluded.output_tokens,
+    total_tokens = total_tokens + excluded.total_tokens,
+    latency_ms = latency_ms + excluded.latency_ms
+"""
+EVALUATION_UPSERT = """
+INSERT INTO evaluation_daily_rollup (day, repository, user, evaluations, passed)
+VALUES (?, ?, ?, 1, ?)
+ON CONFLICT (day, repository, user) DO UPDATE SET
+    evaluations = evaluations + 1,
+    passed = passed + excluded.passed
+"""
+GROUP_BY_COLUMNS = ("rule", "repository", "user", "day")
+UNKNOWN = "unknown"
+
+
+def count_findings(response: str) -> int:
+    """Count the vulnerabilities reported in an agent response.
+
+    Verdict-only responses list the vulnerable lines without a suggested fix,
+    so the findings are counted from the YAML items when it can be parsed.
+    """
+    blocks = split_findings(response)
+    return len(blocks) if blocks is not None else response.count("suggested_fix:")
+
+
+class AnalyticsStore:
+    """Incrementally maintained rollups of the evaluation results.
+
+    Every completed evaluation updates one row per rule in a daily rollup, so
+    dashboard queries only scan one row per (day, rule, repository, user)
+    instead of the raw evaluation history.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(ROLLUP_SCHEMA)
+
+    def record_evaluation(
+        self,
+        results: list,
+        repository: Optional[str] = None,
+        user: Optional[str] = None,
+        timestamp: Optional[datetime] = None,
+    ) -> None:
+        """Add the results of one evaluation to the rollup tables."""
+        day = (timestamp or datetime.now(timezone.utc)).date().isoformat()
+        repository = repository or UNKNOWN
+        user = user or UNKNOWN
+        rule_rows = []
+        for result in results:
+            metrics = result.get("metrics", {})
+            rule_rows.append(
+                (
+                    day,
+                    result["owasp_name"],
+                    repository,
+                    user,
+                    0 if result["pass"] else 1,
+                    count_findings(result.get("response", "")),
+                    metrics.get("inputTokens", 0),
+                    metrics.get("outputTokens", 0),
+                    metrics.get("totalTokens", 0),
+                    metrics.get("latencyMs", 0),
+                )
+            )
+        passed = all(result["pass"] for result in results)
+        with self._lock, self._connection:
+            self._connection.executemany(RULE_UPSERT, rule_rows)
+            self._connection.execute(
+                EVALUATION_UPSERT, (day, repository, user, int(passed))
+            )
+
+    def query(
+        self,
+        group_by: str = "rule",
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        repository: Optional[str] = None,
+        user: Optional[str] = None,
+    ) -> list:
+        """Aggregate the rule rollups between two ISO dates (both inclusive)."""
+        if group_by not in GROUP_BY_COLUMNS:
+            raise ValueError(
+                f"Invalid group_by '{group_by}', expected one of {GROUP_BY_COLUMNS}"
+            )
+        where, params = self._build_filters(start, end, repository, user)
+        sql = (
+            f"SELECT {group_by}, SUM(evaluations), SUM(failures), "
+            "SUM(vulnerabilities), SUM(input_tokens), SUM(output_tokens), "
+            "SUM(total_tokens), SUM(latency_ms) "
+            f"FROM rule_daily_rollup {where} GROUP BY {group_by} ORDER BY {group_by}"
+        )
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return [
+            {
+                group_by: key,
+                "evaluations": evaluations,
+                "failures": failures,
+                "vulnerabilities": vulnerabilities,
+                "pass_rate": round(1 - failures / evaluations, 4),
+                "inputTokens": input_tokens,
+                "outputTokens": output_tokens,
+                "totalTokens": total_tokens,
+                "avgLatencyMs": round(latency_ms / evaluations, 0),
+            }
+            for (
+                key,
+                evaluations,
+                failures,
+                vulnerabilities,
+                input_tokens,
+                output_tokens,
+                total_tokens,
+                latency_ms,
+            ) in rows
+        ]
+
+    def summary(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        repository: Optional[str] = None,
+        user: Optional[str] = None,
+    ) -> dict:
+        """Commit level pass rate between two ISO dates (both inclusive)."""
+        where, params = self._build_filters(start, end, repository, user)
+        sql = (
+            "SELECT COALESCE(SUM(evaluations), 0), COALESCE(SUM(passed), 0) "
+            f"FROM evaluation_daily_rollup {where}"
+        )
+        with self._lock:
+            evaluations, passed = self._connection.execute(sql, params).fetchone()
+        return {
+            "evaluations": evaluations,
+            "passed": passed,
+            "pass_rate": round(passed / evaluations, 4) if evaluations else None,
+        }
+
+    @staticmethod
+    def _build_filters(
+        start: Optional[str],
+        end: Optional[str],
+        repository: Optional[str],
+        user: Optional[str],
+    ) -> tuple[str, list]:
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("day >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("day <= ?")
+            params.append(end)
+        if repository is not None:
+            clauses.append("repository = ?")
+            params.append(repository)
+        if user is not None:
+            clauses.append("user = ?")
+            params.append(user)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
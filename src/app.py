@@ -1,12 +1,55 @@
 """Base API for the AntMan service
 Ref: https://auth0.com/blog/build-and-secure-fastapi-server-with-auth0/"""
 
+import asyncio
+import logging
 import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from datetime import date
+from functools import partial
+from typing import Optional
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Security
-from pydantic import BaseModel
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Security
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, ValidationError
 
+from .admission import OverloadedError
+from .analytics import GROUP_BY_COLUMNS, AnalyticsStore
+from .guardrails import PromptInjectionError
+from .ingest import (
+    NDJSON_MEDIA_TYPES,
+    DecodingRequest,
+    DecodingRoute,
+    IngestLimits,
+    iter_ndjson,
+)
+from .integrity import (
+    IntegrityIndex,
+    failed_hunks,
+    file_node,
+    parse_diff,
+    split_hunks,
+)
+from .lanes import LaneFullError
+from .logs import (
+    CORRELATION_HEADER,
+    correlation_id,
+    logging_stats,
+    new_correlation_id,
+)
+from .prefetch import CacheWarmer, Prefetcher
+from .profiler import (
+    PROFILE_HEADER,
+    PROFILE_SCOPE,
+    RequestProfile,
+    StackSampler,
+    current_profile,
+)
+from .pushes import evaluate_range, net_files, plan_range
 from .utils import get_env_variable
 from .workflow import OwaspWorkflow
 from .auth_utils import VerifyToken
@@ -14,8 +57,29 @@ from .auth_utils import VerifyToken
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="AntMan API", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the background prefetch workers and cache warming with the app."""
+    sampler.attach(asyncio.get_running_loop())
+    if prefetcher is not None:
+        prefetcher.start()
+        warmer.start()
+    yield
+    if prefetcher is not None:
+        await warmer.stop()
+        await prefetcher.stop()
+    # Let the pending writes of the served requests finish
+    if background_tasks:
+        await asyncio.wait(background_tasks)
+
+
+app = FastAPI(title="AntMan API", version="0.1.0", lifespan=lifespan)
+# Request bodies may come compressed, they are decoded and size checked as
+# they are received
+app.router.route_class = DecodingRoute
 auth = VerifyToken()
+logger = logging.getLogger(__name__)
 
 # Initialize the workflow
 try:
@@ -25,26 +89,240 @@ try:
     )
     workflow = OwaspWorkflow(CONFIG_PATH)
 except Exception as e:
-    print(f"Warning: Could not initialize OwaspWorkflow: {e}")
+    logger.warning("Could not initialize OwaspWorkflow: %s", e)
     workflow = None
+DecodingRequest.limits = IngestLimits.from_dict(
+    workflow.evaluation_config.get("ingest", {}) if workflow is not None else {}
+)
+
+# Initialize the prefetching, requests are never slowed down by it
+prefetcher = warmer = None
+prefetch_config = dict(
+    workflow.evaluation_config.get("prefetch", {}) if workflow is not None else {}
+)
+if prefetch_config.pop("enabled", False):
+    try:
+        warming_config = prefetch_config.pop("warming", {})
+        prefetcher = Prefetcher(workflow, **prefetch_config)
+        warmer = CacheWarmer(prefetcher, **warming_config)
+    except Exception as e:
+        logger.warning("Could not initialize Prefetcher: %s", e)
+        prefetcher = warmer = None
+
+# Initialize the stack sampler, it only runs while someone profiles
+try:
+    sampler = StackSampler(
+        **(
+            workflow.evaluation_config.get("profiler", {})
+            if workflow is not None
+            else {}
+        )
+    )
+except Exception as e:
+    logger.warning("Could not initialize StackSampler: %s", e)
+    sampler = StackSampler()
+
+# Initialize the index of the evaluated code, used to validate pushes
+try:
+    integrity = IntegrityIndex(get_env_variable("INTEGRITY_DB_PATH", "integrity.db"))
+except Exception as e:
+    logger.warning("Could not initialize IntegrityIndex: %s", e)
+    integrity = None
+
+# Writes to the stores that run after the response, drained on shutdown
+background_tasks = set()
+
+# Initialize the analytics rollups
+try:
+    analytics = AnalyticsStore(get_env_variable("ANALYTICS_DB_PATH", "analytics.db"))
+except Exception as e:
+    logger.warning("Could not initialize AnalyticsStore: %s", e)
+    analytics = None
+
+
+@app.middleware("http")
+async def correlate_request(request: Request, call_next):
+    """Tag every log line of a request, its rule calls included, with one id."""
+    request_id = new_correlation_id(request.headers.get(CORRELATION_HEADER))
+    token = correlation_id.set(request_id)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+        response.headers[CORRELATION_HEADER] = request_id
+        logger.info(
+            "Request served",
+            extra={
+                "method": request.method,
+                "path": request.url.path,
+                "status": response.status_code,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            },
+        )
+        return response
+    finally:
+        correlation_id.reset(token)
+
+
+async def request_profile(request: Request, auth_result=Security(auth.verify)):
+    """Opt-in profile of a request, its tasks and rule threads inherit it.
+
+    Started only once auth confirms the admin:profile scope, so other clients
+    cannot make the sampler run with the header.
+    """
+    profile = None
+    if (
+        request.headers.get(PROFILE_HEADER)
+        and PROFILE_SCOPE in auth_result.get("scope", "").split()
+    ):
+        profile = sampler.start_request()
+    current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        if profile is not None:
+            sampler.finish_request(profile)
 
 
 class CodeEvaluationRequest(BaseModel):
     code: str
+    repository: Optional[str] = None
+    language: Optional[str] = None
+    path: Optional[str] = None
+    lane: Optional[str] = None
 
 
 class CodeEvaluationResponse(BaseModel):
     result: list
     status: str = "success"
+    guardrail: Optional[dict] = None
+    evaluation_id: Optional[str] = None
+    language: Optional[str] = None
+    lane: Optional[str] = None
+    metrics: Optional[dict] = None
+
+
+class FilesEvaluationResponse(BaseModel):
+    files: list
+    status: str = "success"
+
+
+class CommitDiff(BaseModel):
+    id: str
+    diff: str
+
+
+class RangeEvaluationRequest(BaseModel):
+    commits: list[CommitDiff]
+    repository: Optional[str] = None
+    lane: Optional[str] = None
+
+
+class RangeEvaluationResponse(BaseModel):
+    commits: list
+    summary: dict
+    status: str = "success"
+    evaluation_id: Optional[str] = None
+
+
+class PrefetchResponse(BaseModel):
+    status: str
+    language: Optional[str] = None
+
+
+class EvaluationDetailsResponse(BaseModel):
+    result: list
+    status: str = "success"
+
+
+class PushedFile(BaseModel):
+    path: str
+    code: str
 
 
 class CommitValidationRequest(BaseModel):
-    hash: str
+    hash: Optional[str] = None
+    diff: Optional[str] = None
+    files: Optional[list[PushedFile]] = None
+    repository: Optional[str] = None
 
 
 class CommitValidationResponse(BaseModel):
     result: list
     status: str = "success"
+    root: Optional[str] = None
+    unevaluated: list = []
+    evaluations: list = []
+
+
+class SchedulerResponse(BaseModel):
+    plan: list
+    stats: list
+    recent: list
+    status: str = "success"
+
+
+class AnalyticsResponse(BaseModel):
+    result: list
+    summary: dict
+    status: str = "success"
+
+
+def run_in_background(description: str, function, *args) -> None:
+    """Run a store write in the executor without making the request wait."""
+
+    async def run():
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, function, *args)
+        except Exception as e:
+            logger.warning("Could not %s: %s", description, e)
+
+    task = asyncio.create_task(run())
+    # Keep a reference until it is done, the loop only holds weak ones
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+def record_analytics(result: list, repository: Optional[str], auth_result):
+    """Update the analytics rollups without blocking the event loop."""
+    run_in_background(
+        "record analytics",
+        analytics.record_evaluation,
+        result,
+        repository,
+        auth_result.get("sub"),
+    )
+
+
+def record_integrity(
+    evaluation_id: str,
+    files: list,
+    passed: bool,
+    failed: set,
+    repository: Optional[str],
+    auth_result,
+):
+    """Index the evaluated hunks and their verdicts without blocking the event loop."""
+    run_in_background(
+        "record the evaluated hunks",
+        integrity.record_evaluation,
+        evaluation_id,
+        files,
+        passed,
+        repository,
+        auth_result.get("sub"),
+        workflow.ruleset_signature,
+        failed,
+    )
+
+
+def resolve_lane(requested: Optional[str], auth_result) -> str:
+    """Priority lane of a request, from the token scopes and the request."""
+    try:
+        return workflow.lanes.resolve(requested, auth_result.get("scope", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
 
 
 @app.get("/")
@@ -61,26 +339,343 @@ async def health_check(auth_result: str = Security(auth.verify)):
 async def evaluate_code(
     request: CodeEvaluationRequest,
     auth_result: str = Security(auth.verify),
+    profile: Optional[RequestProfile] = Depends(request_profile),
 ):
     """
-    Evaluate code snippet using the OWASP workflow
+    Evaluate code snippet using the OWASP workflow. With the `X-Profile`
+    header and the admin:profile scope, `metrics.profile` tells where the time
+    of the request went
     """
+    evaluation = await evaluate_request(request, auth_result)
+    if profile is not None:
+        evaluation.metrics = {"profile": sampler.summary(profile)}
+    return evaluation
+
+
+@app.post("/evaluate/files", response_model=FilesEvaluationResponse)
+async def evaluate_files(
+    request: Request,
+    repository: Optional[str] = None,
+    lane: Optional[str] = None,
+    auth_result: str = Security(auth.verify),
+):
+    """
+    Evaluate the files of an NDJSON upload, one `{"path", "code"}` object per
+    line, each one as soon as it is received
+    """
+    if workflow is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: OWASP workflow not initialized",
+        )
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if media_type not in NDJSON_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=415, detail=f"Expected one of {NDJSON_MEDIA_TYPES}"
+        )
+
+    limits = request.limits
+    # Bounds the files held in memory: reading waits while all slots are busy
+    slots = asyncio.Semaphore(limits.max_concurrent_files)
+
+    async def evaluate_file(file: CodeEvaluationRequest) -> dict:
+        try:
+            evaluation = await evaluate_request(file, auth_result)
+            return {
+                "path": file.path,
+                "status": evaluation.status,
+                "evaluation": evaluation.model_dump(),
+            }
+        except HTTPException as e:
+            return {
+                "path": file.path,
+                "status": "error",
+                "status_code": e.status_code,
+                "detail": e.detail,
+            }
+        finally:
+            slots.release()
+
+    tasks = []
+    try:
+        async for item in iter_ndjson(request.decoded_stream(), limits.max_file_bytes):
+            if len(tasks) >= limits.max_files:
+                raise HTTPException(
+                    status_code=413, detail=f"More than {limits.max_files} files"
+                )
+            try:
+                file = CodeEvaluationRequest(
+                    **{"repository": repository, "lane": lane, **item}
+                )
+            except ValidationError as e:
+                raise HTTPException(
+                    status_code=400, detail=e.errors(include_input=False)
+                )
+            await slots.acquire()
+            tasks.append(asyncio.create_task(evaluate_file(file)))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    files = await asyncio.gather(*tasks)
+    status_str = (
+        "success" if all(file["status"] == "success" for file in files) else "failed"
+    )
+    return FilesEvaluationResponse(files=files, status=status_str)
+
+
+async def evaluate_request(
+    request: CodeEvaluationRequest, auth_result: dict
+) -> CodeEvaluationResponse:
+    """Screen, admit and evaluate one snippet."""
     if workflow is None:
         raise HTTPException(
             status_code=503,
             detail="Service unavailable: OWASP workflow not initialized",
         )
 
+    # Screen the code before any model call
     try:
-        # Run the async inference with the provided code
-        result = await workflow.run_async_inference(request.code)
+        guardrail_result = workflow.guardrail.check(request.code)
+    except PromptInjectionError as e:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": str(e), "guardrail": e.result.to_dict()},
+        )
+
+    lane = resolve_lane(request.lane, auth_result)
+    # The language selects the rules that apply to the snippet
+    language = workflow.resolve_language(request.path, request.code, request.language)
+    if not workflow.rules_for(language):
+        # e.g. documentation: nothing to evaluate, skipped rather than passed
+        return CodeEvaluationResponse(
+            result=[], status="skipped", language=language, lane=lane
+        )
+    # Shed the request now rather than queue it beyond what can be served
+    try:
+        ticket = workflow.admission.admit(
+            lane, *workflow.estimate_cost(guardrail_result.code, language)
+        )
+    except OverloadedError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    started = time.perf_counter()
+    try:
+        # Run the async inference with the provided code. In two-phase mode only
+        # the verdicts are returned, details come from /evaluate/{id}/details
+        evaluation_id = None
+        if workflow.two_phase_enabled:
+            evaluation_id, result = await workflow.run_async_verdicts(
+                request.code,
+                guardrail_result,
+                repository=request.repository,
+                language=language,
+                lane=lane,
+            )
+        else:
+            result = await workflow.run_async_inference(
+                request.code,
+                guardrail_result,
+                repository=request.repository,
+                language=language,
+                lane=lane,
+            )
+        workflow.lanes.record_request(lane, time.perf_counter() - started)
         evaluation_status = all([x["pass"] for x in result])
         status_str = "success" if evaluation_status else "failed"
+        if analytics is not None:
+            record_analytics(result, request.repository, auth_result)
+        if integrity is not None and result:
+            files = split_hunks(request.code, request.path)
+            record_integrity(
+                evaluation_id or uuid.uuid4().hex,
+                files,
+                evaluation_status,
+                failed_hunks(files, result),
+                request.repository,
+                auth_result,
+            )
 
-        return CodeEvaluationResponse(result=result, status=status_str)
+        return CodeEvaluationResponse(
+            result=result,
+            status=status_str,
+            guardrail=guardrail_result.to_dict() if guardrail_result.matches else None,
+            evaluation_id=evaluation_id,
+            language=language,
+            lane=lane,
+        )
 
+    except LaneFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(workflow.admission.default_retry_after)},
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error evaluating code: {str(e)}")
+    finally:
+        ticket.release()
+
+
+@app.post("/prefetch", response_model=PrefetchResponse, status_code=202)
+async def prefetch_code(
+    request: CodeEvaluationRequest,
+    auth_result: str = Security(auth.verify),
+):
+    """
+    Queue a snippet to be evaluated in the background, e.g. on save or on
+    `git add`, so the evaluation at commit time hits the cache
+    """
+    if prefetcher is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: prefetching not enabled",
+        )
+    try:
+        guardrail_result = workflow.guardrail.check(request.code)
+    except PromptInjectionError as e:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": str(e), "guardrail": e.result.to_dict()},
+        )
+    language = workflow.resolve_language(request.path, request.code, request.language)
+    if not workflow.rules_for(language):
+        return PrefetchResponse(status="skipped", language=language)
+    try:
+        status_str = await prefetcher.submit(
+            request.code,
+            guardrail_result,
+            language=language,
+            repository=request.repository,
+            path=request.path,
+        )
+    except LaneFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(prefetcher.retry_after)},
+        )
+    return PrefetchResponse(status=status_str, language=language)
+
+
+@app.post("/evaluate/range", response_model=RangeEvaluationResponse)
+async def evaluate_commit_range(
+    request: RangeEvaluationRequest,
+    auth_result: str = Security(auth.verify),
+):
+    """
+    Evaluate a push given as its ordered commit diffs, every distinct hunk once,
+    and attribute the findings to the commits that contain each hunk
+    """
+    if workflow is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: OWASP workflow not initialized",
+        )
+    lane = resolve_lane(request.lane, auth_result)
+    loop = asyncio.get_running_loop()
+    plan = await loop.run_in_executor(
+        None,
+        plan_range,
+        workflow,
+        [(commit.id, commit.diff) for commit in request.commits],
+    )
+    costs = [
+        workflow.estimate_cost(snippet.code, snippet.language)
+        for snippet in plan.snippets
+    ]
+    try:
+        ticket = workflow.admission.admit(
+            lane, sum(cost[0] for cost in costs), sum(cost[1] for cost in costs)
+        )
+    except OverloadedError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    started = time.perf_counter()
+    try:
+        report = await evaluate_range(
+            workflow, plan, repository=request.repository, lane=lane
+        )
+        workflow.lanes.record_request(lane, time.perf_counter() - started)
+    except PromptInjectionError as e:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": str(e), "guardrail": e.result.to_dict()},
+        )
+    except LaneFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(workflow.admission.default_retry_after)},
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error evaluating commit range: {str(e)}"
+        )
+    finally:
+        ticket.release()
+
+    evaluation_id = uuid.uuid4().hex
+    evaluated_hunks = plan.evaluated_hunks()
+    if integrity is not None and evaluated_hunks:
+        # The net hunks are the added runs of the diff of the whole push, only
+        # those that rules evaluated
+        record_integrity(
+            evaluation_id,
+            net_files(evaluated_hunks),
+            report["passed"],
+            report["failed_hunks"],
+            request.repository,
+            auth_result,
+        )
+    return RangeEvaluationResponse(
+        commits=report["commits"],
+        summary=report["summary"],
+        status="success" if report["passed"] else "failed",
+        evaluation_id=evaluation_id,
+    )
+
+
+@app.get("/evaluate/{evaluation_id}/details", response_model=EvaluationDetailsResponse)
+async def get_evaluation_details(
+    evaluation_id: str,
+    lane: Optional[str] = None,
+    auth_result: str = Security(auth.verify),
+):
+    """Full description and suggested fix of the rules failed in an evaluation"""
+    if workflow is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: OWASP workflow not initialized",
+        )
+
+    try:
+        result = await workflow.run_async_details(
+            evaluation_id, resolve_lane(lane, auth_result)
+        )
+    except HTTPException:
+        raise
+    except LaneFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error generating details: {str(e)}"
+        )
+    if result is None:
+        raise HTTPException(
+            status_code=404, detail=f"Evaluation {evaluation_id} not found"
+        )
+    status_str = "success" if all([x["pass"] for x in result]) else "failed"
+    return EvaluationDetailsResponse(result=result, status=status_str)
 
 
 @app.post("/validate", response_model=CommitValidationResponse)
@@ -88,11 +683,172 @@ async def validate_commit(
     request: CommitValidationRequest,
     auth_result: str = Security(auth.verify),
 ):
-    """Validates a commit to check the evaluation results"""
+    """
+    Verify that pushed code was evaluated and passed, from its diff or its files.
+    Lists the hunks that were never evaluated
+    """
+    if integrity is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: integrity index not initialized",
+        )
+    if request.diff is None and request.files is None:
+        raise HTTPException(status_code=400, detail="Expected a diff or files")
+    files = parse_diff(request.diff) if request.diff is not None else []
+    files.extend(file_node(file.code, file.path) for file in request.files or [])
+    logger.info(
+        "Validating commit", extra={"commit": request.hash, "files": len(files)}
+    )
     try:
-        print(f"Validating commit: {request.hash}")
-        return CommitValidationResponse(result=["TODO: implementar"], status="success")
+        report = await asyncio.get_running_loop().run_in_executor(
+            None, integrity.verify, files, request.repository
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error validating commit: {str(e)}"
         )
+    return CommitValidationResponse(
+        result=report["files"],
+        status="success" if report["passed"] else "failed",
+        root=report["root"],
+        unevaluated=report["unevaluated"],
+        evaluations=report["evaluations"],
+    )
+
+
+@app.get("/analytics", response_model=AnalyticsResponse)
+async def get_analytics(
+    group_by: str = Query("rule", enum=list(GROUP_BY_COLUMNS)),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    repository: Optional[str] = None,
+    user: Optional[str] = None,
+    auth_result: str = Security(auth.verify),
+):
+    """Aggregated vulnerability counts, pass rates and token spend"""
+    if analytics is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: analytics store not initialized",
+        )
+
+    filters = {
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None,
+        "repository": repository,
+        "user": user,
+    }
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(
+            None, partial(analytics.query, group_by=group_by, **filters)
+        )
+        summary = await loop.run_in_executor(
+            None, partial(analytics.summary, **filters)
+        )
+        return AnalyticsResponse(result=result, summary=summary)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/scheduler", response_model=SchedulerResponse)
+async def get_scheduler(
+    repository: Optional[str] = None,
+    language: Optional[str] = None,
+    auth_result: str = Security(auth.verify),
+):
+    """Rule statistics and the dispatch order the scheduler would use"""
+    if workflow is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: OWASP workflow not initialized",
+        )
+
+    scheduler = workflow.scheduler
+    plan = scheduler.preview(workflow.rules_for(language), repository, language)
+    return SchedulerResponse(
+        plan=[asdict(decision) for decision in plan],
+        stats=scheduler.snapshot(repository, language),
+        recent=list(scheduler.decisions),
+    )
+
+
+@app.get("/lanes")
+async def get_lanes(auth_result: str = Security(auth.verify)):
+    """Occupancy, queues and latency percentiles of every priority lane"""
+    if workflow is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: OWASP workflow not initialized",
+        )
+    return workflow.lanes.stats()
+
+
+@app.get("/admission")
+async def get_admission(auth_result: str = Security(auth.verify)):
+    """Backlog size, drain rate and admitted and shed request counts"""
+    if workflow is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: OWASP workflow not initialized",
+        )
+    return workflow.admission.stats()
+
+
+@app.get("/backends")
+async def get_backends(auth_result: str = Security(auth.verify)):
+    """Load, latency and health of the backends of every pooled rule"""
+    if workflow is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: OWASP workflow not initialized",
+        )
+    return {agent_id: pool.stats() for agent_id, pool in workflow.backend_pools.items()}
+
+
+@app.get("/logging")
+async def get_logging(auth_result: str = Security(auth.verify)):
+    """Size of the log queue and records dropped because it was full"""
+    return logging_stats()
+
+
+@app.get("/debug/profile")
+async def get_profile(
+    seconds: float = Query(10, gt=0),
+    format: str = Query("collapsed", pattern="^(collapsed|json)$"),
+    idle: bool = False,
+    auth_result: str = Security(auth.verify, scopes=[PROFILE_SCOPE]),
+):
+    """
+    Sample the stacks of all the threads for `seconds`, as collapsed stacks
+    (flamegraph.pl, speedscope) or JSON. Waiting threads are left out unless
+    `idle` is set
+    """
+    try:
+        session = await sampler.profile(seconds, include_idle=idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "collapsed":
+        return PlainTextResponse(session.collapsed())
+    return session.to_dict()
+
+
+@app.get("/near-duplicates")
+async def get_near_duplicates(auth_result: str = Security(auth.verify)):
+    """Size of the near-duplicate index and verdicts reused or prioritized"""
+    if workflow is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable: OWASP workflow not initialized",
+        )
+    if workflow.near_duplicates is None:
+        return {"enabled": False}
+    return {"enabled": True, **workflow.near_duplicates.stats()}
+
+
+@app.get("/prefetch")
+async def get_prefetch(auth_result: str = Security(auth.verify)):
+    """Prefetch queue, token budget and cache warming of every repository"""
+    if prefetcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **prefetcher.stats(), "warming": warmer.stats()}
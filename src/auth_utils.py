@@ -55,8 +55,12 @@ class VerifyToken:
         self.config = get_settings()
 
         # This gets the JWKS from a given URL and does processing so you can
-        # use any of the keys available
-        jwks_url = f"https://{self.config.auth0_domain}/.well-known/jwks.json"
+        # use any of the keys available. AUTH0_JWKS_URL points it elsewhere,
+        # e.g. to the local JWKS of the load tests
+        jwks_url = get_env_variable(
+            "AUTH0_JWKS_URL",
+            f"https://{self.config.auth0_domain}/.well-known/jwks.json",
+        )
         self.jwks_client = jwt.PyJWKClient(jwks_url)
 
     async def verify(
@@ -0,0 +1,249 @@
+"""Script used to balance the model calls of a rule across several backends"""
+
+import logging
+import threading
+import time
+from typing import Any, AsyncGenerator, Optional, Type, TypeVar, Union
+
+from pydantic import BaseModel
+from strands.models import Model
+from strands.models.openai import OpenAIModel
+
+from .utils import get_env_variable
+
+T = TypeVar("T", bound=BaseModel)
+logger = logging.getLogger(__name__)
+
+# Constants
+BACKEND_PROVIDERS = ("openai", "ollama")
+
+
+class NoHealthyBackendError(Exception):
+    """Raised when every member of a pool is ejected or failed the request."""
+
+
+class Backend:
+    """A pool member with its load and health bookkeeping."""
+
+    def __init__(self, name: str, model: Model, weight: float = 1.0):
+        self.name = name
+        self.model = model
+        self.weight = weight
+        self.outstanding = 0
+        self.latency_ms: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "ejected": self.ejected_until > time.monotonic(),
+        }
+
+
+def build_backend_model(backend: dict, params: dict) -> Model:
+    """Model of a pool member from its configuration.
+
+    OpenAI compatible members take `client_args` (e.g. `base_url`) and read the
+    key from the environment variable named in `api_key_env`, so no secret
+    lives in configs.json. Ollama members take a `host`.
+    """
+    provider = backend.get("provider", "openai")
+    params = {**params, **backend.get("params", {})}
+    if provider == "openai":
+        client_args = dict(backend.get("client_args", {}))
+        client_args["api_key"] = get_env_variable(
+            backend.get("api_key_env", "OPENAI_API_KEY")
+        )
+        return OpenAIModel(
+            client_args=client_args, model_id=backend["model_id"], params=params
+        )
+    if provider == "ollama":
+        # Optional dependency, only needed when a pool has local members
+        from strands.models.ollama import OllamaModel
+
+        return OllamaModel(
+            host=backend.get("host", "http://localhost:11434"),
+            model_id=backend["model_id"],
+            **params,
+        )
+    raise ValueError(f"Unknown backend provider '{provider}', use {BACKEND_PROVIDERS}")
+
+
+class BackendPool(Model):
+    """Model that spreads the calls of a rule over several backends.
+
+    Every call goes to the healthy member with the lowest
+    `(outstanding + 1) * latency / weight`: weighted least outstanding requests,
+    scaled by the EWMA latency of the member so slow endpoints get less work.
+    A member failing `max_failures` times in a row is ejected for
+    `ejection_seconds`, doubled on every new ejection. A call failing before
+    any response event is retried on another member, up to `max_attempts`.
+    """
+
+    def __init__(
+        self,
+        backends: list,
+        alpha: float = 0.2,
+        max_failures: int = 3,
+        ejection_seconds: float = 30,
+        max_ejection_seconds: float = 300,
+        max_attempts: int = 2,
+    ):
+        if not backends:
+            raise ValueError("A backend pool needs at least one member")
+        self.backends = backends
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.ejection_seconds = ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+    def update_config(self, **model_config: Any) -> None:
+        for backend in self.backends:
+            backend.model.update_config(**model_config)
+
+    def get_config(self) -> Any:
+        return {
+            **dict(self.backends[0].model.get_config()),
+            "backends": [backend.name for backend in self.backends],
+        }
+
+    def _pick(self, excluded: set) -> Backend:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                backend
+                for backend in self.backends
+                if backend.name not in excluded and backend.ejected_until <= now
+            ]
+            if not candidates:
+                # Every member is ejected: try the one closest to coming back
+                candidates = [
+                    min(
+                        (b for b in self.backends if b.name not in excluded),
+                        key=lambda backend: backend.ejected_until,
+                        default=None,
+                    )
+                ]
+                if candidates[0] is None:
+                    raise NoHealthyBackendError("Every backend failed this request")
+            known = [b.latency_ms for b in candidates if b.latency_ms is not None]
+            # New members get the average latency, so they are tried right away
+            default_latency = sum(known) / len(known) if known else 1.0
+            backend = min(
+                candidates,
+                key=lambda b: (b.outstanding + 1)
+                * (b.latency_ms or default_latency)
+                / b.weight,
+            )
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def _finish(self, backend: Backend, started: float, ok: bool) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            if ok:
+                latency_ms = (time.perf_counter() - started) * 1000
+                backend.latency_ms = (
+                    latency_ms
+                    if backend.latency_ms is None
+                    else backend.latency_ms
+                    + self.alpha * (latency_ms - backend.latency_ms)
+                )
+                backend.consecutive_failures = 0
+                return
+            backend.failures += 1
+            if backend.ejected_until > time.monotonic():
+                # Calls sent before the ejection, already accounted for
+                return
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.max_failures:
+                backend.ejections += 1
+                backend.consecutive_failures = 0
+                backend.ejected_until = time.monotonic() + min(
+                    self.ejection_seconds * 2 ** (backend.ejections - 1),
+                    self.max_ejection_seconds,
+                )
+                logger.warning(
+                    "Ejecting backend",
+                    extra={"backend": backend.name, "ejections": backend.ejections},
+                )
+
+    async def stream(
+        self,
+        messages: list,
+        tool_specs: Optional[list] = None,
+        system_prompt: Optional[str] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[dict, None]:
+        excluded = set()
+        for attempt in range(1, self.max_attempts + 1):
+            backend = self._pick(excluded)
+            started, streamed, ok = time.perf_counter(), False, False
+            try:
+                async for event in backend.model.stream(
+                    messages, tool_specs, system_prompt, **kwargs
+                ):
+                    streamed = True
+                    yield event
+                ok = True
+                return
+            except Exception:
+                # Part of the answer already reached the caller, can't retry
+                if streamed or attempt == self.max_attempts:
+                    raise
+                excluded.add(backend.name)
+            finally:
+                # Also when the caller closes the stream or the task is cancelled
+                self._finish(backend, started, ok)
+
+    def structured_output(
+        self,
+        output_model: Type[T],
+        prompt: list,
+        system_prompt: Optional[str] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[dict[str, Union[T, Any]], None]:
+        return self._structured_output(output_model, prompt, system_prompt, **kwargs)
+
+    async def _structured_output(self, output_model, prompt, system_prompt, **kwargs):
+        backend = self._pick(set())
+        started, ok = time.perf_counter(), False
+        try:
+            async for event in backend.model.structured_output(
+                output_model, prompt, system_prompt=system_prompt, **kwargs
+            ):
+                yield event
+            ok = True
+        finally:
+            self._finish(backend, started, ok)
+
+    def stats(self) -> list:
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
+
+
+def build_backend_pool(backends: list, params: dict, pool_config: dict) -> BackendPool:
+    return BackendPool(
+        [
+            Backend(
+                name=backend.get("name", f"{backend['model_id']}-{index}"),
+                model=build_backend_model(backend, params),
+                weight=backend.get("weight", 1.0),
+            )
+            for index, backend in enumerate(backends)
+        ],
+        **pool_config,
+    )
@@ -0,0 +1,300 @@
+"""Script used to cache rule results between evaluations"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+
+class ResultCache:
+    """In-memory LRU cache of rule results keyed by code fingerprint."""
+
+    # Whether calls do I/O, and so must not run on the event loop
+    blocking = False
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached value for a key, or None when missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry[0]):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: dict) -> None:
+        """Store a value, evicting the least recently used entries when full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+    def _is_expired(self, stored_at: float) -> bool:
+        return (
+            self.ttl_seconds is not None
+            and time.monotonic() - stored_at > self.ttl_seconds
+        )
+
+
+class SQLiteResultCache(ResultCache):
+    """Result cache shared by every worker process of a node.
+
+    Uses SQLite in WAL mode so readers never block the single writer, with one
+    connection per thread since the executor threads share the instance. Hits
+    update the access time of the entry, so eviction drops the least recently
+    used entries first. A hit only writes when the access time is older than
+    `touch_interval_seconds`, so hot entries do not serialize readers on the
+    write lock.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 2048,
+        ttl_seconds: Optional[float] = None,
+        eviction_interval: int = 256,
+        touch_interval_seconds: float = 60,
+    ):
+        super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.path = path
+        self.eviction_interval = eviction_interval
+        self.touch_interval_seconds = touch_interval_seconds
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            columns = {
+                row[1] for row in connection.execute("PRAGMA table_info(results)")
+            }
+            if "accessed_at" not in columns:
+                # Caches created before entries tracked their last access
+                connection.execute(
+                    "ALTER TABLE results "
+                    "ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0"
+                )
+                connection.execute("UPDATE results SET accessed_at = stored_at")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_results_stored_at ON results(stored_at)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_results_accessed_at "
+                "ON results(accessed_at)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Optional[dict]:
+        connection = self._connect()
+        row = connection.execute(
+            "SELECT value, stored_at, accessed_at FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        with self._lock:
+            if row is None or self._is_expired(row[1]):
+                self.misses += 1
+                return None
+            self.hits += 1
+        now = time.time()
+        if now - row[2] > self.touch_interval_seconds:
+            # Eviction only needs the access time to the interval
+            with connection:
+                connection.execute(
+                    "UPDATE results SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict) -> None:
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, stored_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.eviction_interval == 0
+        if evict:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop expired entries and the least recently used above the size limit."""
+        with self._connect() as connection:
+            if self.ttl_seconds is not None:
+                connection.execute(
+                    "DELETE FROM results WHERE stored_at < ?",
+                    (time.time() - self.ttl_seconds,),
+                )
+            connection.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> dict:
+        (entries,) = self._connect().execute("SELECT COUNT(*) FROM results").fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+    def _is_expired(self, stored_at: float) -> bool:
+        return (
+            self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+        )
+
+
+class InFlightRegistry:
+    """Tracks the evaluations in progress so duplicates wait for the result.
+
+    A claim is a lease: if its owner dies without releasing it, another caller
+    can take it over once `lease_seconds` have passed.
+    """
+
+    blocking = False
+
+    def __init__(self, lease_seconds: float = 120):
+        self.lease_seconds = lease_seconds
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key: str) -> bool:
+        """Try to become the owner of an evaluation, True when successful."""
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._leases.get(key)
+            if expires_at is not None and expires_at > now:
+                return False
+            self._leases[key] = now + self.lease_seconds
+            return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._leases.pop(key, None)
+
+    def active(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for expires_at in self._leases.values() if expires_at > now)
+
+
+class SQLiteInFlightRegistry(InFlightRegistry):
+    """In-flight registry shared by every worker process of a node."""
+
+    blocking = True
+
+    def __init__(self, path: str, lease_seconds: float = 120):
+        super().__init__(lease_seconds=lease_seconds)
+        self.path = path
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS inflight ("
+                "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def claim(self, key: str) -> bool:
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO inflight (key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                "owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE inflight.expires_at <= ?",
+                (key, self.owner, now + self.lease_seconds, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, key: str) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM inflight WHERE key = ? AND owner = ?", (key, self.owner)
+            )
+
+    def active(self) -> int:
+        (count,) = (
+            self._connect()
+            .execute(
+                "SELECT COUNT(*) FROM inflight WHERE expires_at > ?", (time.time(),)
+            )
+            .fetchone()
+        )
+        return count
+
+
+def build_cache(config: dict) -> tuple[ResultCache, InFlightRegistry]:
+    """Create the result cache and in-flight registry for a cache configuration.
+
+    The `sqlite` backend shares both between the worker processes of a node
+    (e.g. `uvicorn --workers N`), the default `memory` backend is per process.
+    The `none` backend keeps nothing, so every rule call reaches the model.
+    """
+    config = dict(config)
+    backend = config.pop("backend", "memory")
+    lease_seconds = config.pop("lease_seconds", 120)
+    if backend == "none":
+        # Every entry is evicted as soon as it is stored
+        return ResultCache(max_entries=0), InFlightRegistry(lease_seconds=lease_seconds)
+    if backend == "memory":
+        config.pop("path", None)
+        config.pop("touch_interval_seconds", None)
+        return ResultCache(**config), InFlightRegistry(lease_seconds=lease_seconds)
+    if backend == "sqlite":
+        path = config.pop("path", "cache.db")
+        return (
+            SQLiteResultCache(path, **config),
+            SQLiteInFlightRegistry(path, lease_seconds=lease_seconds),
+        )
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -1,6 +1,6 @@
 """Script used to handle configurations for the project"""
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from .utils import get_env_variable
 
@@ -10,6 +10,13 @@ USER_PROMPT_TEMPLATE = (
     "Provide a detailed explanation of any vulnerabilities found, including how they can be exploited and recommendations for mitigation.\n"
     "Here is the code:\n<code>\n{code_snippet}\n</code>"
 )
+VERDICT_PROMPT_TEMPLATE = (
+    "Analyze the following code and decide if it has security issues related to {owasp_name}.\n"
+    "Answer ONLY with the YAML below, one item per vulnerable line, without descriptions, explanations nor suggested fixes:\n"
+    "```yaml\nvulnerabilities_detected:\n  - line: <line number>\n```\n"
+    "If no vulnerabilities are found, respond with:\n```yaml\nvulnerabilities_detected: []\n```\n"
+    "Here is the code:\n<code>\n{code_snippet}\n</code>"
+)
 
 
 # Data models
@@ -20,6 +27,8 @@ class OpenAIModelConfig:
     model_id: str
     params: dict
     client_args: dict
+    # Optional pool of endpoints serving the rule, see backends.py
+    backends: list = field(default_factory=list)
 
     @classmethod
     def from_dict(cls, config: dict):
@@ -29,6 +38,7 @@ class OpenAIModelConfig:
             client_args=config.get(
                 "client_args", {"api_key": get_env_variable("OPENAI_API_KEY")}
             ),
+            backends=config.get("backends", []),
         )
 
     def to_dict(self) -> dict:
@@ -0,0 +1,61 @@
+"""Script used to split and reassemble the YAML findings returned by the agents"""
+
+import re
+from typing import Optional
+
+# Constants
+FINDINGS_HEADER = "vulnerabilities_detected:"
+ITEM_PATTERN = re.compile(r"^(\s*)- ")
+LINE_VALUE_PATTERN = re.compile(r"\bline:[ \t]*\[?[ \t]*(\d+)")
+
+
+def split_findings(response: str) -> Optional[list]:
+    """Split a YAML response into one text block per finding.
+
+    Returns None when the response does not follow the expected format, so
+    callers can fall back to keeping the response as a whole.
+    """
+    lines = response.splitlines()
+    try:
+        start = next(
+            index
+            for index, line in enumerate(lines)
+            if line.strip().startswith(FINDINGS_HEADER)
+        )
+    except StopIteration:
+        return None
+    if lines[start].strip() in (f"{FINDINGS_HEADER} []", f"{FINDINGS_HEADER} null"):
+        return []
+    blocks, current, indent = [], None, None
+    for line in lines[start + 1 :]:
+        if line.strip().startswith("```"):
+            break
+        match = ITEM_PATTERN.match(line)
+        if match and (indent is None or len(match.group(1)) == indent):
+            indent = len(match.group(1))
+            current = [line[indent:]]
+            blocks.append(current)
+        elif current is not None and (
+            not line.strip() or len(line) - len(line.lstrip()) > indent
+        ):
+            current.append(line[indent:] if line.strip() else "")
+        elif line.strip():
+            break
+    return ["\n".join(block).rstrip() for block in blocks]
+
+
+def finding_line(block: str) -> Optional[int]:
+    """First line number referenced by a finding."""
+    match = LINE_VALUE_PATTERN.search(block)
+    return int(match.group(1)) if match else None
+
+
+def render_findings(blocks: list) -> str:
+    """Render finding blocks back into the YAML format used by the prompts."""
+    if not blocks:
+        return f"```yaml\n{FINDINGS_HEADER} []\n```"
+    items = "\n".join(
+        "\n".join(f"  {line}" if line else "" for line in block.splitlines())
+        for block in blocks
+    )
+    return f"```yaml\n{FINDINGS_HEADER}\n{items}\n```"
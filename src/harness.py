@@ -0,0 +1,227 @@
+"""Evaluation harness to measure precision, recall and latency per rule.
+
+The corpus is a directory of labeled snippets:
+
+    corpus/
+        clean/...            snippets where no rule should fail
+        A03_Injection/...    snippets where the A03_Injection rule should fail
+        labels.json          optional {"relative/path": ["A01_BAC", ...]} overrides
+
+Every snippet runs through `OwaspWorkflow` once per configuration variant, the
+raw results are streamed to a JSONL file and a per-rule report is printed.
+
+Usage (from the repository root):
+    uv run python -m src.harness corpus/ --configs src/configs/configs.json \\
+        --concurrency 4 --output harness_results.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+from .workflow import OwaspWorkflow
+
+load_dotenv()  # Load environment variables from .env file
+
+CLEAN_LABEL = "clean"
+LABELS_FILE = "labels.json"
+# Every sample must reach the model: cached results and units, reused
+# near-duplicate verdicts and prefetched results would hide the precision,
+# latency and tokens being measured. The near-duplicate index of a run is kept
+# in memory, apart from the service one
+WORKFLOW_OVERRIDES = {
+    "cache": {"backend": "none"},
+    "near_duplicates": {"reuse": False, "path": None},
+    "prefetch": {"enabled": False},
+}
+
+
+def pprint(data):
+    print(json.dumps(data, indent=2, ensure_ascii=False))
+
+
+def load_corpus(corpus_path: str, rule_ids: list) -> list:
+    """List the corpus samples with the set of rules expected to fail."""
+    overrides = {}
+    labels_path = os.path.join(corpus_path, LABELS_FILE)
+    if os.path.exists(labels_path):
+        with open(labels_path, "r") as file:
+            overrides = json.load(file)
+
+    samples = []
+    for label in sorted(os.listdir(corpus_path)):
+        label_path = os.path.join(corpus_path, label)
+        if not os.path.isdir(label_path):
+            continue
+        if label != CLEAN_LABEL and label not in rule_ids:
+            print(f"Warning: skipping '{label}', not a rule id nor '{CLEAN_LABEL}'")
+            continue
+        for root, _, files in os.walk(label_path):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, corpus_path)
+                expected = overrides.get(
+                    relative, [] if label == CLEAN_LABEL else [label]
+                )
+                samples.append({"path": relative, "expected": sorted(expected)})
+    return samples
+
+
+def percentile(values: list, ratio: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(round(ratio * (len(values) - 1))), len(values) - 1)]
+
+
+class RuleReport:
+    """Confusion matrix, latencies and tokens of one rule for one variant."""
+
+    def __init__(self):
+        self.true_positives = 0
+        self.false_positives = 0
+        self.false_negatives = 0
+        self.true_negatives = 0
+        self.latencies = []
+        self.total_tokens = 0
+        self.errors = 0
+
+    def add(self, expected: bool, predicted: bool, metrics: dict) -> None:
+        if expected and predicted:
+            self.true_positives += 1
+        elif predicted:
+            self.false_positives += 1
+        elif expected:
+            self.false_negatives += 1
+        else:
+            self.true_negatives += 1
+        self.latencies.append(metrics.get("latencyMs", 0))
+        self.total_tokens += metrics.get("totalTokens", 0)
+
+    def to_dict(self) -> dict:
+        flagged = self.true_positives + self.false_positives
+        vulnerable = self.true_positives + self.false_negatives
+        samples = flagged + self.false_negatives + self.true_negatives
+        return {
+            "samples": samples,
+            "tp": self.true_positives,
+            "fp": self.false_positives,
+            "fn": self.false_negatives,
+            "tn": self.true_negatives,
+            "errors": self.errors,
+            "precision": round(self.true_positives / flagged, 4) if flagged else None,
+            "recall": (
+                round(self.true_positives / vulnerable, 4) if vulnerable else None
+            ),
+            "p50LatencyMs": percentile(self.latencies, 0.5),
+            "p90LatencyMs": percentile(self.latencies, 0.9),
+            "p99LatencyMs": percentile(self.latencies, 0.99),
+            "totalTokens": self.total_tokens,
+            "avgTokens": round(self.total_tokens / samples, 1) if samples else None,
+        }
+
+
+async def evaluate_variant(
+    config_path: str,
+    corpus_path: str,
+    concurrency: int,
+    output,
+) -> dict:
+    """Run the corpus through one configuration variant."""
+    variant = os.path.splitext(os.path.basename(config_path))[0]
+    workflow = OwaspWorkflow(config_path, overrides=WORKFLOW_OVERRIDES)
+    rules = workflow.evaluation_config["rules"]
+    rule_by_name = {details["name"]: owasp_id for owasp_id, details in rules.items()}
+    reports = {owasp_id: RuleReport() for owasp_id in rules}
+    samples = load_corpus(corpus_path, list(rules))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def evaluate_sample(sample: dict) -> None:
+        async with semaphore:
+            # Read under the semaphore, so `concurrency` also bounds open files
+            with open(
+                os.path.join(corpus_path, sample["path"]), "r", errors="replace"
+            ) as file:
+                code = file.read()
+            started = time.perf_counter()
+            try:
+                results = await workflow.run_async_inference(code)
+                error = None
+            except Exception as e:
+                results, error = [], str(e)
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 0)
+
+        predictions = {}
+        for result in results:
+            owasp_id = rule_by_name[result["owasp_name"]]
+            predicted = not result["pass"]
+            expected = owasp_id in sample["expected"]
+            reports[owasp_id].add(expected, predicted, result["metrics"])
+            predictions[owasp_id] = {
+                "expected": expected,
+                "predicted": predicted,
+                "metrics": result["metrics"],
+            }
+        if error is not None:
+            for report in reports.values():
+                report.errors += 1
+        record = {
+            "variant": variant,
+            **sample,
+            "latencyMs": elapsed_ms,
+            "rules": predictions,
+            "error": error,
+        }
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(evaluate_sample(sample) for sample in samples))
+    return {
+        "variant": variant,
+        "config_path": config_path,
+        "samples": len(samples),
+        "wallTimeSeconds": round(time.perf_counter() - started, 2),
+        "rules": {owasp_id: report.to_dict() for owasp_id, report in reports.items()},
+    }
+
+
+async def run_harness(
+    corpus_path: str, config_paths: list, concurrency: int, output_path: str
+) -> list:
+    with open(output_path, "w") as output:
+        return [
+            await evaluate_variant(config_path, corpus_path, concurrency, output)
+            for config_path in config_paths
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", help="Directory with the labeled snippets")
+    parser.add_argument(
+        "--configs",
+        nargs="+",
+        default=[os.path.join(os.path.dirname(__file__), "configs", "configs.json")],
+        help="configs.json variants to compare",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--output", default="harness_results.jsonl")
+    parser.add_argument("--report", help="Optional path for the JSON report")
+    args = parser.parse_args()
+
+    report = asyncio.run(
+        run_harness(args.corpus, args.configs, args.concurrency, args.output)
+    )
+    pprint(report)
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
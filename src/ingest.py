@@ -0,0 +1,223 @@
+"""Script used to read compressed and streamed request bodies within bounded memory"""
+
+import json
+import zlib
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable
+
+from fastapi import HTTPException, Request
+from fastapi.routing import APIRoute
+
+# Constants
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/jsonl")
+# Output produced per decompression step, bounds the memory of a zip bomb
+DECODE_STEP_BYTES = 64 * 1024
+
+
+@dataclass
+class IngestLimits:
+    """Size limits enforced while a request body is being received."""
+
+    max_body_bytes: int = 5 * 1024 * 1024
+    max_decoded_bytes: int = 20 * 1024 * 1024
+    max_file_bytes: int = 1024 * 1024
+    max_files: int = 500
+    max_concurrent_files: int = 4
+
+    @classmethod
+    def from_dict(cls, config: dict):
+        return cls(**config)
+
+
+class PayloadTooLargeError(HTTPException):
+    def __init__(self, what: str, limit: int):
+        super().__init__(status_code=413, detail=f"{what} exceeds {limit} bytes")
+
+
+def _decompressor(encoding: str):
+    """Object with `decompress(data, max_length)` for a Content-Encoding."""
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "zstd":
+        try:
+            # Optional dependency, zstd bodies are refused without it
+            import zstandard
+        except ImportError:
+            raise HTTPException(status_code=415, detail="zstd encoding not enabled")
+        return _ZstdDecompressor(zstandard.ZstdDecompressor())
+    raise HTTPException(status_code=415, detail=f"Unsupported encoding '{encoding}'")
+
+
+class _InputNeeded(Exception):
+    """Tells the zstd stream reader that the queued input ran out."""
+
+
+class _ZstdDecompressor:
+    """Adapts the zstandard streaming API to the zlib one used below.
+
+    Only the stream reader of zstandard bounds the output of a call, so the
+    body is queued as its source and `readinto1` fills at most `max_length`
+    bytes. `readinto1` only asks for input before producing any output, so
+    running out of queued input ends a call without losing decoded bytes.
+    """
+
+    READ_BYTES = 8 * 1024
+
+    def __init__(self, decompressor):
+        self.reader = decompressor.stream_reader(
+            self, read_size=self.READ_BYTES, read_across_frames=True
+        )
+        self.queue = bytearray()
+        self.finished = False
+        self.unconsumed_tail = b""
+
+    def read(self, size: int) -> bytes:
+        """Source of the stream reader, the queued input."""
+        if not self.queue:
+            if self.finished:
+                return b""
+            raise _InputNeeded()
+        data = bytes(self.queue[:size])
+        del self.queue[:size]
+        return data
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        # `data` is a new chunk or the previous tail, the queue is empty otherwise
+        self.queue[:] = data
+        output = self._read(max_length)
+        self.unconsumed_tail = bytes(self.queue)
+        return output
+
+    def flush(self) -> bytes:
+        """Output the reader still holds once the body ended, a step per call."""
+        self.finished = True
+        return self._read(DECODE_STEP_BYTES)
+
+    def _read(self, max_length: int) -> bytes:
+        output = bytearray(max_length)
+        view, size = memoryview(output), 0
+        while size < max_length:
+            try:
+                read = self.reader.readinto1(view[size:])
+            except _InputNeeded:
+                break
+            if not read:
+                break
+            size += read
+        view.release()
+        del output[size:]
+        return bytes(output)
+
+
+def _decode(decompressor, chunk: bytes):
+    """Decoded pieces of a chunk, at most DECODE_STEP_BYTES each."""
+    if decompressor is None:
+        yield chunk
+        return
+    while chunk:
+        yield decompressor.decompress(chunk, DECODE_STEP_BYTES)
+        chunk = decompressor.unconsumed_tail
+
+
+async def decoded_stream(
+    request: Request, limits: IngestLimits
+) -> AsyncIterator[bytes]:
+    """Body of a request as decoded chunks, aborting as soon as a limit is hit.
+
+    The compressed size is checked against `max_body_bytes` (also upfront with
+    the Content-Length) and the decoded size against `max_decoded_bytes`.
+    """
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > limits.max_body_bytes:
+        raise PayloadTooLargeError("Request body", limits.max_body_bytes)
+    decompressor = _decompressor(
+        request.headers.get("content-encoding", "").strip().lower()
+    )
+    received = decoded = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limits.max_body_bytes:
+            raise PayloadTooLargeError("Request body", limits.max_body_bytes)
+        pieces = _decode(decompressor, chunk)
+        if decompressor is not None and not chunk:
+            # End of the stream, output kept back by the decompressor
+            pieces = iter(decompressor.flush, b"")
+        for piece in pieces:
+            decoded += len(piece)
+            if decoded > limits.max_decoded_bytes:
+                raise PayloadTooLargeError("Decoded body", limits.max_decoded_bytes)
+            if piece:
+                yield piece
+
+
+async def iter_ndjson(
+    chunks: AsyncIterator[bytes], max_line_bytes: int
+) -> AsyncIterator[dict]:
+    """Objects of an NDJSON stream, one line in memory at a time.
+
+    Complete lines and the unfinished one are both checked against
+    `max_line_bytes`, so a line without newline never grows the buffer to the
+    size of the whole body.
+    """
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            if end - start > max_line_bytes:
+                raise PayloadTooLargeError("NDJSON line", max_line_bytes)
+            line = bytes(buffer[start:end])
+            start = end + 1
+            if line.strip():
+                yield _parse_line(line)
+        del buffer[:start]
+        if len(buffer) > max_line_bytes:
+            raise PayloadTooLargeError("NDJSON line", max_line_bytes)
+    if bytes(buffer).strip():
+        yield _parse_line(bytes(buffer))
+
+
+def _parse_line(line: bytes) -> dict:
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid NDJSON line: {e}")
+    if not isinstance(item, dict):
+        raise HTTPException(status_code=400, detail="NDJSON lines must be objects")
+    return item
+
+
+class DecodingRequest(Request):
+    """Request whose body is decompressed and size checked while received."""
+
+    limits = IngestLimits()
+
+    def decoded_stream(self) -> AsyncIterator[bytes]:
+        return decoded_stream(self, self.limits)
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = bytearray()
+            async for chunk in self.decoded_stream():
+                body += chunk
+            self._body = bytes(body)
+        return self._body
+
+
+class DecodingRoute(APIRoute):
+    """Route handing the endpoints a `DecodingRequest`."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def decoding_handler(request: Request):
+            return await handler(DecodingRequest(request.scope, request.receive))
+
+        return decoding_handler
@@ -0,0 +1,413 @@
+"""Script used to verify that the pushed code is the code that was evaluated"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from typing import Optional
+
+from .findings import finding_line, split_findings
+
+# Constants
+INTEGRITY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluated_trees (
+    evaluation_id TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    passed INTEGER NOT NULL,
+    repository TEXT,
+    user TEXT,
+    created_at TEXT NOT NULL,
+    tree TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS evaluated_nodes (
+    hash TEXT PRIMARY KEY,
+    evaluation_id TEXT NOT NULL,
+    passed INTEGER NOT NULL,
+    rules TEXT
+) WITHOUT ROWID;
+"""
+# The latest evaluation of a node decides whether it passed, except that a
+# failed node only passes again under other rules: retrying the same rules
+# until a flaky verdict passes does not clear a failure. Rules only change
+# with a new configuration, so other rules are newer ones
+NODE_UPSERT = """
+INSERT INTO evaluated_nodes (hash, evaluation_id, passed, rules) VALUES (?, ?, ?, ?)
+ON CONFLICT (hash) DO UPDATE SET
+    evaluation_id = excluded.evaluation_id,
+    passed = excluded.passed,
+    rules = excluded.rules
+WHERE excluded.passed = 0
+    OR evaluated_nodes.passed = 1
+    OR evaluated_nodes.rules IS NOT excluded.rules
+"""
+HUNK_HEADER_PATTERN = re.compile(
+    r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@", re.MULTILINE
+)
+SNIPPET_PATH = "-"
+# SQLite limit of bound parameters per statement is 999 on old builds
+LOOKUP_BATCH_SIZE = 500
+
+
+def _digest(kind: str, *parts: str) -> str:
+    # The kind keeps a hunk from ever colliding with a file or a root
+    return hashlib.sha256("\0".join((kind, *parts)).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class Hunk:
+    """Lines added together, `start_line` is their line in the new file."""
+
+    start_line: int
+    lines: list
+    repository: Optional[str] = None
+    # Line of the evaluated diff where the hunk starts, None outside diffs
+    diff_line: Optional[int] = field(default=None, compare=False)
+
+    @property
+    def end_line(self) -> int:
+        return self.start_line + len(self.lines) - 1
+
+    @property
+    def hash(self) -> str:
+        if self.repository is None:
+            return _digest("hunk", "\n".join(self.lines))
+        # The same code evaluated in another repository never covers this one
+        return _digest("repository hunk", self.repository, "\n".join(self.lines))
+
+
+@dataclass
+class FileNode:
+    """A file of an evaluation or a push, the parent of its hunks."""
+
+    path: str
+    hunks: list = field(default_factory=list)
+
+    @property
+    def hash(self) -> str:
+        return _digest("file", self.path, *(hunk.hash for hunk in self.hunks))
+
+    def to_dict(self) -> dict:
+        return {
+            "path": self.path,
+            "hash": self.hash,
+            "hunks": [
+                {
+                    "start_line": hunk.start_line,
+                    "end_line": hunk.end_line,
+                    "hash": hunk.hash,
+                }
+                for hunk in self.hunks
+            ],
+        }
+
+
+def scope_files(files: list, repository: Optional[str]) -> list:
+    """Copies of the files whose hunks belong to a repository."""
+    return [
+        FileNode(
+            file.path, [replace(hunk, repository=repository) for hunk in file.hunks]
+        )
+        for file in files
+    ]
+
+
+def merkle_root(files: list) -> str:
+    ordered = sorted(files, key=lambda file: file.path)
+    return _digest("root", *(file.hash for file in ordered))
+
+
+def make_hunk(start_line: int, lines: list) -> Optional[Hunk]:
+    """Hunk of the lines without trailing spaces nor surrounding blank lines."""
+    lines = [line.rstrip() for line in lines]
+    while lines and not lines[0]:
+        lines.pop(0)
+        start_line += 1
+    while lines and not lines[-1]:
+        lines.pop()
+    return Hunk(start_line, lines) if lines else None
+
+
+def is_diff(code: str) -> bool:
+    return HUNK_HEADER_PATTERN.search(code) is not None
+
+
+def parse_diff(diff: str) -> list:
+    """Files of a unified diff, a hunk per run of consecutive added lines.
+
+    Runs are the unit, not the `@@` blocks, because the blocks of a diff
+    depend on its context lines while the added lines do not. Deleted files
+    have nothing to verify and are left out.
+    """
+    files, current, run, run_start, run_diff_line = [], None, [], 0, 0
+    line_number = old_remaining = new_remaining = 0
+
+    def close_run():
+        nonlocal run
+        hunk = make_hunk(run_start, run)
+        if current is not None and hunk is not None:
+            hunk.diff_line = run_diff_line + hunk.start_line - run_start
+            current.hunks.append(hunk)
+        run = []
+
+    for diff_line, line in enumerate(diff.replace("\r\n", "\n").split("\n"), 1):
+        if old_remaining > 0 or new_remaining > 0:
+            # Inside a block, its header says how many lines it has
+            if line.startswith("+"):
+                if not run:
+                    run_start, run_diff_line = line_number, diff_line
+                run.append(line[1:])
+                line_number += 1
+                new_remaining -= 1
+                continue
+            close_run()
+            if line.startswith("-"):
+                old_remaining -= 1
+            elif not line.startswith("\\"):
+                line_number += 1
+                old_remaining -= 1
+                new_remaining -= 1
+            continue
+        close_run()
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match:
+            line_number = int(match.group(3))
+            old_remaining = int(match.group(2) or 1)
+            new_remaining = int(match.group(4) or 1)
+        elif line.startswith("diff --git "):
+            current = None
+        elif line.startswith("+++ "):
+            path = line[4:].split("\t")[0].strip()
+            current = None
+            if path != "/dev/null":
+                current = FileNode(path[2:] if path.startswith("b/") else path)
+                files.append(current)
+    close_run()
+    return [file for file in files if file.hunks]
+
+
+def split_hunks(code: str, path: Optional[str] = None) -> list:
+    """Files and hunks of an evaluated snippet.
+
+    A diff is split as in `parse_diff`, any other snippet is a single file
+    (e.g. a whole file of an NDJSON upload) whose hunk is all of its lines, so
+    a diff that adds that file has the same hunk.
+    """
+    if is_diff(code):
+        return parse_diff(code)
+    return [file_node(code, path)]
+
+
+def file_node(code: str, path: Optional[str] = None) -> FileNode:
+    """A whole file as a single hunk."""
+    hunk = make_hunk(1, code.replace("\r\n", "\n").split("\n"))
+    return FileNode(path or SNIPPET_PATH, [hunk] if hunk is not None else [])
+
+
+def failed_hunks(files: list, results: list) -> set:
+    """Hashes of the hunks of an evaluated snippet that the findings point at.
+
+    Findings are attributed by their line, as `pushes.attribute_findings`
+    does for packed snippets. A response that cannot be split, or a finding
+    outside the hunks, fails every hunk so it is never lost.
+    """
+    hunks = [hunk for file in files for hunk in file.hunks]
+    lines = {
+        hunk.diff_line + offset: hunk.hash
+        for hunk in hunks
+        if hunk.diff_line is not None
+        for offset in range(len(hunk.lines))
+    }
+    failed = set()
+    for result in results:
+        if result["pass"]:
+            continue
+        blocks = split_findings(result["response"])
+        if not blocks:
+            return {hunk.hash for hunk in hunks}
+        for block in blocks:
+            hunk_hash = lines.get(finding_line(block))
+            if hunk_hash is None:
+                return {hunk.hash for hunk in hunks}
+            failed.add(hunk_hash)
+    return failed
+
+
+class IntegrityIndex:
+    """Merkle trees of the evaluated code, to verify pushes against them.
+
+    Every evaluation stores a tree of hunk hashes under file hashes under a
+    root hash, and all of its nodes are indexed. A push is hashed the same way
+    and compared top down: a known root covers the whole push in one lookup, a
+    known file covers all of its hunks, and only the hunks of the files that
+    differ are looked up. Verification cost follows the differences, and the
+    hunks never evaluated are reported exactly.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(INTEGRITY_SCHEMA)
+        columns = {
+            row[1]
+            for row in self._connection.execute("PRAGMA table_info(evaluated_nodes)")
+        }
+        if "rules" not in columns:
+            # Indexes created before the rules were recorded
+            self._connection.execute(
+                "ALTER TABLE evaluated_nodes ADD COLUMN rules TEXT"
+            )
+
+    def record_evaluation(
+        self,
+        evaluation_id: str,
+        files: list,
+        passed: bool,
+        repository: Optional[str] = None,
+        user: Optional[str] = None,
+        rules: Optional[str] = None,
+        failed: Optional[set] = None,
+    ) -> str:
+        """Store the tree of an evaluation and index its nodes, returns the root.
+
+        The hunks are scoped to `repository`, and `rules` is the signature of
+        the rules that evaluated them. `failed` holds the hashes of the hunks
+        the findings point at (see `failed_hunks`): the other hunks pass, and
+        a file passes when all of its hunks do. Without it every node gets
+        the verdict of the whole evaluation.
+        """
+        scoped_files = scope_files(files, repository)
+        nodes = {}
+        for file, scoped in zip(files, scoped_files):
+            verdicts = [
+                passed if failed is None else hunk.hash not in failed
+                for hunk in file.hunks
+            ]
+            nodes.update(zip((hunk.hash for hunk in scoped.hunks), verdicts))
+            nodes[scoped.hash] = all(verdicts) if verdicts else passed
+        root = merkle_root(scoped_files)
+        nodes[root] = passed
+        tree = json.dumps([file.to_dict() for file in scoped_files])
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO evaluated_trees VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    evaluation_id,
+                    root,
+                    int(passed),
+                    repository,
+                    user,
+                    datetime.now(timezone.utc).isoformat(),
+                    tree,
+                ),
+            )
+            self._connection.executemany(
+                NODE_UPSERT,
+                [
+                    (node, evaluation_id, int(verdict), rules)
+                    for node, verdict in nodes.items()
+                ],
+            )
+        return root
+
+    def _lookup(self, hashes: list) -> dict:
+        """`{hash: (evaluation_id, passed)}` of the evaluated nodes among hashes."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+                batch = hashes[start : start + LOOKUP_BATCH_SIZE]
+                rows = self._connection.execute(
+                    "SELECT hash, evaluation_id, passed FROM evaluated_nodes "
+                    f"WHERE hash IN ({', '.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                found.update((row[0], (row[1], bool(row[2]))) for row in rows)
+        return found
+
+    def verify(self, files: list, repository: Optional[str] = None) -> dict:
+        """Coverage of pushed files by the evaluations, from the root down."""
+        files = scope_files(files, repository)
+        root = merkle_root(files)
+        lookups = 1
+        node = self._lookup([root]).get(root)
+        if node is not None:
+            return self._report(root, files, {}, node, lookups)
+        file_nodes = self._lookup([file.hash for file in files])
+        lookups += len(files)
+        pending = [
+            hunk.hash
+            for file in files
+            if file.hash not in file_nodes
+            for hunk in file.hunks
+        ]
+        hunk_nodes = self._lookup(pending)
+        lookups += len(pending)
+        return self._report(root, files, {**file_nodes, **hunk_nodes}, None, lookups)
+
+    @staticmethod
+    def _report(root: str, files: list, nodes: dict, root_node, lookups: int):
+        results, unevaluated, evaluations = [], [], set()
+        for file in files:
+            node = root_node or nodes.get(file.hash)
+            if node is not None:
+                evaluations.add(node[0])
+                status = "passed" if node[1] else "failed"
+                results.append(
+                    {"path": file.path, "status": status, "evaluation_id": node[0]}
+                )
+                continue
+            hunks = []
+            for hunk in file.hunks:
+                hunk_node = nodes.get(hunk.hash)
+                entry = {
+                    "start_line": hunk.start_line,
+                    "end_line": hunk.end_line,
+                    "hash": hunk.hash,
+                    "status": "unevaluated",
+                    "evaluation_id": None,
+                }
+                if hunk_node is None:
+                    unevaluated.append({"path": file.path, **entry})
+                else:
+                    evaluations.add(hunk_node[0])
+                    entry["status"] = "passed" if hunk_node[1] else "failed"
+                    entry["evaluation_id"] = hunk_node[0]
+                hunks.append(entry)
+            statuses = {hunk["status"] for hunk in hunks}
+            status = next(
+                (s for s in ("unevaluated", "failed") if s in statuses), "passed"
+            )
+            results.append({"path": file.path, "status": status, "hunks": hunks})
+        return {
+            "root": root,
+            "covered": not unevaluated,
+            "passed": all(result["status"] == "passed" for result in results),
+            "files": results,
+            "unevaluated": unevaluated,
+            "evaluations": sorted(evaluations),
+            "lookups": lookups,
+        }
+
+    def get_tree(self, evaluation_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT root, passed, repository, user, created_at, tree "
+                "FROM evaluated_trees WHERE evaluation_id = ?",
+                (evaluation_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "evaluation_id": evaluation_id,
+            "root": row[0],
+            "passed": bool(row[1]),
+            "repository": row[2],
+            "user": row[3],
+            "created_at": row[4],
+            "files": json.loads(row[5]),
+        }
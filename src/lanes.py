@@ -0,0 +1,215 @@
+"""Script used to share the model call capacity between priority lanes"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+# Constants
+DEFAULT_LANES = {
+    "interactive": {"priority": 0, "reserved": 6, "max_queue": 200},
+    "ci": {"priority": 1, "reserved": 4, "max_queue": 500},
+    "bulk": {"priority": 2, "reserved": 0, "max_concurrency": 4, "max_queue": 1000},
+    "prefetch": {"priority": 3, "reserved": 0, "max_concurrency": 2, "max_queue": 100},
+}
+LANE_SCOPE_PREFIX = "lane:"
+
+
+class LaneFullError(Exception):
+    """Raised when the queue of a lane is full."""
+
+    def __init__(self, lane: str):
+        self.lane = lane
+        super().__init__(f"Lane '{lane}' is at capacity")
+
+
+class Lane:
+    """Configuration, counters and recent timings of one priority lane."""
+
+    def __init__(
+        self,
+        name: str,
+        priority: int,
+        reserved: int = 0,
+        max_concurrency: Optional[int] = None,
+        max_queue: int = 1000,
+        history_size: int = 1000,
+    ):
+        self.name = name
+        self.priority = priority
+        self.reserved = reserved
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.dispatched = 0
+        self.rejected = 0
+        self.waiters = deque()
+        self.waits = deque(maxlen=history_size)
+        self.calls = deque(maxlen=history_size)
+        self.requests = deque(maxlen=history_size)
+
+    def stats(self) -> dict:
+        return {
+            "priority": self.priority,
+            "reserved": self.reserved,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": len(self.waiters),
+            "dispatched": self.dispatched,
+            "rejected": self.rejected,
+            "wait_p50_ms": _percentile_ms(self.waits, 0.5),
+            "wait_p95_ms": _percentile_ms(self.waits, 0.95),
+            "call_p50_ms": _percentile_ms(self.calls, 0.5),
+            "call_p95_ms": _percentile_ms(self.calls, 0.95),
+            "request_p50_ms": _percentile_ms(self.requests, 0.5),
+            "request_p95_ms": _percentile_ms(self.requests, 0.95),
+        }
+
+
+class LaneScheduler:
+    """Dispatches model calls from priority lanes onto a fixed number of slots.
+
+    Every lane owns `reserved` slots no other lane can take, the rest are shared.
+    When a slot frees up it goes to the waiting call of the most urgent lane
+    (lowest `priority`), so interactive calls overtake queued bulk work, while
+    the reservations keep lower lanes from starving. A lane can also be capped
+    with `max_concurrency`, and `max_queue` bounds the calls waiting in it.
+    """
+
+    def __init__(
+        self,
+        total_concurrency: int = 16,
+        lanes: Optional[dict] = None,
+        default: str = "interactive",
+        history_size: int = 1000,
+    ):
+        self.lanes = {
+            name: Lane(name, history_size=history_size, **config)
+            for name, config in (lanes or DEFAULT_LANES).items()
+        }
+        if default not in self.lanes:
+            raise ValueError(f"Unknown default lane '{default}'")
+        self.default = default
+        self.total_concurrency = total_concurrency
+        self.shared = total_concurrency - sum(
+            lane.reserved for lane in self.lanes.values()
+        )
+        if self.shared < 0:
+            raise ValueError("Lane reservations exceed the total concurrency")
+        self._by_priority = sorted(self.lanes.values(), key=lambda lane: lane.priority)
+
+    def resolve(self, requested: Optional[str], scopes: str = "") -> str:
+        """Lane of a request from the token scopes and the requested lane.
+
+        A `lane:<name>` scope sets the most urgent lane the token may use, the
+        default lane otherwise. A request can ask for that lane or a less
+        urgent one, never for a more urgent one.
+        """
+        allowed = [
+            self.lanes[scope[len(LANE_SCOPE_PREFIX) :]]
+            for scope in scopes.split()
+            if scope.startswith(LANE_SCOPE_PREFIX)
+            and scope[len(LANE_SCOPE_PREFIX) :] in self.lanes
+        ]
+        ceiling = (
+            min(allowed, key=lambda lane: lane.priority)
+            if allowed
+            else self.lanes[self.default]
+        )
+        if requested is None:
+            return ceiling.name
+        if requested not in self.lanes:
+            raise ValueError(f"Unknown lane '{requested}'")
+        if self.lanes[requested].priority < ceiling.priority:
+            raise PermissionError(f"Lane '{requested}' not allowed for this token")
+        return requested
+
+    def _shared_in_use(self) -> int:
+        return sum(max(lane.running - lane.reserved, 0) for lane in self.lanes.values())
+
+    def _can_start(self, lane: Lane) -> bool:
+        if lane.max_concurrency is not None and lane.running >= lane.max_concurrency:
+            return False
+        return lane.running < lane.reserved or self._shared_in_use() < self.shared
+
+    def _dispatch(self) -> None:
+        """Hand free slots to the waiting calls, most urgent lanes first."""
+        for lane in self._by_priority:
+            while lane.waiters and self._can_start(lane):
+                waiter = lane.waiters.popleft()
+                if waiter.done():
+                    continue
+                lane.running += 1
+                waiter.set_result(None)
+
+    async def acquire(self, name: str) -> None:
+        lane = self.lanes[name]
+        started = time.perf_counter()
+        urgent_waiting = any(
+            other.waiters
+            for other in self._by_priority
+            if other.priority <= lane.priority
+        )
+        # Own reserved slots are always free to take, shared ones only when no
+        # call of an equal or more urgent lane is waiting for them
+        if self._can_start(lane) and (
+            lane.running < lane.reserved or not urgent_waiting
+        ):
+            lane.running += 1
+            lane.dispatched += 1
+            lane.waits.append(0.0)
+            return
+        if len(lane.waiters) >= lane.max_queue:
+            lane.rejected += 1
+            raise LaneFullError(name)
+        waiter = asyncio.get_running_loop().create_future()
+        lane.waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted right as the call got cancelled
+                self.release(name)
+            elif waiter in lane.waiters:
+                lane.waiters.remove(waiter)
+            raise
+        lane.dispatched += 1
+        lane.waits.append(time.perf_counter() - started)
+
+    def release(self, name: str) -> None:
+        self.lanes[name].running -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, name: Optional[str]):
+        """Hold a model call slot of a lane, the default lane when None."""
+        name = name or self.default
+        await self.acquire(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.lanes[name].calls.append(time.perf_counter() - started)
+            self.release(name)
+
+    def record_request(self, name: str, seconds: float) -> None:
+        """End to end latency of a request served in a lane."""
+        self.lanes[name].requests.append(seconds)
+
+    def stats(self) -> dict:
+        return {
+            "total_concurrency": self.total_concurrency,
+            "shared": self.shared,
+            "shared_in_use": self._shared_in_use(),
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+        }
+
+
+def _percentile_ms(values, ratio: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(ratio * len(values)), len(values) - 1)] * 1000, 1)
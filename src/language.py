@@ -0,0 +1,139 @@
+"""Script used to identify the programming language of source files and snippets"""
+
+import os
+import re
+from typing import Optional
+
+# Constants
+EXTENSION_LANGUAGES = {
+    ".py": "python",
+    ".pyw": "python",
+    ".js": "javascript",
+    ".jsx": "javascript",
+    ".mjs": "javascript",
+    ".cjs": "javascript",
+    ".ts": "typescript",
+    ".tsx": "typescript",
+    ".java": "java",
+    ".kt": "kotlin",
+    ".kts": "kotlin",
+    ".scala": "scala",
+    ".go": "go",
+    ".rs": "rust",
+    ".c": "c",
+    ".h": "c",
+    ".cc": "cpp",
+    ".cpp": "cpp",
+    ".cxx": "cpp",
+    ".hpp": "cpp",
+    ".cs": "csharp",
+    ".php": "php",
+    ".rb": "ruby",
+    ".swift": "swift",
+    ".sh": "shell",
+    ".bash": "shell",
+    ".sql": "sql",
+    ".html": "html",
+    ".vue": "javascript",
+    ".md": "markdown",
+    ".rst": "markdown",
+    ".txt": "text",
+    ".json": "json",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+    ".toml": "toml",
+}
+SHEBANG_LANGUAGES = {
+    "python": "python",
+    "node": "javascript",
+    "deno": "typescript",
+    "bash": "shell",
+    "sh": "shell",
+    "zsh": "shell",
+    "ruby": "ruby",
+    "php": "php",
+}
+SHEBANG_PATTERN = re.compile(r"#!\s*\S*/(?:env\s+(?:-\S+\s+)*)?([a-z]+)")
+# Distinctive tokens per language, every hit adds its weight to the language
+TOKEN_HINTS = {
+    "python": [
+        (r"^\s*def \w+\(.*\)\s*(?:->.*)?:\s*$", 3),
+        (r"^\s*(?:from [\w.]+ )?import [\w., ]+$", 2),
+        (r"\bself\.\w+", 1),
+        (r"^\s*(?:elif|except|with) .*:\s*$", 2),
+    ],
+    "javascript": [
+        (r"\bfunction\s*\w*\s*\(", 2),
+        (r"^\s*(?:const|let|var) \w+\s*=", 2),
+        (r"=>", 1),
+        (r"\brequire\(['\"]", 3),
+        (r"\bconsole\.log\(", 2),
+    ],
+    "typescript": [
+        (r"^\s*(?:export )?interface \w+", 3),
+        (r":\s*(?:string|number|boolean)\b", 2),
+    ],
+    "java": [
+        (r"\bpublic (?:static )?(?:final )?(?:class|void|[A-Z]\w*) ", 3),
+        (r"\bSystem\.out\.", 3),
+        (r"^\s*import java\.", 4),
+    ],
+    "go": [
+        (r"^package \w+$", 3),
+        (r"^func (?:\(.*\) )?\w+\(", 3),
+        (r":=", 1),
+    ],
+    "rust": [(r"\bfn \w+\(", 3), (r"\blet mut\b", 3), (r"^use \w+::", 3)],
+    "php": [(r"<\?php", 6), (r"\$\w+\s*=", 2), (r"\$_(?:GET|POST|REQUEST)\b", 4)],
+    "ruby": [(r"^\s*def \w+[^:]*$", 2), (r"^\s*end$", 2), (r"\bputs\b", 2)],
+    "csharp": [(r"^using System", 4), (r"^\s*namespace \w+", 2)],
+    "c": [(r"^#include\s*[<\"]", 3), (r"\bprintf\(", 2)],
+    "shell": [(r"^\s*(?:echo|export) ", 2), (r"^\s*fi\s*$", 3), (r"\$\{?\w+\}?", 1)],
+    "sql": [(r"\b(?:SELECT|INSERT INTO|UPDATE|DELETE FROM|CREATE TABLE)\b", 2)],
+    "html": [(r"<(?:html|div|body|script|form)\b", 3)],
+    "markdown": [(r"^#{1,6} \S", 2), (r"^\s*[-*] \S", 1), (r"^```", 2)],
+}
+TOKEN_PATTERNS = {
+    language: [(re.compile(pattern, re.MULTILINE), weight) for pattern, weight in hints]
+    for language, hints in TOKEN_HINTS.items()
+}
+# Lines that look like code in any language (calls, assignments, blocks)
+CODE_LINE_PATTERN = re.compile(r"\w\s*\([^()]*\)\s*[;{:]?\s*$|[=;{}]\s*$", re.MULTILINE)
+DOCUMENT_LANGUAGES = {"markdown"}
+# Only the beginning of a snippet is looked at, enough to tell the language
+SAMPLE_CHARACTERS = 4096
+MIN_TOKEN_SCORE = 2
+
+
+def detect_language(
+    path: Optional[str] = None, code: Optional[str] = None
+) -> Optional[str]:
+    """Language of a file or snippet, None when it cannot be told.
+
+    Uses the extension when there is a path, then the shebang and finally a
+    score of distinctive tokens.
+    """
+    if path:
+        language = EXTENSION_LANGUAGES.get(os.path.splitext(path)[1].lower())
+        if language is not None or code is None:
+            return language
+    if not code:
+        return None
+    sample = code[:SAMPLE_CHARACTERS]
+    match = SHEBANG_PATTERN.match(sample)
+    if match:
+        interpreter = match.group(1).rstrip("0123456789.")
+        if interpreter in SHEBANG_LANGUAGES:
+            return SHEBANG_LANGUAGES[interpreter]
+    scores = {
+        language: sum(
+            weight * len(pattern.findall(sample)) for pattern, weight in hints
+        )
+        for language, hints in TOKEN_PATTERNS.items()
+    }
+    if CODE_LINE_PATTERN.search(sample):
+        # Document languages skip rules, never guess one for code looking text
+        for language in DOCUMENT_LANGUAGES:
+            scores.pop(language)
+    language, score = max(scores.items(), key=lambda item: item[1])
+    return language if score >= MIN_TOKEN_SCORE else None
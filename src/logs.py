@@ -0,0 +1,158 @@
+"""Script used to log structured events without blocking the request path"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Constants
+LOGGER_NAME = __package__ or "src"
+CORRELATION_HEADER = "X-Request-ID"
+CORRELATION_PATTERN = re.compile(r"^[\w.:-]{1,64}$")
+DEFAULT_SAMPLE_RATES = {"DEBUG": 0.05, "INFO": 1.0}
+# Attributes every LogRecord has, anything else came in `extra`
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+_handler: Optional["DroppingQueueHandler"] = None
+
+
+def new_correlation_id(candidate: Optional[str] = None) -> str:
+    """The given id when it is safe to log as is, a fresh one otherwise."""
+    if candidate and CORRELATION_PATTERN.match(candidate):
+        return candidate
+    return uuid.uuid4().hex[:16]
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the `extra` fields of the call."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        entry.update(
+            (key, value)
+            for key, value in vars(record).items()
+            if key not in RECORD_ATTRIBUTES
+        )
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the correlation id of the calling context to the record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a share of the records of each level, warnings and above always.
+
+    The decision is derived from the correlation id, so the records of one
+    request are either all kept or all dropped and its fan-out stays whole.
+    """
+
+    def __init__(self, sample_rates: dict):
+        super().__init__()
+        self.sample_rates = sample_rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.sample_rates.get(record.levelname, 1.0)
+        if rate >= 1:
+            return True
+        key = getattr(record, "correlation_id", None)
+        if key is None:
+            return random.random() < rate
+        return zlib.crc32(key.encode("utf-8")) / 2**32 < rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of waiting for a full queue."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Snapshot what can't wait for the listener, without formatting.
+
+        The message is merged with its arguments, which may change later, and
+        the traceback is rendered to `exc_text` so the frames are not kept.
+        The JSON formatting itself is left to the listener thread.
+        """
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(
+    level: str = "INFO",
+    queue_size: int = 10000,
+    sample_rates: Optional[dict] = None,
+) -> DroppingQueueHandler:
+    """Route the project loggers through a bounded queue to a JSON writer.
+
+    Callers only pay for filtering and enqueueing a record, the formatting and
+    the stdout writes happen in the listener thread. Configured once per
+    process, later calls return the existing handler.
+    """
+    global _handler
+    if _handler is not None:
+        return _handler
+    log_queue = queue.Queue(maxsize=queue_size)
+    _handler = DroppingQueueHandler(log_queue)
+    _handler.addFilter(ContextFilter())
+    _handler.addFilter(
+        SamplingFilter(DEFAULT_SAMPLE_RATES if sample_rates is None else sample_rates)
+    )
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, writer, respect_handler_level=False)
+    listener.start()
+    atexit.register(listener.stop)
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.addHandler(_handler)
+    logger.propagate = False
+    return _handler
+
+
+def logging_stats() -> dict:
+    if _handler is None:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "queued": _handler.queue.qsize(),
+        "dropped": _handler.dropped,
+    }
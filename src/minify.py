@@ -0,0 +1,188 @@
+"""Script used to strip the content of a snippet that does not change its findings"""
+
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from .language import CODE_LINE_PATTERN, detect_language
+from .normalize import SLASH_COMMENT_PREFIXES, TOKEN_PATTERN, remap_line_fields
+
+# Constants
+TRIPLE_QUOTES = ('"""', "'''")
+# Encoded data (base64, hex, keys) without spaces
+BLOB_PATTERN = re.compile(r"[A-Za-z0-9+/=_\-\\\n]+")
+# A literal that may be filled with user input is evidence, it is never elided
+INTERPOLATION_PATTERN = re.compile(r"\{|\$|%[-#0 +]*[\w(]|\?")
+# A line with nothing but literals and punctuation, as in embedded data tables
+DATA_LINE_PATTERN = re.compile(
+    r"""^\s*(?:(?:-?\d[\w.+-]*|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|true|false|null|None)"""
+    r"""|[\[\]{}(),:;\s])+$"""
+)
+DATA_LINES_KEPT = 3
+# Languages where `//` always starts a comment, and where it never does (floor
+# division); for any other the tokens before it on its line decide
+SLASH_COMMENT_LANGUAGES = {
+    "javascript",
+    "typescript",
+    "java",
+    "kotlin",
+    "scala",
+    "go",
+    "rust",
+    "c",
+    "cpp",
+    "csharp",
+    "php",
+    "swift",
+}
+NO_SLASH_COMMENT_LANGUAGES = {"python", "ruby", "shell"}
+# Languages with backtick strings (template literals, Go raw strings), anywhere
+# else a backtick is a plain token
+BACKTICK_STRING_LANGUAGES = {"javascript", "typescript", "go"}
+
+
+@dataclass
+class MinifiedCode:
+    """Minified snippet with the original line of each of its lines."""
+
+    text: str
+    line_map: list
+    original_chars: int
+
+    def to_original(self, line: int) -> int:
+        if 1 <= line <= len(self.line_map):
+            return self.line_map[line - 1]
+        return line
+
+    def remap(self, response: str) -> str:
+        """Move the `line:` fields of a response back to the original lines."""
+        return remap_line_fields(response, self.to_original)
+
+    def metrics(self) -> dict:
+        return {
+            "originalChars": self.original_chars,
+            "minifiedChars": len(self.text),
+            "minifyRatio": round(1 - len(self.text) / max(self.original_chars, 1), 4),
+        }
+
+
+def minify(
+    code: str,
+    language: Optional[str] = None,
+    max_literal_chars: int = 512,
+    blob_literal_chars: int = 128,
+    literal_prefix_chars: int = 64,
+    max_data_lines: int = 20,
+) -> MinifiedCode:
+    """Drop comments, blank lines and trailing spaces, and elide large literals.
+
+    A literal is elided, keeping its first `literal_prefix_chars`, when it is
+    an encoded blob longer than `blob_literal_chars` or any literal longer
+    than `max_literal_chars` without interpolation markers. Runs of more than
+    `max_data_lines` data-only lines keep their first and last lines.
+    Indentation is kept, so the structure of the code reads the same. The
+    `language` (detected from the code when None) decides which comments and
+    strings there are, and a literal spanning lines that look like code is
+    never elided: a misread string must not hide the code after it.
+    """
+    language = language or detect_language(code=code)
+    backtick_strings = language in BACKTICK_STRING_LANGUAGES
+    lines, line_map = [], []
+    current, start = [], None
+    line_number, position, previous = 1, 0, None
+
+    def end_line():
+        nonlocal current, start
+        text = "".join(current).rstrip()
+        if text.strip():
+            lines.append(text)
+            line_map.append(start)
+        current, start = [], None
+
+    while position < len(code):
+        match = TOKEN_PATTERN.match(code, position)
+        kind, value = match.lastgroup, match.group()
+        if kind == "string" and value[0] == "`" and not backtick_strings:
+            kind, value = "token", "`"
+        if kind == "slash_comment" and not _is_slash_comment(language, previous):
+            # Not a comment (e.g. Python floor division), emit `/` and keep scanning
+            kind, value = "token", "/"
+        position += len(value)
+        if kind == "newline":
+            end_line()
+            previous = None
+        elif kind == "space":
+            current.append(value)
+        elif kind in ("string", "token"):
+            text = value
+            if kind == "string":
+                text = _elide(
+                    value, max_literal_chars, blob_literal_chars, literal_prefix_chars
+                )
+            for offset, part in enumerate(text.split("\n")):
+                if offset:
+                    end_line()
+                if part:
+                    start = start or line_number + offset
+                    current.append(part)
+            previous = value
+        line_number += value.count("\n")
+    end_line()
+    lines, line_map = _collapse_data(lines, line_map, max_data_lines)
+    return MinifiedCode("\n".join(lines), line_map, len(code))
+
+
+def _is_slash_comment(language: Optional[str], previous: Optional[str]) -> bool:
+    if language in SLASH_COMMENT_LANGUAGES:
+        return True
+    if language in NO_SLASH_COMMENT_LANGUAGES:
+        return False
+    return previous in SLASH_COMMENT_PREFIXES
+
+
+def _elide(value: str, max_chars: int, blob_chars: int, prefix_chars: int) -> str:
+    quote = value[:3] if value[:3] in TRIPLE_QUOTES else value[0]
+    inner = value[len(quote) : -len(quote)]
+    blob = len(inner) > blob_chars and BLOB_PATTERN.fullmatch(inner)
+    large = (
+        len(inner) > max_chars
+        and not INTERPOLATION_PATTERN.search(inner)
+        and not ("\n" in inner and CODE_LINE_PATTERN.search(inner))
+    )
+    if not (blob or large):
+        return value
+    elided = f"...[{len(inner) - prefix_chars} chars elided]"
+    return f"{quote}{inner[:prefix_chars]}{elided}{quote}"
+
+
+def _collapse_data(lines: list, line_map: list, max_data_lines: int):
+    """Keep the first and last lines of every long run of data-only lines."""
+    kept_lines, kept_map, run = [], [], []
+
+    def close_run():
+        if len(run) > max(max_data_lines, DATA_LINES_KEPT + 1):
+            # The last line usually closes the structure, it is kept too
+            elided = run[DATA_LINES_KEPT:-1]
+            first = lines[elided[0]]
+            indent = first[: len(first) - len(first.lstrip())]
+            kept = [*run[:DATA_LINES_KEPT], None, run[-1]]
+        else:
+            kept = run
+        for index in kept:
+            if index is None:
+                kept_lines.append(f"{indent}... [{len(elided)} lines of data elided]")
+                kept_map.append(line_map[elided[0]])
+            else:
+                kept_lines.append(lines[index])
+                kept_map.append(line_map[index])
+        run.clear()
+
+    for index, line in enumerate(lines):
+        if DATA_LINE_PATTERN.match(line):
+            run.append(index)
+            continue
+        close_run()
+        kept_lines.append(line)
+        kept_map.append(line_map[index])
+    close_run()
+    return kept_lines, kept_map
@@ -0,0 +1,164 @@
+"""Script used to canonicalize code snippets before the cache lookup"""
+
+import ast
+import hashlib
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+
+# Constants
+TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<block_comment>/\*.*?\*/|<!--.*?-->)
+  | (?P<string>\"\"\".*?\"\"\"|'''.*?'''|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)
+  | (?P<hash_comment>\#(?=[\s\#!]|$)[^\n]*)
+  | (?P<slash_comment>//[^\n]*)
+  | (?P<newline>\n)
+  | (?P<space>[^\S\n]+)
+  | (?P<token>\w+|[^\w\s])
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+# Tokens after which a `//` can only start a comment (avoids Python floor division)
+SLASH_COMMENT_PREFIXES = {None, ";", "{", "}", ","}
+LINE_FIELD_PATTERN = re.compile(r"(\bline:[ \t]*)([^\n]*)")
+NUMBER_PATTERN = re.compile(r"\d+")
+
+
+@dataclass
+class CanonicalCode:
+    """Semantic fingerprint of a code snippet.
+
+    `line_map` holds, for every canonical unit (a statement for Python, a
+    non-empty token line otherwise), the original line where it starts. Two
+    snippets with the same fingerprint have unit-by-unit equivalent maps, which
+    is what allows findings to be moved from one to the other.
+    """
+
+    text: str
+    fingerprint: str
+    line_map: list
+    method: str
+
+
+def canonicalize(code: str) -> CanonicalCode:
+    """Build the canonical form of a snippet, AST based when it is valid Python."""
+    try:
+        return _canonicalize_python(code)
+    except (SyntaxError, ValueError, RecursionError):
+        return _canonicalize_tokens(code)
+
+
+def _canonicalize_python(code: str) -> CanonicalCode:
+    tree = ast.parse(code)
+    _strip_docstrings(tree)
+    text = ast.dump(tree, annotate_fields=False, include_attributes=False)
+    return CanonicalCode(
+        text=text,
+        fingerprint=_hash("ast", text),
+        line_map=list(_statement_lines(tree)),
+        method="ast",
+    )
+
+
+def _strip_docstrings(tree: ast.AST) -> None:
+    """Remove the docstrings of modules, classes and functions in place."""
+    for node in ast.walk(tree):
+        if not isinstance(
+            node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+        ):
+            continue
+        body = node.body
+        if (
+            body
+            and isinstance(body[0], ast.Expr)
+            and isinstance(body[0].value, ast.Constant)
+            and isinstance(body[0].value.value, str)
+        ):
+            docstring = body.pop(0)
+            if not body:
+                body.append(ast.copy_location(ast.Pass(), docstring))
+
+
+def _statement_lines(node: ast.AST):
+    """Start line of every statement in source (pre-order) order."""
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, ast.stmt):
+            yield child.lineno
+        yield from _statement_lines(child)
+
+
+def _canonicalize_tokens(code: str) -> CanonicalCode:
+    lines, line_map = [], []
+    current, current_start = [], None
+    line_number = 1
+    position = 0
+    while position < len(code):
+        kind, value = _next_token(code, position)
+        previous = current[-1] if current else None
+        if kind == "slash_comment" and previous not in SLASH_COMMENT_PREFIXES:
+            # Not a comment (e.g. Python floor division), emit `/` and keep scanning
+            kind, value = "token", "/"
+        if kind == "newline":
+            if current:
+                lines.append(" ".join(current))
+                line_map.append(current_start)
+            current, current_start = [], None
+        elif kind in ("string", "token"):
+            if current_start is None:
+                current_start = line_number
+            current.append(value)
+        position += len(value)
+        line_number += value.count("\n")
+    if current:
+        lines.append(" ".join(current))
+        line_map.append(current_start)
+    text = "\n".join(lines)
+    return CanonicalCode(
+        text=text,
+        fingerprint=_hash("tokens", text),
+        line_map=line_map,
+        method="tokens",
+    )
+
+
+def _next_token(code: str, position: int) -> tuple[str, str]:
+    match = TOKEN_PATTERN.match(code, position)
+    return match.lastgroup, match.group()
+
+
+def _hash(method: str, text: str) -> str:
+    return hashlib.sha256(f"{method}\n{text}".encode("utf-8")).hexdigest()
+
+
+def map_line(line: int, source_map: list, target_map: list) -> int:
+    """Translate a line of the source snippet to the equivalent target line."""
+    if not source_map or not target_map:
+        return line
+    index = max(bisect_right(source_map, line) - 1, 0)
+    offset = max(line - source_map[index], 0)
+    target = target_map[index]
+    if index + 1 < len(target_map):
+        offset = min(offset, max(target_map[index + 1] - target - 1, 0))
+    return target + offset
+
+
+def remap_findings(response: str, source_map: list, target_map: list) -> str:
+    """Rewrite the `line:` fields of a YAML response between two line maps."""
+    if source_map == target_map:
+        return response
+    return remap_line_fields(
+        response, lambda line: map_line(line, source_map, target_map)
+    )
+
+
+def remap_line_fields(response: str, mapper) -> str:
+    """Apply a line number mapper to every `line:` field of a YAML response."""
+
+    def _remap_field(match: re.Match) -> str:
+        value = NUMBER_PATTERN.sub(
+            lambda number: str(mapper(int(number.group()))), match.group(2)
+        )
+        return match.group(1) + value
+
+    return LINE_FIELD_PATTERN.sub(_remap_field, response)
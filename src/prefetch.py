@@ -0,0 +1,373 @@
+"""Script used to evaluate code ahead of the commit, so commits hit a warm cache"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Optional
+
+from .admission import OverloadedError
+from .guardrails import GuardrailResult, PromptInjectionError
+from .language import detect_language
+from .lanes import LaneFullError
+from .logs import correlation_id, new_correlation_id
+from .scanner import MAX_FILE_BYTES
+
+# Constants
+PREFETCH_LANE = "prefetch"
+GIT_TIMEOUT_SECONDS = 120
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Spends at most `rate` estimated tokens per second, bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self, amount: float) -> None:
+        """Wait until `amount` tokens are available and spend them.
+
+        A cost above the burst waits for a full bucket, it would never fit.
+        """
+        amount = min(amount, self.burst)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def level(self) -> float:
+        self._refill()
+        return round(self.tokens, 1)
+
+
+@dataclass
+class PrefetchItem:
+    code: str
+    guardrail_result: GuardrailResult
+    language: Optional[str]
+    repository: Optional[str]
+    path: Optional[str]
+    key: str
+
+
+class Prefetcher:
+    """Evaluates snippets in the background to fill the result cache.
+
+    Snippets wait in a bounded queue and `concurrency` workers evaluate them
+    the way /evaluate would, so the same cache entries get filled. Prefetch
+    work never competes with the requests: its model calls run in the lowest
+    priority lane, it is admitted only within the `prefetch` share of the
+    backlog, and the estimated tokens it spends are capped by a token bucket
+    of `tokens_per_second`. Snippets already cached cost nothing.
+    """
+
+    def __init__(
+        self,
+        workflow,
+        lane: str = PREFETCH_LANE,
+        tokens_per_second: float = 200,
+        burst_tokens: float = 20_000,
+        max_queue: int = 200,
+        concurrency: int = 1,
+        retry_after: int = 30,
+    ):
+        if lane not in workflow.lanes.lanes:
+            raise ValueError(f"Unknown prefetch lane '{lane}'")
+        self.workflow = workflow
+        self.lane = lane
+        self.bucket = TokenBucket(tokens_per_second, burst_tokens)
+        self.concurrency = concurrency
+        self.retry_after = retry_after
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self._queued = set()
+        self._workers = []
+        self.counters = {
+            "queued": 0,
+            "duplicate": 0,
+            "rejected": 0,
+            "prefetched": 0,
+            "warm": 0,
+            "failed": 0,
+            "tokens": 0,
+        }
+
+    def start(self) -> None:
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(
+        self,
+        code: str,
+        guardrail_result: GuardrailResult,
+        language: Optional[str] = None,
+        repository: Optional[str] = None,
+        path: Optional[str] = None,
+        wait: bool = False,
+    ) -> str:
+        """Queue a screened snippet, `"queued"` or `"duplicate"` if already queued.
+
+        Raises LaneFullError when the queue is full, unless `wait` is set.
+        """
+        key = hashlib.sha256(f"{language}\0{code}".encode("utf-8")).hexdigest()
+        if key in self._queued:
+            self.counters["duplicate"] += 1
+            return "duplicate"
+        item = PrefetchItem(code, guardrail_result, language, repository, path, key)
+        if wait:
+            await self.queue.put(item)
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self.counters["rejected"] += 1
+                raise LaneFullError(self.lane)
+        self._queued.add(key)
+        self.counters["queued"] += 1
+        return "queued"
+
+    async def _work(self) -> None:
+        while True:
+            item = await self.queue.get()
+            # Each prefetch gets its own id in the logs
+            token = correlation_id.set(new_correlation_id())
+            try:
+                await self._prefetch(item)
+            except Exception as e:
+                self.counters["failed"] += 1
+                logger.warning(
+                    "Prefetch failed",
+                    extra={"path": item.path, "repository": item.repository},
+                    exc_info=e,
+                )
+            finally:
+                correlation_id.reset(token)
+                self._queued.discard(item.key)
+                self.queue.task_done()
+
+    async def _prefetch(self, item: PrefetchItem) -> None:
+        workflow = self.workflow
+        # Looking up the cache may hit the database, keep it off the loop
+        calls, tokens = await asyncio.get_running_loop().run_in_executor(
+            None,
+            partial(
+                workflow.estimate_cost,
+                item.guardrail_result.code,
+                item.language,
+                skip_cached=True,
+            ),
+        )
+        if not calls:
+            self.counters["warm"] += 1
+            return
+        await self.bucket.take(tokens)
+        while True:
+            try:
+                ticket = workflow.admission.admit(self.lane, calls, tokens)
+                break
+            except OverloadedError as e:
+                # Requests come first, retry once the backlog drained
+                await asyncio.sleep(e.retry_after)
+        with ticket:
+            if workflow.two_phase_enabled:
+                await workflow.run_async_verdicts(
+                    item.code,
+                    item.guardrail_result,
+                    repository=item.repository,
+                    language=item.language,
+                    lane=self.lane,
+                )
+            else:
+                await workflow.run_async_inference(
+                    item.code,
+                    item.guardrail_result,
+                    repository=item.repository,
+                    language=item.language,
+                    lane=self.lane,
+                )
+        self.counters["prefetched"] += 1
+        self.counters["tokens"] += tokens
+        logger.debug(
+            "Prefetched",
+            extra={"path": item.path, "repository": item.repository, "calls": calls},
+        )
+
+    def stats(self) -> dict:
+        return {
+            "lane": self.lane,
+            "pending": self.queue.qsize(),
+            "max_queue": self.queue.maxsize,
+            "bucket_tokens": self.bucket.level(),
+            **self.counters,
+        }
+
+
+class CacheWarmer:
+    """Periodically prefetches the files of the default branch of repositories.
+
+    Every `interval_seconds` each configured clone is (optionally) fetched and,
+    when its branch moved, the files changed since the last warmed commit (all
+    of them the first time) are read with git and queued in the prefetcher.
+    Feature branches share most of their files with the default branch, so
+    their commits mostly hit warm entries. Repositories are configured as
+    `{"path": ..., "repository": ..., "branch": ..., "fetch": ...}`, the
+    branch defaults to the one `origin/HEAD` points to.
+    """
+
+    def __init__(
+        self,
+        prefetcher: Prefetcher,
+        repositories: Optional[list] = None,
+        interval_seconds: float = 900,
+        max_file_bytes: int = MAX_FILE_BYTES,
+    ):
+        self.prefetcher = prefetcher
+        self.repositories = repositories or []
+        self.interval_seconds = interval_seconds
+        self.max_file_bytes = max_file_bytes
+        self.warmed = {}
+        self._task = None
+
+    def start(self) -> None:
+        if self.repositories:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            for repository in self.repositories:
+                try:
+                    await self.warm(**repository)
+                except Exception as e:
+                    logger.warning(
+                        "Cache warming failed",
+                        extra={"path": repository.get("path")},
+                        exc_info=e,
+                    )
+            await asyncio.sleep(self.interval_seconds)
+
+    async def warm(
+        self,
+        path: str,
+        repository: Optional[str] = None,
+        branch: Optional[str] = None,
+        fetch: bool = False,
+    ) -> int:
+        """Queue the files of a branch changed since its last warming."""
+        if fetch:
+            await _git(path, "fetch", "--quiet", "origin")
+        if branch is None:
+            try:
+                branch = await _git(
+                    path, "symbolic-ref", "--short", "refs/remotes/origin/HEAD"
+                )
+            except RuntimeError:
+                branch = "HEAD"
+        commit = await _git(path, "rev-parse", "--verify", f"{branch}^{{commit}}")
+        previous = self.warmed.get(path, {}).get("commit")
+        if commit == previous:
+            return 0
+        if previous is None:
+            listing = await _git(path, "ls-tree", "-r", "--name-only", commit)
+        else:
+            listing = await _git(
+                path, "diff", "--name-only", "--diff-filter=d", previous, commit
+            )
+        queued = 0
+        workflow = self.prefetcher.workflow
+        for relative in filter(None, listing.split("\n")):
+            language = detect_language(relative)
+            if language is None or not workflow.rules_for(language):
+                continue
+            code = await self._read(path, commit, relative)
+            if code is None:
+                continue
+            try:
+                guardrail_result = workflow.guardrail.check(code)
+            except PromptInjectionError:
+                continue
+            # Waits for room in the queue, the warming goes at prefetch pace
+            status = await self.prefetcher.submit(
+                code,
+                guardrail_result,
+                language=language,
+                repository=repository,
+                path=relative,
+                wait=True,
+            )
+            queued += status == "queued"
+        self.warmed[path] = {
+            "repository": repository,
+            "branch": branch,
+            "commit": commit,
+            "queued": queued,
+            "timestamp": time.time(),
+        }
+        logger.info(
+            "Cache warming queued",
+            extra={"repository": repository, "commit": commit, "files": queued},
+        )
+        return queued
+
+    async def _read(self, path: str, commit: str, relative: str) -> Optional[str]:
+        size = await _git(path, "cat-file", "-s", f"{commit}:{relative}")
+        if int(size) > self.max_file_bytes:
+            return None
+        data = await _git(path, "show", f"{commit}:{relative}", text=False)
+        if b"\0" in data[:8192]:
+            return None
+        return data.decode("utf-8", errors="replace")
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval_seconds,
+            "running": self._task is not None and not self._task.done(),
+            "repositories": dict(self.warmed),
+        }
+
+
+async def _git(path: str, *args: str, text: bool = True):
+    """Output of a git command in the `path` clone, RuntimeError on failure."""
+    process = await asyncio.create_subprocess_exec(
+        "git",
+        "-C",
+        path,
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            process.communicate(), GIT_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        process.kill()
+        raise RuntimeError(f"git {args[0]} timed out")
+    if process.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {stderr.decode().strip()}")
+    return stdout.decode("utf-8", errors="replace").strip() if text else stdout
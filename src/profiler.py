@@ -0,0 +1,382 @@
+"""Script used to sample the stacks of the service threads for live profiling"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+# Constants
+PROFILE_HEADER = "X-Profile"
+PROFILE_SCOPE = "admin:profile"
+DEFAULT_INTERVAL_MS = 10
+DEFAULT_MAX_SECONDS = 60
+MAX_STACK_DEPTH = 64
+MAX_REQUEST_PROFILES = 4
+TOP_FUNCTIONS = 10
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Phase of the frames of this package, by file and function (None for any).
+# The phase of a sample is the one of the frame closest to its leaf
+PACKAGE_PHASES = {
+    ("auth_utils.py", None): "auth",
+    ("ingest.py", None): "ingest",
+    ("guardrails.py", None): "guardrails",
+    ("normalize.py", None): "preprocessing",
+    ("segment.py", None): "preprocessing",
+    ("similarity.py", None): "preprocessing",
+    ("cache.py", None): "cache",
+    ("retrieval.py", None): "prompt",
+    ("minify.py", None): "prompt",
+    ("minify.py", "remap"): "parsing",
+    ("agent.py", "run_inference"): "prompt",
+    ("agent.py", "is_pass"): "parsing",
+    ("findings.py", None): "parsing",
+}
+LIBRARY_PHASES = (
+    (f"{os.sep}jwt{os.sep}", "auth"),
+    (f"{os.sep}strands{os.sep}", "agent"),
+    (f"{os.sep}yaml{os.sep}", "parsing"),
+)
+# A thread waiting for work: under its waits is the loop of a worker
+WAIT_FILES = {"threading.py", "queue.py", "selectors.py"}
+IDLE_CALLERS = {
+    ("base_events.py", "_run_once"),
+    ("thread.py", "_worker"),
+    ("handlers.py", "dequeue"),
+    ("_asyncio.py", "run"),
+}
+THREAD_NUMBER_PATTERN = re.compile(r"[-_]\d+")
+
+logger = logging.getLogger(__name__)
+
+# Profile of the request being served, inherited by its tasks
+current_profile = contextvars.ContextVar("current_profile", default=None)
+# Executor threads running work of a profiled request, read by the sampler
+_thread_profiles = {}
+_thread_profiles_lock = threading.Lock()
+
+
+def tagged(function: Callable) -> Callable:
+    """Function that credits the thread running it to the current profile.
+
+    Called where the work is submitted, so the time spent waiting for an
+    executor thread is measured too. Without a profiled request the function
+    is returned as is.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return function
+    submitted = time.perf_counter()
+
+    def run(*args, **kwargs):
+        ident = threading.get_ident()
+        profile.queue_waits.append(time.perf_counter() - submitted)
+        with _thread_profiles_lock:
+            _thread_profiles[ident] = profile
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with _thread_profiles_lock:
+                _thread_profiles.pop(ident, None)
+
+    return run
+
+
+@dataclass(eq=False)
+class RequestProfile:
+    """Samples of the threads working for one request."""
+
+    started: float = field(default_factory=time.perf_counter)
+    samples: int = 0
+    phases: Counter = field(default_factory=Counter)
+    functions: Counter = field(default_factory=Counter)
+    queue_waits: list = field(default_factory=list)
+    # Whether loop samples could be told apart from other requests, they are
+    # left out when not
+    loop_attribution: str = "exact"
+
+    def add(self, phase: str, label: str) -> None:
+        self.samples += 1
+        self.phases[phase] += 1
+        self.functions[label] += 1
+
+
+@dataclass
+class ProfileSession:
+    """Collapsed stacks of every thread during a profiling window."""
+
+    seconds: float
+    interval: float
+    include_idle: bool
+    stacks: Counter = field(default_factory=Counter)
+    samples: int = 0
+    sampling_seconds: float = 0.0
+
+    def collapsed(self) -> str:
+        """One `thread;root;...;leaf count` line per stack, as flamegraphs read."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.items())
+
+    def to_dict(self) -> dict:
+        return {
+            "seconds": self.seconds,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            # Share of the window the sampler held the interpreter
+            "overhead": round(self.sampling_seconds / self.seconds, 4),
+            "stacks": [
+                {"stack": stack, "count": count}
+                for stack, count in self.stacks.most_common()
+            ],
+        }
+
+
+class StackSampler:
+    """Wall-clock sampler of the stacks of all the threads of the process.
+
+    Every `interval_ms` a background thread reads the current frame of each
+    thread with `sys._current_frames`, nothing is instrumented and the sampler
+    only runs while someone profiles. `profile` collects the stacks of all the
+    threads for a window (waiting threads left out unless `include_idle`).
+    Request profiles only keep the samples of the threads working for their
+    request: the executor threads of its rule calls, and the event loop while
+    it runs one of the request tasks (`Task.get_context`, Python 3.12+; on
+    older versions loop samples are left out of the request profiles).
+    """
+
+    def __init__(
+        self,
+        interval_ms: float = DEFAULT_INTERVAL_MS,
+        max_seconds: float = DEFAULT_MAX_SECONDS,
+        max_depth: int = MAX_STACK_DEPTH,
+        max_request_profiles: int = MAX_REQUEST_PROFILES,
+    ):
+        self.interval = interval_ms / 1000
+        self.max_seconds = max_seconds
+        self.max_depth = max_depth
+        self.max_request_profiles = max_request_profiles
+        self.loop = None
+        self.loop_thread = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._session = None
+        self._requests = []
+        self._thread_names = {}
+        self._labels = {}
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Set the event loop of the service, call from its thread."""
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+
+    async def profile(self, seconds: float, include_idle: bool = False):
+        """Sample all the threads for `seconds`, RuntimeError if already running."""
+        seconds = min(seconds, self.max_seconds)
+        with self._lock:
+            if self._session is not None:
+                raise RuntimeError("A profile is already running")
+            session = self._session = ProfileSession(
+                seconds, self.interval, include_idle
+            )
+            self._ensure_running()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            with self._lock:
+                self._session = None
+        return session
+
+    def start_request(self) -> Optional[RequestProfile]:
+        """Profile of a new request, None when too many are being profiled."""
+        with self._lock:
+            if len(self._requests) >= self.max_request_profiles:
+                return None
+            profile = RequestProfile()
+            self._requests.append(profile)
+            self._ensure_running()
+        return profile
+
+    def finish_request(self, profile: RequestProfile) -> None:
+        with self._lock:
+            if profile in self._requests:
+                self._requests.remove(profile)
+
+    def summary(self, profile: RequestProfile) -> dict:
+        """Where the time of a request went, in milliseconds of thread time.
+
+        Rule calls run in parallel threads, so the phases may add up to more
+        than the duration of the request.
+        """
+        to_ms = self.interval * 1000
+        with self._lock:
+            phases = profile.phases.most_common()
+            functions = profile.functions.most_common(TOP_FUNCTIONS)
+            samples = profile.samples
+        waits = list(profile.queue_waits)
+        return {
+            "duration_ms": round((time.perf_counter() - profile.started) * 1000, 1),
+            "interval_ms": to_ms,
+            "samples": samples,
+            "phases_ms": {phase: round(count * to_ms, 1) for phase, count in phases},
+            "executor_queue_ms": {
+                "calls": len(waits),
+                "total": round(sum(waits) * 1000, 1),
+                "max": round(max(waits, default=0) * 1000, 1),
+            },
+            "top_functions": [
+                {"function": label, "ms": round(count * to_ms, 1)}
+                for label, count in functions
+            ],
+            "loop_attribution": profile.loop_attribution,
+        }
+
+    def _ensure_running(self) -> None:
+        # Called with the lock held
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="stack-sampler", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                if self._session is None and not self._requests:
+                    self._thread = None
+                    return
+                started = time.perf_counter()
+                try:
+                    self._sample(own)
+                except Exception as e:
+                    logger.warning("Stack sample failed: %s", e)
+                if self._session is not None:
+                    self._session.sampling_seconds += time.perf_counter() - started
+            time.sleep(self.interval)
+
+    def _sample(self, own: int) -> None:
+        # Called with the lock held
+        session = self._session
+        if session is not None:
+            session.samples += 1
+        loop_profiles = self._loop_profiles() if self._requests else []
+        with _thread_profiles_lock:
+            thread_profiles = dict(_thread_profiles)
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            frames = self._frames(frame)
+            profile = thread_profiles.get(ident)
+            if profile not in self._requests:
+                # Work still running for a finished request
+                profile = None
+            profiles = (
+                [profile]
+                if profile is not None
+                else loop_profiles if ident == self.loop_thread else []
+            )
+            if session is None and not profiles:
+                continue
+            labels = [self._label(entry) for entry in frames]
+            if profiles:
+                # The function reported is the one that decided the phase
+                phase, index = _phase(frames)
+                for profile in profiles:
+                    profile.add(phase, labels[index])
+            if session is not None and (session.include_idle or not _idle(frames)):
+                labels.append(self._thread_name(ident))
+                session.stacks[";".join(reversed(labels))] += 1
+
+    def _loop_profiles(self) -> list:
+        """Profiled requests the event loop is working for right now."""
+        if self.loop is None:
+            return []
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            return []
+        if task is None:
+            return []
+        get_context = getattr(task, "get_context", None)
+        if get_context is None:
+            # Any request, profiled or not, may own the task
+            for profile in self._requests:
+                profile.loop_attribution = "unavailable"
+            return []
+        profile = get_context().get(current_profile)
+        return [profile] if profile in self._requests else []
+
+    def _frames(self, frame) -> list:
+        """`(file, function, qualified name)` of the frames, leaf first."""
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            frames.append(
+                (
+                    code.co_filename,
+                    code.co_name,
+                    getattr(code, "co_qualname", code.co_name),
+                )
+            )
+            frame = frame.f_back
+        if frame is not None:
+            frames.append(("", "(truncated)", "(truncated)"))
+        return frames
+
+    def _label(self, entry: tuple) -> str:
+        label = self._labels.get(entry)
+        if label is None:
+            filename, _, qualname = entry
+            label = self._labels[entry] = (
+                f"{qualname} ({_short_path(filename)})" if filename else qualname
+            )
+        return label
+
+    def _thread_name(self, ident: int) -> str:
+        name = self._thread_names.get(ident)
+        if name is None:
+            self._thread_names = {
+                thread.ident: THREAD_NUMBER_PATTERN.sub("", thread.name)
+                for thread in threading.enumerate()
+            }
+            name = self._thread_names.get(ident, "unknown")
+        return name
+
+
+def _phase(frames: list) -> tuple[str, int]:
+    """Phase of a sample and the index of the frame that decided it."""
+    for index, (filename, function, _) in enumerate(frames):
+        if filename.startswith(PACKAGE_DIR):
+            name = os.path.basename(filename)
+            phase = PACKAGE_PHASES.get((name, function)) or PACKAGE_PHASES.get(
+                (name, None)
+            )
+            if phase is not None:
+                return phase, index
+            continue
+        for fragment, phase in LIBRARY_PHASES:
+            if fragment in filename:
+                return phase, index
+    return "other", 0
+
+
+def _idle(frames: list) -> bool:
+    for filename, function, _ in frames:
+        name = os.path.basename(filename)
+        if name not in WAIT_FILES:
+            return (name, function) in IDLE_CALLERS
+    return False
+
+
+def _short_path(filename: str) -> str:
+    """Path relative to the longest `sys.path` entry that contains it."""
+    best = ""
+    for entry in sys.path:
+        if entry and filename.startswith(entry + os.sep) and len(entry) > len(best):
+            best = entry
+    return filename[len(best) + 1 :] if best else filename
@@ -0,0 +1,410 @@
+"""Script used to evaluate a range of commits once per distinct hunk"""
+
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .findings import finding_line, split_findings
+from .integrity import HUNK_HEADER_PATTERN, FileNode, Hunk, make_hunk
+from .normalize import remap_line_fields
+
+# Constants
+MAX_SNIPPET_LINES = 400
+DEV_NULL = "/dev/null"
+
+
+@dataclass
+class DiffBlock:
+    """One `@@` block: where it starts on each side and its `(op, text)` lines."""
+
+    old_start: int
+    old_count: int
+    new_start: int
+    lines: list = field(default_factory=list)
+
+
+@dataclass
+class FilePatch:
+    """Changes of one file in a diff, a None path is a created or deleted file."""
+
+    old_path: Optional[str]
+    new_path: Optional[str]
+    blocks: list = field(default_factory=list)
+
+
+@dataclass
+class NetHunk:
+    """Added lines that survive to the end of the range, with their commits."""
+
+    path: str
+    hunk: Hunk
+    commits: list
+
+
+def _strip_prefix(path: str) -> Optional[str]:
+    path = path.split("\t")[0].strip()
+    if path == DEV_NULL:
+        return None
+    return path[2:] if path[:2] in ("a/", "b/") else path
+
+
+def parse_patches(diff: str) -> list:
+    """File patches of a unified diff, renames included."""
+    patches, current = [], None
+    old_remaining = new_remaining = 0
+    for line in diff.replace("\r\n", "\n").split("\n"):
+        if old_remaining > 0 or new_remaining > 0:
+            op = line[:1] if line[:1] in ("+", "-", "\\") else " "
+            if op == "\\":
+                continue
+            current.blocks[-1].lines.append((op, line[1:]))
+            old_remaining -= op != "+"
+            new_remaining -= op != "-"
+            continue
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match and current is not None:
+            old_count = int(match.group(2) or 1)
+            current.blocks.append(
+                DiffBlock(int(match.group(1)), old_count, int(match.group(3)))
+            )
+            old_remaining, new_remaining = old_count, int(match.group(4) or 1)
+        elif line.startswith("diff --git "):
+            old, _, new = line[len("diff --git ") :].partition(" b/")
+            current = FilePatch(_strip_prefix(old), new)
+            patches.append(current)
+        elif current is None:
+            continue
+        elif line.startswith("--- "):
+            current.old_path = _strip_prefix(line[4:])
+        elif line.startswith("+++ "):
+            current.new_path = _strip_prefix(line[4:])
+        elif line.startswith("rename from "):
+            current.old_path = line[len("rename from ") :]
+        elif line.startswith("rename to "):
+            current.new_path = line[len("rename to ") :]
+        elif line.startswith("new file mode"):
+            current.old_path = None
+        elif line.startswith("deleted file mode"):
+            current.new_path = None
+    return patches
+
+
+def _position_mapper(blocks: list):
+    """Function moving a line of the old side to the new side, None if removed."""
+    mapping, offsets = {}, []
+    for block in blocks:
+        # A block without old lines inserts after `old_start`
+        old = block.old_start if block.old_count else block.old_start + 1
+        new = block.new_start
+        for op, _ in block.lines:
+            if op == " ":
+                mapping[old] = new
+                old, new = old + 1, new + 1
+            elif op == "-":
+                mapping[old] = None
+                old += 1
+            else:
+                new += 1
+        offsets.append((old, new - old))
+
+    def mapper(position: int) -> Optional[int]:
+        if position in mapping:
+            return mapping[position]
+        offset = 0
+        for end, block_offset in offsets:
+            if position < end:
+                break
+            offset = block_offset
+        return position + offset
+
+    return mapper
+
+
+def net_hunks(commits: list) -> tuple[list, Counter]:
+    """Net hunks of an ordered list of `(commit_id, diff)`.
+
+    Every added line is followed through the later diffs: lines removed or
+    changed by a later commit are superseded and dropped, the rest end up in
+    their line of the last commit. Consecutive surviving lines form the net
+    hunks, usually the same added runs as the diff of the whole range. Also
+    returns the superseded lines per commit.
+    """
+    # path -> {line: (text, commit_id)} of the lines added in the range
+    added, superseded = {}, Counter()
+    for commit_id, diff in commits:
+        for patch in parse_patches(diff):
+            tracked = added.pop(patch.old_path, {}) if patch.old_path else {}
+            mapper = _position_mapper(patch.blocks)
+            moved = {}
+            for position, (text, origin) in tracked.items():
+                new_position = mapper(position) if patch.new_path else None
+                if new_position is None:
+                    superseded[origin] += 1
+                else:
+                    moved[new_position] = (text, origin)
+            for block in patch.blocks:
+                line_number = block.new_start
+                for op, text in block.lines:
+                    if op == "+":
+                        moved[line_number] = (text, commit_id)
+                    if op != "-":
+                        line_number += 1
+            if patch.new_path is not None and moved:
+                added[patch.new_path] = moved
+
+    hunks = []
+    for path, lines in added.items():
+        run = []
+        for position in sorted(lines):
+            if run and position != run[-1] + 1:
+                hunks.extend(_net_hunk(path, run, lines))
+                run = []
+            run.append(position)
+        hunks.extend(_net_hunk(path, run, lines))
+    return hunks, superseded
+
+
+def _net_hunk(path: str, run: list, lines: dict) -> list:
+    if not run:
+        return []
+    hunk = make_hunk(run[0], [lines[position][0] for position in run])
+    if hunk is None:
+        return []
+    commits = list(dict.fromkeys(lines[position][1] for position in run))
+    return [NetHunk(path, hunk, commits)]
+
+
+def net_files(hunks: list) -> list:
+    """Net hunks as the file nodes of the integrity index."""
+    files = {}
+    for net_hunk in hunks:
+        files.setdefault(net_hunk.path, FileNode(net_hunk.path)).hunks.append(
+            net_hunk.hunk
+        )
+    return list(files.values())
+
+
+@dataclass
+class PackedSnippet:
+    """Distinct hunks of one language joined in a snippet, to share rule calls."""
+
+    language: Optional[str]
+    code: str
+    # Snippet line -> (hunk hash, line of the hunk), None for separators
+    line_map: list
+
+
+def pack_hunks(
+    hunks: list, resolve_language: Callable, max_lines: int = MAX_SNIPPET_LINES
+) -> list:
+    """Snippets with every distinct hunk once, grouped by language.
+
+    `resolve_language(path, code)` gives the language of a hunk. Hunks are
+    separated by a blank line and a snippet is closed before it exceeds
+    `max_lines` (a larger hunk goes alone).
+    """
+    by_language, seen = {}, set()
+    for net_hunk in hunks:
+        if net_hunk.hunk.hash in seen:
+            continue
+        seen.add(net_hunk.hunk.hash)
+        language = resolve_language(net_hunk.path, "\n".join(net_hunk.hunk.lines))
+        by_language.setdefault(language, []).append(net_hunk.hunk)
+
+    snippets = []
+    for language, language_hunks in by_language.items():
+        lines, line_map = [], []
+        for hunk in language_hunks:
+            if lines and len(lines) + 1 + len(hunk.lines) > max_lines:
+                snippets.append(PackedSnippet(language, "\n".join(lines), line_map))
+                lines, line_map = [], []
+            if lines:
+                lines.append("")
+                line_map.append(None)
+            lines.extend(hunk.lines)
+            line_map.extend(
+                (hunk.hash, relative) for relative in range(1, len(hunk.lines) + 1)
+            )
+        if lines:
+            snippets.append(PackedSnippet(language, "\n".join(lines), line_map))
+    return snippets
+
+
+def attribute_findings(snippet: PackedSnippet, results: list) -> dict:
+    """`{hunk hash: [finding]}` of the failed rules of a packed snippet.
+
+    Finding lines are relative to the hunk. A response that cannot be split,
+    or a finding without a valid line, is attributed to every hunk of the
+    snippet so it is never lost.
+    """
+    hashes = list(dict.fromkeys(entry[0] for entry in snippet.line_map if entry))
+    findings = {}
+
+    def add(hunk_hash: str, result: dict, response: str, line: Optional[int]):
+        findings.setdefault(hunk_hash, []).append(
+            {"owasp_name": result["owasp_name"], "line": line, "response": response}
+        )
+
+    for result in results:
+        if result["pass"]:
+            continue
+        blocks = split_findings(result["response"])
+        for block in blocks if blocks is not None else [result["response"]]:
+            line = finding_line(block) if blocks is not None else None
+            entry = (
+                snippet.line_map[line - 1]
+                if line is not None and 1 <= line <= len(snippet.line_map)
+                else None
+            )
+            if entry is None:
+                for hunk_hash in hashes:
+                    add(hunk_hash, result, block, None)
+                continue
+            hunk_hash, relative = entry
+            add(
+                hunk_hash,
+                result,
+                remap_line_fields(
+                    block, lambda number: _hunk_line(snippet, number) or number
+                ),
+                relative,
+            )
+    return findings
+
+
+def _hunk_line(snippet: PackedSnippet, line: int) -> Optional[int]:
+    if 1 <= line <= len(snippet.line_map) and snippet.line_map[line - 1]:
+        return snippet.line_map[line - 1][1]
+    return None
+
+
+@dataclass
+class RangePlan:
+    """What evaluating a commit range takes, computed before any model call."""
+
+    commits: list
+    hunks: list
+    superseded: Counter
+    snippets: list
+
+    def evaluated_hunks(self) -> list:
+        """Net hunks packed in a snippet, the others have no rules to run."""
+        hashes = {
+            entry[0] for snippet in self.snippets for entry in snippet.line_map if entry
+        }
+        return [net_hunk for net_hunk in self.hunks if net_hunk.hunk.hash in hashes]
+
+
+def plan_range(
+    workflow, commits: list, max_snippet_lines: int = MAX_SNIPPET_LINES
+) -> RangePlan:
+    """Net hunks of `(commit_id, diff)` pairs packed in the snippets to evaluate.
+
+    Snippets of languages without routed rules are left out.
+    """
+    hunks, superseded = net_hunks(commits)
+    snippets = [
+        snippet
+        for snippet in pack_hunks(hunks, workflow.resolve_language, max_snippet_lines)
+        if workflow.rules_for(snippet.language)
+    ]
+    return RangePlan(commits, hunks, superseded, snippets)
+
+
+async def evaluate_range(
+    workflow,
+    plan: RangePlan,
+    repository: Optional[str] = None,
+    lane: Optional[str] = None,
+) -> dict:
+    """Evaluate the snippets of a plan and attribute the findings to commits.
+
+    Every distinct hunk is evaluated once per rule, packed with the other
+    hunks of its language, instead of once per commit that carries it. Each
+    commit gets the net hunks it added lines to, with their findings moved
+    to the lines of the last commit.
+    """
+
+    async def evaluate(snippet: PackedSnippet) -> list:
+        if workflow.two_phase_enabled:
+            _, results = await workflow.run_async_verdicts(
+                snippet.code,
+                repository=repository,
+                language=snippet.language,
+                lane=lane,
+            )
+            return results
+        return await workflow.run_async_inference(
+            snippet.code, repository=repository, language=snippet.language, lane=lane
+        )
+
+    snippet_results = await asyncio.gather(*(evaluate(s) for s in plan.snippets))
+    findings, evaluated, metrics = {}, set(), Counter()
+    for snippet, results in zip(plan.snippets, snippet_results):
+        evaluated.update(entry[0] for entry in snippet.line_map if entry)
+        for hunk_hash, hunk_findings in attribute_findings(snippet, results).items():
+            findings.setdefault(hunk_hash, []).extend(hunk_findings)
+        for result in results:
+            metrics["ruleCalls"] += not result["metrics"].get("cacheHit", False)
+            metrics["totalTokens"] += result["metrics"].get("totalTokens", 0)
+
+    report = []
+    for commit_id, _ in plan.commits:
+        commit_hunks = [
+            _hunk_report(net_hunk, findings, evaluated)
+            for net_hunk in plan.hunks
+            if commit_id in net_hunk.commits
+        ]
+        failed = any(hunk["status"] == "failed" for hunk in commit_hunks)
+        report.append(
+            {
+                "id": commit_id,
+                "status": "failed" if failed else "success",
+                "hunks": commit_hunks,
+                "superseded_lines": plan.superseded[commit_id],
+            }
+        )
+    return {
+        "commits": report,
+        "passed": not findings,
+        "failed_hunks": set(findings),
+        "summary": {
+            "commits": len(plan.commits),
+            "netHunks": len(plan.hunks),
+            "distinctHunks": len({net_hunk.hunk.hash for net_hunk in plan.hunks}),
+            "snippets": len(plan.snippets),
+            "ruleCalls": metrics["ruleCalls"],
+            "totalTokens": metrics["totalTokens"],
+        },
+    }
+
+
+def _hunk_report(net_hunk: NetHunk, findings: dict, evaluated: set) -> dict:
+    """A net hunk with its findings on the lines of its file."""
+    hunk = net_hunk.hunk
+
+    def to_file(line: int) -> int:
+        return hunk.start_line + line - 1
+
+    hunk_findings = [
+        {
+            **finding,
+            "line": to_file(finding["line"]) if finding["line"] else None,
+            "response": remap_line_fields(finding["response"], to_file),
+        }
+        for finding in findings.get(hunk.hash, [])
+    ]
+    if hunk.hash not in evaluated:
+        status = "skipped"
+    else:
+        status = "failed" if hunk_findings else "passed"
+    return {
+        "path": net_hunk.path,
+        "start_line": hunk.start_line,
+        "end_line": hunk.end_line,
+        "hash": hunk.hash,
+        "status": status,
+        "commits": net_hunk.commits,
+        "findings": hunk_findings,
+    }
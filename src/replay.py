@@ -0,0 +1,165 @@
+"""Script used to record and replay model calls for offline evaluation"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, AsyncGenerator, Optional, Type, TypeVar, Union
+
+from pydantic import BaseModel
+from strands.models import Model
+
+T = TypeVar("T", bound=BaseModel)
+
+# Constants
+REPLAY_MODES = ("live", "record", "replay", "auto")
+LATENCY_MODES = ("none", "recorded")
+
+
+class CassetteMissError(Exception):
+    """Raised in replay mode when a request was never recorded."""
+
+
+class CassetteStore:
+    """Compact on-disk store of recorded model responses.
+
+    One SQLite file per cassette, every interaction is a zlib compressed JSON
+    list of `[offset_seconds, event]` pairs keyed by the request fingerprint.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS interactions ("
+            "fingerprint TEXT PRIMARY KEY, events BLOB NOT NULL, "
+            "duration REAL NOT NULL, recorded_at REAL NOT NULL)"
+        )
+
+    def get(self, fingerprint: str) -> Optional[list]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT events FROM interactions WHERE fingerprint = ?",
+                (fingerprint,),
+            ).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def put(self, fingerprint: str, events: list) -> None:
+        blob = zlib.compress(json.dumps(events, default=str).encode("utf-8"))
+        duration = events[-1][0] if events else 0.0
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO interactions VALUES (?, ?, ?, ?)",
+                (fingerprint, blob, duration, time.time()),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM interactions"
+            ).fetchone()[0]
+
+
+def request_fingerprint(
+    model_config: dict, messages: list, system_prompt: Optional[str], tool_specs
+) -> str:
+    """Hash of everything that determines the model answer."""
+    request = json.dumps(
+        {
+            "config": model_config,
+            "messages": messages,
+            "system_prompt": system_prompt,
+            "tool_specs": tool_specs,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+class RecordReplayModel(Model):
+    """Model wrapper that records live responses or replays them from a cassette.
+
+    Modes:
+        - record: call the wrapped model and store every response.
+        - replay: serve stored responses only, raise CassetteMissError otherwise.
+        - auto: replay when recorded, record otherwise.
+    With `latency="recorded"` replayed events are paced like the original call,
+    with `latency="none"` they are served at full speed.
+    """
+
+    def __init__(
+        self,
+        model: Model,
+        store: CassetteStore,
+        mode: str = "replay",
+        latency: str = "none",
+    ):
+        if mode not in REPLAY_MODES[1:]:
+            raise ValueError(f"Invalid replay mode '{mode}'")
+        if latency not in LATENCY_MODES:
+            raise ValueError(f"Invalid replay latency '{latency}'")
+        self.model = model
+        self.store = store
+        self.mode = mode
+        self.latency = latency
+
+    def update_config(self, **model_config: Any) -> None:
+        self.model.update_config(**model_config)
+
+    def get_config(self) -> Any:
+        return self.model.get_config()
+
+    def structured_output(
+        self,
+        output_model: Type[T],
+        prompt: list,
+        system_prompt: Optional[str] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[dict[str, Union[T, Any]], None]:
+        return self.model.structured_output(
+            output_model, prompt, system_prompt=system_prompt, **kwargs
+        )
+
+    async def stream(
+        self,
+        messages: list,
+        tool_specs: Optional[list] = None,
+        system_prompt: Optional[str] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[dict, None]:
+        fingerprint = request_fingerprint(
+            dict(self.get_config()), messages, system_prompt, tool_specs
+        )
+        recorded = None if self.mode == "record" else self.store.get(fingerprint)
+        if recorded is not None:
+            async for event in self._replay(recorded):
+                yield event
+            return
+        if self.mode == "replay":
+            raise CassetteMissError(f"No recorded response for request {fingerprint}")
+
+        events, started = [], time.perf_counter()
+        async for event in self.model.stream(
+            messages, tool_specs, system_prompt, **kwargs
+        ):
+            events.append([round(time.perf_counter() - started, 4), event])
+            yield event
+        self.store.put(fingerprint, events)
+
+    async def _replay(self, recorded: list) -> AsyncGenerator[dict, None]:
+        started = time.perf_counter()
+        for offset, event in recorded:
+            if self.latency == "recorded":
+                delay = offset - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield event
@@ -0,0 +1,286 @@
+"""Script used to slim the rule prompts down to the passages relevant to the code"""
+
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+from array import array
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+# Constants
+INDEX_VERSION = 1
+DEFAULT_CORE_SECTIONS = ("Context", "Objective", "Response Format")
+HEADING_PATTERN = re.compile(r"^(#{2,3}) (.+)$")
+ITEM_PATTERN = re.compile(r"^(?:[-*]|\d+\.) ")
+WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# Splits identifiers like `executeQuery`, `SQLInjection` or `user_input`
+SUBWORD_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+")
+STOPWORDS = set(
+    "a an and are as at be by for from if in is it not of on or the to with without"
+    " def return self this var let const function import".split()
+)
+# Concepts the prompts talk about, added to the query when the code uses them
+QUERY_EXPANSIONS = {
+    "select": "sql query",
+    "insert": "sql query",
+    "cursor": "sql query database",
+    "execute": "sql query",
+    "system": "command shell",
+    "popen": "command shell process",
+    "subprocess": "command shell process",
+    "eval": "code dynamic evaluation",
+    "innerhtml": "html xss output escaping",
+    "md5": "hash weak algorithm",
+    "sha1": "hash weak algorithm",
+    "random": "randomness",
+    "password": "credentials hashing",
+    "secret": "credentials hard coded",
+    "token": "jwt credentials",
+    "jwt": "token",
+    "cors": "origin",
+    "admin": "privilege role",
+    "role": "permission authorization",
+}
+# Only the beginning of very large snippets is used as query
+MAX_QUERY_CHARACTERS = 65536
+
+
+def tokenize(text: str) -> list:
+    """Lowercase terms of a text, identifiers also split in their subwords."""
+    terms = []
+    for word in WORD_PATTERN.findall(text):
+        for term in {word.lower(), *map(str.lower, SUBWORD_PATTERN.findall(word))}:
+            if len(term) > 1 and term not in STOPWORDS:
+                terms.append(term)
+    return terms
+
+
+@dataclass
+class PromptBlock:
+    """Piece of a prompt, always sent (core) or a retrievable passage."""
+
+    text: str
+    section: Optional[int] = None
+    passage: Optional[int] = None
+
+
+def split_prompt(text: str, core_sections=DEFAULT_CORE_SECTIONS):
+    """Split a rule prompt in core blocks and one passage per list item.
+
+    The `##` sections named in `core_sections` and the text after the lists
+    are core. Every other section (`###` ones and the rest of the `##` ones)
+    contributes a passage per top level list item; its heading is only sent
+    when one of its passages is. Returns the section headings and the blocks.
+    """
+    headings, blocks, lines = [], [], []
+    section, in_items, in_fence = None, False, False
+
+    def flush():
+        if "\n".join(lines).strip():
+            blocks.append(
+                PromptBlock("\n".join(lines).strip("\n"), section if in_items else None)
+            )
+        lines.clear()
+
+    for line in text.splitlines():
+        if in_fence or line.startswith("```"):
+            in_fence ^= line.startswith("```")
+            lines.append(line)
+            continue
+        match = HEADING_PATTERN.match(line)
+        if match:
+            flush()
+            name = match.group(2).strip().rstrip(":")
+            in_items = False
+            if len(match.group(1)) == 2 and name in core_sections:
+                section = None
+                lines.append(line)
+            else:
+                section = len(headings)
+                headings.append(line)
+            continue
+        if section is None:
+            lines.append(line)
+        elif ITEM_PATTERN.match(line):
+            flush()
+            in_items = True
+            lines.append(line)
+        elif in_items and line.strip() and not line[0].isspace():
+            # End of the list, what follows is core again
+            flush()
+            section, in_items = None, False
+            lines.append(line)
+        elif in_items:
+            lines.append(line)
+        elif line.strip():
+            # Introduction of the section, sent along with its heading
+            headings[section] += f"\n{line}"
+    flush()
+    return headings, blocks
+
+
+class PromptIndex:
+    """BM25 index over the passages of the rule prompts, persisted on disk.
+
+    The index is built once, the first time a set of prompts is seen, and kept
+    next to `path`: the vocabulary and the passages in `<path>.json`, the
+    postings (passage, term frequency pairs) in `<path>.bin`. The postings
+    are memory-mapped, so every worker process shares the same pages.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        documents: dict,
+        core_sections=DEFAULT_CORE_SECTIONS,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        digest = hashlib.sha256(
+            json.dumps(
+                [INDEX_VERSION, sorted(documents.items()), list(core_sections), k1, b]
+            ).encode("utf-8")
+        ).hexdigest()
+        meta = self._load_meta(digest)
+        if meta is None:
+            self._build(documents, core_sections, digest)
+            meta = self._load_meta(digest)
+        self.documents = {
+            key: (
+                document["headings"],
+                [PromptBlock(*block) for block in document["blocks"]],
+            )
+            for key, document in meta["documents"].items()
+        }
+        self.passage_lengths = meta["passage_lengths"]
+        self.average_length = meta["average_length"]
+        self.terms = meta["terms"]
+        self._document_passages = {
+            key: {block.passage for block in blocks if block.passage is not None}
+            for key, (_, blocks) in self.documents.items()
+        }
+        self._postings = self._map_postings()
+
+    def _load_meta(self, digest: str) -> Optional[dict]:
+        try:
+            with open(f"{self.path}.json", "r", encoding="utf-8") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if meta.get("digest") != digest or not os.path.exists(f"{self.path}.bin"):
+            return None
+        return meta
+
+    def _build(self, documents: dict, core_sections, digest: str) -> None:
+        passage_terms, indexed = [], {}
+        for key, text in documents.items():
+            headings, blocks = split_prompt(text, core_sections)
+            for block in blocks:
+                if block.section is not None:
+                    block.passage = len(passage_terms)
+                    passage_terms.append(
+                        Counter(tokenize(f"{headings[block.section]}\n{block.text}"))
+                    )
+            indexed[key] = {
+                "headings": headings,
+                "blocks": [
+                    [block.text, block.section, block.passage] for block in blocks
+                ],
+            }
+        postings = defaultdict(list)
+        for passage, counts in enumerate(passage_terms):
+            for term, frequency in counts.items():
+                postings[term].append((passage, frequency))
+        data, terms = array("I"), {}
+        for term, entries in sorted(postings.items()):
+            terms[term] = [len(data), len(entries)]
+            for passage, frequency in entries:
+                data.extend((passage, frequency))
+        lengths = [sum(counts.values()) for counts in passage_terms]
+        meta = {
+            "version": INDEX_VERSION,
+            "digest": digest,
+            "documents": indexed,
+            "passage_lengths": lengths,
+            "average_length": sum(lengths) / len(lengths) if lengths else 0.0,
+            "terms": terms,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Written aside and moved in place, concurrent workers may build it too
+        for suffix, content, mode in (
+            (".bin", data.tobytes(), "wb"),
+            (".json", json.dumps(meta), "w"),
+        ):
+            temporary = f"{self.path}{suffix}.{os.getpid()}.tmp"
+            with open(temporary, mode) as file:
+                file.write(content)
+            os.replace(temporary, f"{self.path}{suffix}")
+
+    def _map_postings(self):
+        with open(f"{self.path}.bin", "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return array("I")
+            return memoryview(
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            ).cast("I")
+
+    def search(self, document: str, code: str, top_k: int) -> list:
+        """Best scoring passages of a prompt for the code, as (passage, score)."""
+        allowed = self._document_passages.get(document, set())
+        total = len(self.passage_lengths)
+        scores = defaultdict(float)
+        query = set(tokenize(code[:MAX_QUERY_CHARACTERS]))
+        for term in list(query):
+            query.update(QUERY_EXPANSIONS.get(term, "").split())
+        for term in query:
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            offset, count = entry
+            idf = math.log(1 + (total - count + 0.5) / (count + 0.5))
+            for index in range(offset, offset + 2 * count, 2):
+                passage, frequency = self._postings[index], self._postings[index + 1]
+                if passage not in allowed:
+                    continue
+                norm = (
+                    1
+                    - self.b
+                    + self.b
+                    * self.passage_lengths[passage]
+                    / max(self.average_length, 1)
+                )
+                scores[passage] += (
+                    idf * frequency * (self.k1 + 1) / (frequency + self.k1 * norm)
+                )
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:top_k]
+
+    def render(self, document: str, code: str, top_k: int) -> str:
+        """Core of a prompt plus its passages relevant to the code, in order."""
+        headings, blocks = self.documents[document]
+        selected = {passage for passage, _ in self.search(document, code, top_k)}
+        parts, current = [], None
+        for block in blocks:
+            if block.passage is None:
+                parts.append(f"\n{block.text}")
+                current = None
+            elif block.passage in selected:
+                if block.section != current:
+                    parts.append(f"\n{headings[block.section]}")
+                    current = block.section
+                parts.append(block.text)
+        return "\n".join(parts).strip()
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self.documents),
+            "passages": len(self.passage_lengths),
+            "terms": len(self.terms),
+        }
@@ -0,0 +1,448 @@
+"""Repository scanner to evaluate every source file of a tree.
+
+The tree is walked lazily honouring its .gitignore files, the CPU bound
+preprocessing (reading, guardrail, normalization, chunking and triage) runs in a
+process pool and the prepared files reach the rule fan-out through a bounded
+queue, so memory stays flat whatever the size of the repository. Results are
+streamed to JSONL as every file completes and finished paths are appended to a
+checkpoint file, an interrupted scan resumes where it stopped.
+
+Usage (from the repository root):
+    uv run python -m src.scanner path/to/repo --languages python,javascript \\
+        --output scan_results.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from dotenv import load_dotenv
+
+from .guardrails import PromptGuardrail, PromptInjectionError
+from .language import detect_language
+from .normalize import CanonicalCode, canonicalize, remap_line_fields
+from .segment import split_units
+from .workflow import OwaspWorkflow
+
+load_dotenv()  # Load environment variables from .env file
+
+# Constants
+GITIGNORE_FILE = ".gitignore"
+ALWAYS_IGNORED = {".git", ".hg", ".svn"}
+MAX_FILE_BYTES = 512 * 1024
+MAX_CHUNK_LINES = 400
+# Average line length above which a file is considered minified or generated
+MAX_AVERAGE_LINE_LENGTH = 300
+
+
+def pprint(data):
+    print(json.dumps(data, indent=2, ensure_ascii=False))
+
+
+@dataclass
+class IgnoreRule:
+    """One .gitignore pattern, `base` is the directory of its file."""
+
+    base: str
+    regex: re.Pattern
+    negate: bool
+    directory_only: bool
+
+
+@dataclass
+class Chunk:
+    """A piece of a file evaluated as one snippet, starting at `start_line`."""
+
+    start_line: int
+    code: str
+    canonical: CanonicalCode
+    units: list
+
+
+def parse_gitignore(path: str, base: str) -> list:
+    """Read the rules of a .gitignore file located in the `base` directory."""
+    rules = []
+    with open(path, "r", errors="replace") as file:
+        for line in file:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            if line.startswith("\\"):
+                line = line[1:]
+            directory_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            # A slash anywhere but at the end anchors the pattern to `base`
+            anchored = "/" in line
+            regex = re.compile(_glob_regex(line.lstrip("/"), anchored))
+            rules.append(IgnoreRule(base, regex, negate, directory_only))
+    return rules
+
+
+def _glob_regex(pattern: str, anchored: bool) -> str:
+    """Translate a gitignore glob into a regex over `/` separated paths."""
+    parts, index = [], 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            parts.append("(?:.*/)?")
+            index += 3
+        elif pattern.startswith("**", index):
+            parts.append(".*")
+            index += 2
+        elif pattern[index] == "*":
+            parts.append("[^/]*")
+            index += 1
+        elif pattern[index] == "?":
+            parts.append("[^/]")
+            index += 1
+        elif pattern[index] == "[" and "]" in pattern[index + 2 :]:
+            end = pattern.index("]", index + 2)
+            body = pattern[index + 1 : end]
+            parts.append(f"[{'^' + body[1:] if body.startswith('!') else body}]")
+            index = end + 1
+        else:
+            parts.append(re.escape(pattern[index]))
+            index += 1
+    return f"^{'' if anchored else '(?:.*/)?'}{''.join(parts)}$"
+
+
+def is_ignored(relative: str, is_directory: bool, rules: list) -> bool:
+    """Apply the rules in order, the last matching one wins as in git."""
+    ignored = False
+    for rule in rules:
+        if rule.directory_only and not is_directory:
+            continue
+        if relative.startswith(rule.base) and rule.regex.match(
+            relative[len(rule.base) :]
+        ):
+            ignored = not rule.negate
+    return ignored
+
+
+def walk_files(root: str, languages: Optional[set] = None) -> Iterator[tuple]:
+    """Lazily yield `(relative_path, language)` for the source files of a tree.
+
+    Ignored directories are never entered, so only the pending directories and
+    their inherited rules are kept in memory.
+    """
+    stack = [("", [])]
+    while stack:
+        directory, rules = stack.pop()
+        absolute = os.path.join(root, directory)
+        gitignore = os.path.join(absolute, GITIGNORE_FILE)
+        if os.path.isfile(gitignore):
+            rules = rules + parse_gitignore(gitignore, directory)
+        try:
+            entries = sorted(os.scandir(absolute), key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Warning: cannot list '{absolute}': {e}")
+            continue
+        subdirectories = []
+        for entry in entries:
+            relative = directory + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in ALWAYS_IGNORED and not is_ignored(
+                    relative, True, rules
+                ):
+                    subdirectories.append((relative + "/", rules))
+            elif entry.is_file(follow_symlinks=False):
+                language = detect_language(entry.name)
+                if language is None or (languages and language not in languages):
+                    continue
+                if not is_ignored(relative, False, rules):
+                    yield relative, language
+        stack.extend(reversed(subdirectories))
+
+
+def chunk_code(code: str, max_chunk_lines: int = MAX_CHUNK_LINES) -> list:
+    """Split a file in `(start_line, text)` chunks, cutting between units."""
+    lines = code.split("\n")
+    if len(lines) <= max_chunk_lines:
+        return [(1, code)]
+    boundaries = sorted(
+        {
+            line
+            for unit in split_units(code)
+            for line, previous in zip(unit.lines, [None] + unit.lines)
+            if line - 1 != previous
+        }
+    )
+    chunks, start = [], 1
+    while start <= len(lines):
+        end = start + max_chunk_lines
+        if end <= len(lines):
+            cuts = [boundary for boundary in boundaries if start < boundary <= end]
+            end = cuts[-1] if cuts else end
+        else:
+            end = len(lines) + 1
+        chunks.append((start, "\n".join(lines[start - 1 : end - 1])))
+        start = end
+    return chunks
+
+
+# Guardrail of the pool worker process, built once by `_initialize_worker`
+_guardrail: Optional[PromptGuardrail] = None
+
+
+def _initialize_worker(guardrail_config: dict) -> None:
+    global _guardrail
+    _guardrail = PromptGuardrail(**guardrail_config)
+
+
+def preprocess_file(
+    root: str,
+    relative: str,
+    language: str,
+    max_file_bytes: int = MAX_FILE_BYTES,
+    max_chunk_lines: int = MAX_CHUNK_LINES,
+) -> dict:
+    """Read, screen, triage and chunk one file. Runs in the process pool."""
+    record = {"path": relative, "language": language}
+    path = os.path.join(root, relative)
+    try:
+        if os.path.getsize(path) > max_file_bytes:
+            return {**record, "status": "skipped", "reason": "too_large"}
+        with open(path, "rb") as file:
+            data = file.read()
+    except OSError as e:
+        return {**record, "status": "error", "reason": str(e)}
+    if b"\0" in data[:8192]:
+        return {**record, "status": "skipped", "reason": "binary"}
+    code = data.decode("utf-8", errors="replace")
+    lines = code.splitlines()
+    if not any(line.strip() for line in lines):
+        return {**record, "status": "skipped", "reason": "empty"}
+    if len(code) / len(lines) > MAX_AVERAGE_LINE_LENGTH:
+        return {**record, "status": "skipped", "reason": "minified"}
+
+    try:
+        guardrail_result = _guardrail.check(code)
+    except PromptInjectionError as e:
+        return {
+            **record,
+            "status": "rejected",
+            "reason": str(e),
+            "guardrail": e.result.to_dict(),
+        }
+    chunks = []
+    for start_line, text in chunk_code(guardrail_result.code, max_chunk_lines):
+        canonical = canonicalize(text)
+        # Chunks with nothing but comments or blank lines are not worth a call
+        if canonical.line_map:
+            chunks.append(Chunk(start_line, text, canonical, split_units(text)))
+    if not chunks:
+        return {**record, "status": "skipped", "reason": "no_code"}
+    return {
+        **record,
+        "status": "ready",
+        "chunks": chunks,
+        "guardrail": guardrail_result.to_dict() if guardrail_result.matches else None,
+    }
+
+
+async def evaluate_prepared(workflow: OwaspWorkflow, prepared: dict) -> dict:
+    """Run the rules on every chunk of a prepared file, with file line numbers."""
+    if prepared["status"] != "ready":
+        return prepared
+    chunks = prepared.pop("chunks")
+    started = time.perf_counter()
+    findings, total_tokens = [], 0
+    try:
+        for chunk in chunks:
+            results = await workflow.run_async_prepared(
+                chunk.code,
+                chunk.canonical,
+                chunk.units,
+                language=prepared["language"],
+            )
+            offset = chunk.start_line - 1
+            for result in results:
+                total_tokens += result["metrics"].get("totalTokens", 0)
+                if result["pass"]:
+                    continue
+                findings.append(
+                    {
+                        "owasp_name": result["owasp_name"],
+                        "startLine": chunk.start_line,
+                        "response": remap_line_fields(
+                            result["response"], lambda line: line + offset
+                        ),
+                    }
+                )
+    except Exception as e:
+        return {**prepared, "status": "error", "reason": str(e)}
+    return {
+        **prepared,
+        "status": "evaluated",
+        "pass": not findings,
+        "chunks": len(chunks),
+        "findings": findings,
+        "totalTokens": total_tokens,
+        "latencyMs": round((time.perf_counter() - started) * 1000, 0),
+    }
+
+
+def load_checkpoint(checkpoint_path: str) -> set:
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, "r") as file:
+        return {line.rstrip("\n") for line in file if line.strip()}
+
+
+async def scan_repository(
+    workflow: OwaspWorkflow,
+    root: str,
+    output_path: str,
+    checkpoint_path: str,
+    languages: Optional[set] = None,
+    concurrency: int = 4,
+    workers: Optional[int] = None,
+    queue_size: int = 64,
+    max_file_bytes: int = MAX_FILE_BYTES,
+    max_chunk_lines: int = MAX_CHUNK_LINES,
+) -> dict:
+    """Scan a tree, streaming one JSONL record per file.
+
+    Files with an error (e.g. a failed model call) are not checkpointed so a
+    resumed scan retries them, except when their preprocessing raised: that
+    fails the same way on every run.
+    """
+    completed = load_checkpoint(checkpoint_path)
+    stats = Counter(resumed=0)
+    queue = asyncio.Queue(maxsize=queue_size)
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_initialize_worker,
+        initargs=(workflow.evaluation_config.get("guardrail", {}),),
+    )
+    with (
+        pool,
+        open(output_path, "a" if completed else "w") as output,
+        open(checkpoint_path, "a") as checkpoint,
+    ):
+
+        async def prepare(relative: str, language: str) -> dict:
+            try:
+                return await loop.run_in_executor(
+                    pool,
+                    preprocess_file,
+                    root,
+                    relative,
+                    language,
+                    max_file_bytes,
+                    max_chunk_lines,
+                )
+            except Exception as e:
+                # One file never stops the scan, it gets an error record
+                return {
+                    "path": relative,
+                    "language": language,
+                    "status": "error",
+                    "stage": "preprocessing",
+                    "reason": str(e),
+                }
+
+        async def produce():
+            pending = set()
+            for relative, language in walk_files(root, languages):
+                if relative in completed:
+                    stats["resumed"] += 1
+                    continue
+                if not workflow.rules_for(language):
+                    # e.g. documentation, no rule is routed to the language
+                    stats["unrouted"] += 1
+                    continue
+                pending.add(asyncio.ensure_future(prepare(relative, language)))
+                if len(pending) >= queue_size:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        # Blocks while the consumers are behind
+                        await queue.put(future.result())
+            for future in asyncio.as_completed(pending):
+                await queue.put(await future)
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                prepared = await queue.get()
+                if prepared is None:
+                    return
+                record = await evaluate_prepared(workflow, prepared)
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                if (
+                    record["status"] != "error"
+                    or record.get("stage") == "preprocessing"
+                ):
+                    checkpoint.write(record["path"] + "\n")
+                    checkpoint.flush()
+                stats[record["status"]] += 1
+                if not record.get("pass", True):
+                    stats["failed"] += 1
+
+        await asyncio.gather(produce(), *(consume() for _ in range(concurrency)))
+    return {
+        "root": root,
+        "output": output_path,
+        **stats,
+        "wallTimeSeconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root", help="Root directory of the repository to scan")
+    parser.add_argument(
+        "--configs",
+        default=os.path.join(os.path.dirname(__file__), "configs", "configs.json"),
+    )
+    parser.add_argument("--languages", help="Comma separated, e.g. python,go")
+    parser.add_argument("--output", default="scan_results.jsonl")
+    parser.add_argument(
+        "--checkpoint", help="Defaults to the output path plus .checkpoint"
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="Files in flight")
+    parser.add_argument("--workers", type=int, help="Preprocessing processes")
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--max-file-bytes", type=int, default=MAX_FILE_BYTES)
+    parser.add_argument("--max-chunk-lines", type=int, default=MAX_CHUNK_LINES)
+    args = parser.parse_args()
+
+    workflow = OwaspWorkflow(args.configs)
+    summary = asyncio.run(
+        scan_repository(
+            workflow,
+            os.path.abspath(args.root),
+            args.output,
+            args.checkpoint or f"{args.output}.checkpoint",
+            languages=set(args.languages.split(",")) if args.languages else None,
+            concurrency=args.concurrency,
+            workers=args.workers,
+            queue_size=args.queue_size,
+            max_file_bytes=args.max_file_bytes,
+            max_chunk_lines=args.max_chunk_lines,
+        )
+    )
+    pprint(summary)
+
+
+if __name__ == "__main__":
+    main()
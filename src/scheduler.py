@@ -0,0 +1,188 @@
+"""Script used to order the rule dispatch from their historical statistics"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+# Constants
+ANY = "*"
+
+
+@dataclass
+class RuleStats:
+    """Exponentially weighted statistics of one rule in one scope."""
+
+    hit_rate: float = 0.0
+    latency_ms: float = 0.0
+    tokens: float = 0.0
+    samples: int = 0
+    timed_samples: int = 0
+
+
+@dataclass
+class ScheduleDecision:
+    owasp_id: str
+    priority: float
+    hit_rate: float
+    latency_ms: float
+    tokens: float
+    samples: int
+    scope: str
+
+
+class RuleScheduler:
+    """Keeps rolling per-rule statistics and decides the dispatch order.
+
+    Statistics are kept per (repository, language), per language and globally;
+    a plan uses the most specific scope with at least `min_samples` results.
+    Rules are ordered by expected failures per second of model time
+    (`hit_rate / latency`), so the rules most likely to fail start first and a
+    failing verdict is known sooner. With `max_concurrent_rules` only that many
+    rules run at once and the order also decides which ones wait.
+
+    There is no early exit after the first failure: every rule still runs,
+    because the response, the cache, the analytics and the integrity log all
+    hold one verdict per rule, and a skipped rule has none to report.
+
+    Repositories come from the clients, so at most `max_entries` statistics
+    are kept and the least recently updated ones are dropped first. The
+    language and global scopes are updated by every result, so they stay.
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        min_samples: int = 5,
+        prior_hit_rate: float = 0.5,
+        prior_latency_ms: float = 5000,
+        max_concurrent_rules: Optional[int] = None,
+        history_size: int = 100,
+        max_entries: int = 10000,
+    ):
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.prior_hit_rate = prior_hit_rate
+        self.prior_latency_ms = prior_latency_ms
+        self.max_concurrent_rules = max_concurrent_rules
+        self.decisions = deque(maxlen=history_size)
+        self.max_entries = max_entries
+        self._stats = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scopes(repository: Optional[str], language: Optional[str]) -> list:
+        language = language or ANY
+        scopes = [(ANY, language), (ANY, ANY)]
+        if repository:
+            scopes.insert(0, (repository, language))
+        return list(dict.fromkeys(scopes))
+
+    def record(
+        self,
+        owasp_id: str,
+        result: dict,
+        repository: Optional[str] = None,
+        language: Optional[str] = None,
+    ) -> None:
+        """Update the statistics of a rule with one of its results."""
+        metrics = result.get("metrics", {})
+        # Cached results say nothing about the latency nor the cost of a call
+        timed = not metrics.get("cacheHit", False)
+        with self._lock:
+            for scope in self._scopes(repository, language):
+                stats = self._stats.setdefault((*scope, owasp_id), RuleStats())
+                self._stats.move_to_end((*scope, owasp_id))
+                stats.hit_rate = self._update(
+                    stats.hit_rate, float(not result["pass"]), stats.samples
+                )
+                stats.samples += 1
+                if timed:
+                    stats.latency_ms = self._update(
+                        stats.latency_ms,
+                        metrics.get("latencyMs", 0),
+                        stats.timed_samples,
+                    )
+                    stats.tokens = self._update(
+                        stats.tokens, metrics.get("totalTokens", 0), stats.timed_samples
+                    )
+                    stats.timed_samples += 1
+            while len(self._stats) > self.max_entries:
+                self._stats.popitem(last=False)
+
+    def _update(self, average: float, value: float, samples: int) -> float:
+        # Plain mean until the EWMA has enough history to be meaningful
+        weight = max(self.alpha, 1 / (samples + 1))
+        return average + weight * (value - average)
+
+    def plan(
+        self,
+        owasp_ids: list,
+        repository: Optional[str] = None,
+        language: Optional[str] = None,
+    ) -> list:
+        """Dispatch order for the rules of one evaluation, highest priority first.
+
+        The decision is kept in `decisions` for inspection.
+        """
+        decisions = self.preview(owasp_ids, repository, language)
+        self.decisions.append(
+            {
+                "timestamp": time.time(),
+                "repository": repository,
+                "language": language,
+                "order": [asdict(decision) for decision in decisions],
+            }
+        )
+        return decisions
+
+    def preview(
+        self,
+        owasp_ids: list,
+        repository: Optional[str] = None,
+        language: Optional[str] = None,
+    ) -> list:
+        """Dispatch order the scheduler would use now, without recording it."""
+        scopes = self._scopes(repository, language)
+        with self._lock:
+            decisions = [self._decide(owasp_id, scopes) for owasp_id in owasp_ids]
+        decisions.sort(key=lambda decision: decision.priority, reverse=True)
+        return decisions
+
+    def _decide(self, owasp_id: str, scopes: list) -> ScheduleDecision:
+        for scope in scopes:
+            stats = self._stats.get((*scope, owasp_id))
+            if stats is not None and stats.samples >= self.min_samples:
+                break
+        else:
+            stats, scope = RuleStats(hit_rate=self.prior_hit_rate), ("prior", "")
+        latency_ms = stats.latency_ms if stats.timed_samples else self.prior_latency_ms
+        return ScheduleDecision(
+            owasp_id=owasp_id,
+            priority=round(stats.hit_rate / max(latency_ms, 1) * 1000, 6),
+            hit_rate=round(stats.hit_rate, 4),
+            latency_ms=round(latency_ms, 1),
+            tokens=round(stats.tokens, 1),
+            samples=stats.samples,
+            scope="/".join(part for part in scope if part),
+        )
+
+    def snapshot(
+        self, repository: Optional[str] = None, language: Optional[str] = None
+    ) -> list:
+        """Statistics of every rule, optionally filtered by scope."""
+        with self._lock:
+            return [
+                {
+                    "repository": scope_repository,
+                    "language": scope_language,
+                    "rule": owasp_id,
+                    **asdict(stats),
+                }
+                for (scope_repository, scope_language, owasp_id), stats in sorted(
+                    self._stats.items()
+                )
+                if repository in (None, scope_repository)
+                and language in (None, scope_language)
+            ]
@@ -0,0 +1,82 @@
+"""Script used to split code snippets into functions and classes"""
+
+import ast
+import re
+from dataclasses import dataclass
+
+from .normalize import CanonicalCode, canonicalize
+
+# Constants
+DECLARATION_PATTERN = re.compile(
+    r"^(?:export\s+)?(?:default\s+)?(?:pub\s+)?(?:async\s+)?"
+    r"(?:def|class|function|func|fn|interface|struct|impl|module|sub)\b"
+    r"|^[A-Za-z_][\w\s\*<>,:\[\]]*\s\**[A-Za-z_]\w*\s*\([^;]*\)\s*\{?\s*$"
+)
+
+
+@dataclass
+class CodeUnit:
+    """A function, class or the module level remainder of a snippet.
+
+    `lines` holds the original line number of every line in `code`.
+    """
+
+    name: str
+    code: str
+    lines: list
+    canonical: CanonicalCode
+
+
+def split_units(code: str) -> list:
+    """Split a snippet into units, AST based when it is valid Python."""
+    source_lines = code.splitlines()
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError, RecursionError):
+        spans = _heuristic_spans(source_lines)
+    else:
+        spans = _python_spans(tree)
+    return [
+        _build_unit(name, lines, source_lines)
+        for name, lines in spans
+        if any(source_lines[line - 1].strip() for line in lines)
+    ]
+
+
+def _python_spans(tree: ast.Module) -> list:
+    """Top level functions and classes, plus the remaining module statements."""
+    spans, module_lines = [], []
+    for node in tree.body:
+        start = min(
+            [node.lineno]
+            + [decorator.lineno for decorator in getattr(node, "decorator_list", [])]
+        )
+        lines = list(range(start, node.end_lineno + 1))
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            spans.append((node.name, lines))
+        else:
+            module_lines.extend(lines)
+    if module_lines:
+        spans.insert(0, ("<module>", module_lines))
+    return spans
+
+
+def _heuristic_spans(source_lines: list) -> list:
+    """Split at unindented declarations for languages without a parser."""
+    starts = [
+        index + 1
+        for index, line in enumerate(source_lines)
+        if DECLARATION_PATTERN.match(line)
+    ]
+    if not starts or starts[0] != 1:
+        starts.insert(0, 1)
+    boundaries = starts + [len(source_lines) + 1]
+    return [
+        (source_lines[start - 1].strip()[:80] or "<module>", list(range(start, end)))
+        for start, end in zip(boundaries, boundaries[1:])
+    ]
+
+
+def _build_unit(name: str, lines: list, source_lines: list) -> CodeUnit:
+    code = "\n".join(source_lines[line - 1] for line in lines)
+    return CodeUnit(name=name, code=code, lines=lines, canonical=canonicalize(code))
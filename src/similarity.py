@@ -0,0 +1,413 @@
+"""Script used to find previously evaluated code units that are near-duplicates"""
+
+import fcntl
+import logging
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .normalize import CanonicalCode
+
+# Constants
+INDEX_VERSION = 1
+# Largest prime below 2**32, keeps `a * x + b` exact in uint64
+MERSENNE_PRIME = np.uint64(4294967291)
+SHINGLE_MULTIPLIER = np.uint64(1099511628211)
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+# MinHash signatures kept for repeated lookups of the same unit
+SIGNATURE_CACHE_SIZE = 4096
+# One bit per rule in the verdict masks
+MAX_RULES = 64
+# Most recent units kept per LSH bucket, bounds the candidates of a lookup
+BUCKET_SIZE = 64
+
+logger = logging.getLogger(__name__)
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH index over the shingles of the evaluated code units.
+
+    Every entry is a unit (keyed by its canonical fingerprint) with a MinHash
+    signature of its token `shingle_size`-grams and, per rule, whether it
+    passed. The signatures are split in `bands` for the LSH buckets, so a
+    lookup only compares the few units sharing a band instead of all of them.
+    Signatures, band hashes and verdict bitmasks live in preallocated NumPy
+    arrays, saved to `path` on `save()` and, every `save_interval` updates, by
+    a background flush so rule calls never wait on the write. Each worker
+    process keeps its own index in memory; a save merges the entries other
+    processes saved to the same path before replacing it, so none are lost.
+    When `max_entries` is reached the oldest units are overwritten.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 5,
+        max_entries: int = 100_000,
+        save_interval: int = 500,
+        seed: int = 1,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        generator = np.random.default_rng(seed)
+        self._a = generator.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._b = generator.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._band_weights = generator.integers(
+            1, 2**63, self.rows, dtype=np.uint64
+        ) | np.uint64(1)
+        self.signatures = np.zeros((max_entries, num_perm), dtype=np.uint32)
+        self.band_hashes = np.zeros((max_entries, bands), dtype=np.uint64)
+        # Bit i of a mask is the rule `self.rules[i]`
+        self.known = np.zeros(max_entries, dtype=np.uint64)
+        self.failed = np.zeros(max_entries, dtype=np.uint64)
+        self.fingerprints = [None] * max_entries
+        self.rules = []
+        # Rules from the least to the most recently recorded
+        self._rule_updates = OrderedDict()
+        self.count = 0
+        self._next = 0
+        self._ids = {}
+        self._buckets = {}
+        self._signature_cache = OrderedDict()
+        self._pending = 0
+        self._flushing = False
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            saved = self._read()
+            if saved is not None:
+                with self._lock:
+                    self._merge(saved)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        tokens = np.fromiter(
+            (zlib.crc32(token.encode("utf-8")) for token in WORD_PATTERN.findall(text)),
+            dtype=np.uint64,
+        )
+        if len(tokens) == 0:
+            return tokens
+        size = min(self.shingle_size, len(tokens))
+        hashes = np.zeros(len(tokens) - size + 1, dtype=np.uint64)
+        for offset in range(size):
+            # Wrapping uint64 arithmetic is the intended hash mixing
+            hashes = hashes * SHINGLE_MULTIPLIER + tokens[offset : offset + len(hashes)]
+        return np.unique(hashes & np.uint64(0xFFFFFFFF))
+
+    def signature(self, canonical: CanonicalCode) -> Optional[np.ndarray]:
+        """MinHash signature of a unit, None when it has no tokens."""
+        with self._lock:
+            cached = self._signature_cache.get(canonical.fingerprint)
+            if cached is not None:
+                self._signature_cache.move_to_end(canonical.fingerprint)
+                return cached
+        shingles = self._shingles(canonical.text)
+        if len(shingles) == 0:
+            return None
+        hashed = (self._a[:, None] * shingles[None, :] + self._b[:, None]) % (
+            MERSENNE_PRIME
+        )
+        signature = hashed.min(axis=1).astype(np.uint32)
+        with self._lock:
+            self._signature_cache[canonical.fingerprint] = signature
+            while len(self._signature_cache) > SIGNATURE_CACHE_SIZE:
+                self._signature_cache.popitem(last=False)
+        return signature
+
+    def _band_hashes(self, signature: np.ndarray) -> np.ndarray:
+        bands = signature.astype(np.uint64).reshape(self.bands, self.rows)
+        return (bands * self._band_weights).sum(axis=1)
+
+    def query(self, canonical: CanonicalCode) -> Optional[tuple[float, int]]:
+        """Most similar indexed unit as (estimated Jaccard similarity, entry)."""
+        signature = self.signature(canonical)
+        if signature is None:
+            return None
+        band_hashes = self._band_hashes(signature)
+        with self._lock:
+            exact = self._ids.get(canonical.fingerprint)
+            if exact is not None:
+                return 1.0, exact
+            candidates = set()
+            for band, value in enumerate(band_hashes.tolist()):
+                candidates.update(self._buckets.get((band, value), ()))
+            if not candidates:
+                return None
+            candidates = np.fromiter(candidates, dtype=np.int64)
+            matches = np.count_nonzero(self.signatures[candidates] == signature, axis=1)
+            best = int(matches.argmax())
+            return float(matches[best] / self.num_perm), int(candidates[best])
+
+    def verdict(self, entry: int, rule: str) -> Optional[bool]:
+        """Whether an indexed unit passed a rule, None when never evaluated."""
+        with self._lock:
+            if rule not in self.rules:
+                return None
+            bit = np.uint64(1 << self.rules.index(rule))
+            if not self.known[entry] & bit:
+                return None
+            return not bool(self.failed[entry] & bit)
+
+    def add(self, canonical: CanonicalCode, rule: str, passed: bool) -> None:
+        """Record the verdict of a rule for a unit, indexing the unit if new."""
+        signature = self.signature(canonical)
+        if signature is None:
+            return
+        band_hashes = self._band_hashes(signature)
+        with self._lock:
+            bit = np.uint64(1 << self._rule_slot(rule))
+            entry = self._ids.get(canonical.fingerprint)
+            if entry is None:
+                entry = self._insert(canonical.fingerprint, signature, band_hashes)
+            self.known[entry] |= bit
+            if passed:
+                self.failed[entry] &= ~bit
+            else:
+                self.failed[entry] |= bit
+            self._pending += 1
+            if self.path and self._pending >= self.save_interval:
+                self._schedule_save()
+
+    def _schedule_save(self) -> None:
+        # Called with the lock held
+        if self._flushing:
+            return
+        self._flushing = True
+        threading.Thread(
+            target=self._flush, name="near-duplicate-flush", daemon=True
+        ).start()
+
+    def _flush(self) -> None:
+        try:
+            self.save()
+        except Exception as e:
+            logger.warning(
+                "Could not save index", extra={"path": self.path, "error": str(e)}
+            )
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def _rule_slot(self, rule: str) -> int:
+        """Bit of a rule, the least recently recorded rule gives up its bit when full.
+
+        Rules are versioned keys, so the bits of outdated versions are reused.
+        """
+        if rule in self._rule_updates:
+            self._rule_updates.move_to_end(rule)
+            return self.rules.index(rule)
+        if len(self.rules) < MAX_RULES:
+            self.rules.append(rule)
+        else:
+            oldest, _ = self._rule_updates.popitem(last=False)
+            slot = self.rules.index(oldest)
+            bit = np.uint64(1 << slot)
+            self.known &= ~bit
+            self.failed &= ~bit
+            self.rules[slot] = rule
+        self._rule_updates[rule] = None
+        return self.rules.index(rule)
+
+    def _insert(self, fingerprint: str, signature, band_hashes) -> int:
+        entry = self._next
+        if self.fingerprints[entry] is not None:
+            # Ring buffer full, the oldest unit leaves the index
+            self._ids.pop(self.fingerprints[entry], None)
+            for band, value in enumerate(self.band_hashes[entry].tolist()):
+                bucket = self._buckets.get((band, value), {})
+                bucket.pop(entry, None)
+                if not bucket:
+                    self._buckets.pop((band, value), None)
+        self.fingerprints[entry] = fingerprint
+        self.signatures[entry] = signature
+        self.band_hashes[entry] = band_hashes
+        self.known[entry] = self.failed[entry] = 0
+        self._ids[fingerprint] = entry
+        self._add_to_buckets(entry)
+        self._next = (entry + 1) % self.max_entries
+        self.count = min(self.count + 1, self.max_entries)
+        return entry
+
+    def _add_to_buckets(self, entry: int) -> None:
+        for band, value in enumerate(self.band_hashes[entry].tolist()):
+            # Dicts as insertion ordered sets, the oldest unit is dropped first
+            bucket = self._buckets.setdefault((band, value), {})
+            bucket[entry] = None
+            if len(bucket) > BUCKET_SIZE:
+                del bucket[next(iter(bucket))]
+
+    def save(self) -> None:
+        """Persist the index merged with the saved one, written aside and moved in place."""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Serializes the read, merge and replace of the workers sharing the path
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            saved = self._read() if os.path.exists(self.path) else None
+            with self._lock:
+                if saved is not None:
+                    self._merge(saved)
+                arrays = {
+                    "version": np.array([INDEX_VERSION, self.num_perm, self.bands]),
+                    "signatures": self.signatures[: self.count].copy(),
+                    "band_hashes": self.band_hashes[: self.count].copy(),
+                    "known": self.known[: self.count].copy(),
+                    "failed": self.failed[: self.count].copy(),
+                    "fingerprints": np.array(
+                        self.fingerprints[: self.count], dtype="U64"
+                    ),
+                    "rules": np.array(self.rules, dtype="U128"),
+                    "next": np.array([self._next]),
+                }
+                self._pending = 0
+            temporary = f"{self.path}.{os.getpid()}.tmp.npz"
+            np.savez(temporary, **arrays)
+            os.replace(temporary, self.path)
+
+    def _read(self) -> Optional[dict]:
+        """Arrays of the saved index, None when missing or incompatible."""
+        try:
+            with np.load(self.path) as data:
+                version, num_perm, bands = data["version"].tolist()
+                if (version, num_perm, bands) != (
+                    INDEX_VERSION,
+                    self.num_perm,
+                    self.bands,
+                ):
+                    logger.warning(
+                        "Ignoring incompatible index", extra={"path": self.path}
+                    )
+                    return None
+                return {key: data[key] for key in data.files}
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(
+                "Could not load index", extra={"path": self.path, "error": str(e)}
+            )
+            return None
+
+    def _merge(self, saved: dict) -> None:
+        """Add the saved units and verdicts this index does not have.
+
+        Called with the lock held. Verdicts recorded here win over the saved
+        ones, saved rules only get a bit when one is free.
+        """
+        slots = []
+        for slot, rule in enumerate(saved["rules"].tolist()):
+            if rule not in self._rule_updates and len(self.rules) < MAX_RULES:
+                self.rules.append(rule)
+                self._rule_updates[rule] = None
+            if rule in self._rule_updates:
+                slots.append((slot, self.rules.index(rule)))
+        known = self._remap(saved["known"], slots)
+        failed = self._remap(saved["failed"], slots)
+        count = len(saved["fingerprints"])
+        # Oldest saved unit first, at most as many as this index holds
+        start = int(saved["next"][0]) % count if count else 0
+        order = [*range(start, count), *range(start)][-self.max_entries :]
+        fingerprints = saved["fingerprints"].tolist()
+        # A slot reused by a later insert belongs to the later unit
+        units = {}
+        for source in order:
+            target = self._ids.get(fingerprints[source])
+            if target is None:
+                target = self._insert(
+                    fingerprints[source],
+                    saved["signatures"][source],
+                    saved["band_hashes"][source],
+                )
+            units[target] = source
+        if not units:
+            return
+        targets = np.fromiter(units.keys(), dtype=np.int64)
+        sources = np.fromiter(units.values(), dtype=np.int64)
+        new = known[sources] & ~self.known[targets]
+        self.known[targets] |= new
+        self.failed[targets] = (self.failed[targets] & ~new) | (failed[sources] & new)
+
+    @staticmethod
+    def _remap(masks: np.ndarray, slots: list) -> np.ndarray:
+        """Verdict masks with the bits moved from the saved to the own slots."""
+        remapped = np.zeros(len(masks), dtype=np.uint64)
+        for slot, own in slots:
+            bits = (masks >> np.uint64(slot)) & np.uint64(1)
+            remapped |= bits << np.uint64(own)
+        return remapped
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": self.count,
+                "max_entries": self.max_entries,
+                "buckets": len(self._buckets),
+                "rules": list(self.rules),
+            }
+
+
+class NearDuplicatePolicy:
+    """Decides what a near-duplicate of an evaluated unit is good for.
+
+    A unit at least `reuse_threshold` similar to one that passed a rule reuses
+    the pass, no model call (only when `reuse` is on, a small edit can add a
+    vulnerability). A unit at least `prioritize_threshold` similar to one that
+    failed a rule moves that rule to the front of the dispatch, its verdict
+    is likely the one that fails the commit.
+    """
+
+    def __init__(
+        self,
+        index: NearDuplicateIndex,
+        reuse: bool = False,
+        reuse_threshold: float = 0.95,
+        prioritize_threshold: float = 0.7,
+    ):
+        self.index = index
+        self.reuse = reuse
+        self.reuse_threshold = reuse_threshold
+        self.prioritize_threshold = prioritize_threshold
+        self.reused = 0
+        self.prioritized = 0
+
+    def reusable_pass(self, canonical: CanonicalCode, rule: str) -> Optional[float]:
+        """Similarity of the passing near-duplicate to reuse, None if none."""
+        if not self.reuse:
+            return None
+        match = self.index.query(canonical)
+        if match is None or match[0] < self.reuse_threshold:
+            return None
+        if self.index.verdict(match[1], rule) is not True:
+            return None
+        self.reused += 1
+        return match[0]
+
+    def suspect_rules(self, canonicals: list, rules: list) -> list:
+        """Rules failed by a near-duplicate of any of the snippets."""
+        suspects = set()
+        for canonical in canonicals:
+            match = self.index.query(canonical)
+            if match is None or match[0] < self.prioritize_threshold:
+                continue
+            suspects.update(
+                rule for rule in rules if self.index.verdict(match[1], rule) is False
+            )
+        self.prioritized += len(suspects)
+        return [rule for rule in rules if rule in suspects]
+
+    def stats(self) -> dict:
+        return {
+            **self.index.stats(),
+            "reused": self.reused,
+            "prioritized": self.prioritized,
+        }
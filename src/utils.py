@@ -2,11 +2,15 @@
 
 import json
 import os
+from typing import Optional
 
 
-def get_env_variable(var_name: str) -> str:
-    """Get an environment variable or raise an error if not found."""
-    value = os.getenv(var_name)
+def get_env_variable(var_name: str, default: Optional[str] = None) -> str:
+    """Get an environment variable or raise an error if not found.
+
+    When a default is given it is returned instead of raising.
+    """
+    value = os.getenv(var_name, default)
     if value is None:
         raise EnvironmentError(f"Environment variable {var_name} not found.")
     return value
@@ -1,60 +1,943 @@
 """Script used to orchestrate the inference workflow"""
 
 import asyncio
+import atexit
+import contextvars
+import functools
+import hashlib
+import json
+import logging
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
 
 from strands.models.openai import OpenAIModel
 
-from .agent import OwaspAgent
-from .config import USER_PROMPT_TEMPLATE, OpenAIModelConfig
-from .utils import load_json_config, load_markdown_file
+from .admission import CHARS_PER_TOKEN, AdmissionController, OverloadedError
+from .agent import OwaspAgent, OwaspVerdictAgent
+from .backends import build_backend_pool
+from .cache import build_cache
+from .config import (
+    USER_PROMPT_TEMPLATE,
+    VERDICT_PROMPT_TEMPLATE,
+    OpenAIModelConfig,
+)
+from .guardrails import GuardrailResult, PromptGuardrail
+from .lanes import LaneScheduler
+from .language import detect_language
+from .logs import setup_logging
+from .minify import minify
+from .findings import finding_line, render_findings, split_findings
+from .normalize import (
+    CanonicalCode,
+    canonicalize,
+    remap_findings,
+    remap_line_fields,
+)
+from .profiler import tagged
+from .replay import CassetteStore, RecordReplayModel
+from .retrieval import DEFAULT_CORE_SECTIONS, INDEX_VERSION, PromptIndex
+from .scheduler import RuleScheduler
+from .segment import CodeUnit, split_units
+from .similarity import NearDuplicateIndex, NearDuplicatePolicy
+from .utils import get_env_variable, load_json_config, load_markdown_file
+
+# Constants
+VERDICT_SUFFIX = ":verdict"
+LANGUAGE_SEPARATOR = "@"
+EVALUATION_KEY_PREFIX = "evaluation:"
+
+logger = logging.getLogger(__name__)
 
 
 class OwaspWorkflow:
     """Class to handle the OWASP analysis workflow."""
 
-    def __init__(self, evaluation_config_path: str):
+    def __init__(self, evaluation_config_path: str, overrides: Optional[dict] = None):
         self.evaluation_config = load_json_config(evaluation_config_path)
+        # Settings replaced per section, e.g. by the harness
+        for section, settings in (overrides or {}).items():
+            self.evaluation_config[section] = {
+                **self.evaluation_config.get(section, {}),
+                **settings,
+            }
+        setup_logging(**self.evaluation_config.get("logging", {}))
+        self.rule_signatures = {}
+        self.replay_config = dict(self.evaluation_config.get("model_replay", {}))
+        self.replay_config["mode"] = get_env_variable(
+            "MODEL_REPLAY_MODE", self.replay_config.get("mode", "live")
+        )
+        self.cassette_store = (
+            CassetteStore(self.replay_config.get("path", "cassettes/default.db"))
+            if self.replay_config["mode"] != "live"
+            else None
+        )
+        self.routing = self.evaluation_config.get("routing", {})
+        self.routes = self._build_routes()
+        self.backend_pool_config = self.evaluation_config.get("backend_pool", {})
+        self.backend_pools = {}
+        self.retrieval_config = self.evaluation_config.get("prompt_retrieval", {})
+        self.prompt_index = self._build_prompt_index()
+        minify_config = dict(self.evaluation_config.get("minify", {}))
+        self.minifier = (
+            functools.partial(minify, **minify_config)
+            if minify_config.pop("enabled", False)
+            else None
+        )
+        self.near_duplicates = self._build_near_duplicates()
         self.agents = self._initialize_agents()
+        self.two_phase_config = self.evaluation_config.get("two_phase", {})
+        self.two_phase_enabled = self.two_phase_config.get("enabled", False)
+        self.verdict_agents = (
+            self._initialize_verdict_agents() if self.two_phase_enabled else {}
+        )
+        # What every evaluation was made with, for the integrity index
+        self.ruleset_signature = hashlib.sha256(
+            json.dumps([self.rule_signatures, self.routes], sort_keys=True).encode(
+                "utf-8"
+            )
+        ).hexdigest()[:16]
+        # References to the background details tasks, so they are not collected
+        self._details_tasks = set()
+        cache_config = dict(self.evaluation_config.get("cache", {}))
+        self.inflight_poll_seconds = cache_config.pop("poll_seconds", 0.25)
+        self.cache, self.inflight = build_cache(cache_config)
+        # Two-phase evaluations are stored apart, so the churn of rule results
+        # never evicts an evaluation whose details were not asked for yet
+        self.evaluations, _ = build_cache(
+            {
+                **cache_config,
+                "path": self.two_phase_config.get("records_path", "evaluations.db"),
+                "max_entries": self.two_phase_config.get("max_records", 10000),
+            }
+        )
+        self.guardrail = PromptGuardrail(**self.evaluation_config.get("guardrail", {}))
+        self.scheduler = RuleScheduler(**self.evaluation_config.get("scheduler", {}))
+        self.lanes = LaneScheduler(**self.evaluation_config.get("lanes", {}))
+        self.admission = AdmissionController(
+            **self.evaluation_config.get("admission", {})
+        )
+        # Background details run in a lane of their own, the least urgent one
+        # unless configured, so they never compete with new requests
+        self.details_lane = (
+            self.two_phase_config.get("details_lane")
+            or max(self.lanes.lanes.values(), key=lambda lane: lane.priority).name
+        )
+        if self.details_lane not in self.lanes.lanes:
+            raise ValueError(f"Unknown details lane '{self.details_lane}'")
+        # One thread per model call slot, the lanes decide who gets them
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.lanes.total_concurrency, thread_name_prefix="rule"
+        )
+
+    def _rule_definitions(self) -> list:
+        """`(agent_id, details)` of every rule and of its per-language overrides.
+
+        An override agent is identified as `<owasp_id>@<language>` and inherits
+        whatever the override does not set from the base rule.
+        """
+        rules = self.evaluation_config["rules"]
+        definitions = list(rules.items())
+        for language, route in self.routing.get("languages", {}).items():
+            for owasp_id, override in route.get("overrides", {}).items():
+                definitions.append(
+                    (
+                        f"{owasp_id}{LANGUAGE_SEPARATOR}{language}",
+                        {**rules[owasp_id], **override},
+                    )
+                )
+        return definitions
+
+    def _build_routes(self) -> dict:
+        """Agents to run per language, from the `routing` configuration."""
+        rules = self.evaluation_config["rules"]
+        routes = {}
+        for language, route in self.routing.get("languages", {}).items():
+            owasp_ids = route.get("rules", list(rules))
+            overrides = route.get("overrides", {})
+            unknown = [i for i in [*owasp_ids, *overrides] if i not in rules]
+            if unknown:
+                raise ValueError(f"Unknown rules in the '{language}' route: {unknown}")
+            routes[language] = [
+                (
+                    f"{owasp_id}{LANGUAGE_SEPARATOR}{language}"
+                    if owasp_id in overrides
+                    else owasp_id
+                )
+                for owasp_id in owasp_ids
+            ]
+        return routes
+
+    def rules_for(self, language: Optional[str]) -> list:
+        """Agents that apply to a language, every rule when it has no route."""
+        return self.routes.get(language, list(self.evaluation_config["rules"]))
+
+    def resolve_language(
+        self,
+        path: Optional[str] = None,
+        code: Optional[str] = None,
+        hint: Optional[str] = None,
+    ) -> Optional[str]:
+        """Language to route a snippet by.
+
+        Only the extension of `path` is trusted to skip rules. A language given
+        by the client (`hint`) or guessed from the code may still select the
+        per-language overrides, but only when its route runs every rule.
+        """
+        language = detect_language(path)
+        if language is not None:
+            return language
+        language = hint or detect_language(code=code)
+        routed = {
+            agent_id.split(LANGUAGE_SEPARATOR)[0]
+            for agent_id in self.rules_for(language)
+        }
+        return language if routed >= set(self.evaluation_config["rules"]) else None
+
+    def _routed_rules(self, language: Optional[str]) -> list:
+        """Agents to run for a language, an evaluation without any is an error."""
+        agent_ids = self.rules_for(language)
+        if not agent_ids:
+            raise ValueError(f"No rules apply to language '{language}'")
+        return agent_ids
 
     def _initialize_agents(self) -> dict:
         """Initialize agents for each OWASP rule defined in the evaluation configuration."""
         agents = {}
-        for owasp_id, details in self.evaluation_config["rules"].items():
-            owasp_name = details["name"]
-            system_prompt = load_markdown_file(
-                os.path.join(
-                    os.path.dirname(__file__),
-                    details.get("prompt_path"),
-                )
-            )
+        for owasp_id, details in self._rule_definitions():
+            system_prompt = self._load_rule_prompt(details)
             model_config = OpenAIModelConfig.from_dict(details.get("model_config", {}))
-            model = OpenAIModel(**model_config.to_dict())
             agents[owasp_id] = OwaspAgent(
-                model=model,
+                model=self._build_model(model_config, owasp_id),
                 system_prompt=system_prompt,
                 user_prompt_template=USER_PROMPT_TEMPLATE,
-                owasp_name=owasp_name,
+                owasp_name=details["name"],
+                prompt_selector=self._prompt_selector(details),
+                minifier=self.minifier,
+            )
+            self.rule_signatures[owasp_id] = self._rule_signature(
+                system_prompt,
+                model_config,
+                USER_PROMPT_TEMPLATE,
+                self._preprocessing_signature(),
+            )
+        return agents
+
+    def _initialize_verdict_agents(self) -> dict:
+        """Agents of the first phase, answering only the vulnerable lines."""
+        agents = {}
+        for owasp_id, details in self._rule_definitions():
+            system_prompt = self._load_rule_prompt(details)
+            model_config = OpenAIModelConfig.from_dict(details.get("model_config", {}))
+            model_config.params = {
+                **model_config.params,
+                "max_tokens": self.two_phase_config.get("verdict_max_tokens", 150),
+            }
+            verdict_id = f"{owasp_id}{VERDICT_SUFFIX}"
+            agents[verdict_id] = OwaspVerdictAgent(
+                model=self._build_model(model_config, verdict_id),
+                system_prompt=system_prompt,
+                user_prompt_template=VERDICT_PROMPT_TEMPLATE,
+                owasp_name=details["name"],
+                prompt_selector=self._prompt_selector(details),
+                minifier=self.minifier,
+            )
+            self.rule_signatures[verdict_id] = self._rule_signature(
+                system_prompt,
+                model_config,
+                VERDICT_PROMPT_TEMPLATE,
+                self._preprocessing_signature(),
             )
         return agents
 
-    def run_inference(self, code_snippet: str) -> list:
-        """Run inference for all OWASP rules on the provided code snippet."""
+    def _build_prompt_index(self) -> Optional[PromptIndex]:
+        """Index of the prompt passages, None when retrieval is disabled."""
+        if not self.retrieval_config.get("enabled", False):
+            return None
+        documents = {
+            details["prompt_path"]: self._load_rule_prompt(details)
+            for _, details in self._rule_definitions()
+        }
+        return PromptIndex(
+            self.retrieval_config.get("path", "prompt_index/owasp"),
+            documents,
+            core_sections=self.retrieval_config.get(
+                "core_sections", DEFAULT_CORE_SECTIONS
+            ),
+        )
+
+    def _prompt_selector(self, details: dict):
+        """System prompt builder of a rule, the full prompt without an index."""
+        if self.prompt_index is None:
+            return None
+        return functools.partial(
+            self.prompt_index.render,
+            details["prompt_path"],
+            top_k=self.retrieval_config.get("top_k", 8),
+        )
+
+    def _build_near_duplicates(self) -> Optional[NearDuplicatePolicy]:
+        config = dict(self.evaluation_config.get("near_duplicates", {}))
+        if not config.pop("enabled", False):
+            return None
+        policy_config = {
+            key: config.pop(key)
+            for key in ("reuse", "reuse_threshold", "prioritize_threshold")
+            if key in config
+        }
+        index = NearDuplicateIndex(**config)
+        atexit.register(index.save)
+        return NearDuplicatePolicy(index, **policy_config)
+
+    def _preprocessing_signature(self) -> Optional[dict]:
+        """Settings of the stages that change what a rule call sends."""
+        signature = {}
+        if self.prompt_index is not None:
+            signature["retrieval"] = [
+                INDEX_VERSION,
+                self.retrieval_config.get("top_k", 8),
+                list(self.retrieval_config.get("core_sections", DEFAULT_CORE_SECTIONS)),
+            ]
+        if self.minifier is not None:
+            signature["minify"] = self.minifier.keywords
+        return signature or None
+
+    @staticmethod
+    def _load_rule_prompt(details: dict) -> str:
+        return load_markdown_file(
+            os.path.join(
+                os.path.dirname(__file__),
+                details.get("prompt_path"),
+            )
+        )
+
+    def _build_model(self, model_config: OpenAIModelConfig, agent_id: str):
+        if model_config.backends:
+            model = build_backend_pool(
+                model_config.backends, model_config.params, self.backend_pool_config
+            )
+            self.backend_pools[agent_id] = model
+        else:
+            model = OpenAIModel(**model_config.to_dict())
+        if self.cassette_store is not None:
+            model = RecordReplayModel(
+                model,
+                self.cassette_store,
+                mode=self.replay_config["mode"],
+                latency=self.replay_config.get("latency", "none"),
+            )
+        return model
+
+    @staticmethod
+    def _rule_signature(
+        system_prompt: str,
+        model_config: OpenAIModelConfig,
+        user_prompt_template: str = USER_PROMPT_TEMPLATE,
+        preprocessing: Optional[dict] = None,
+    ) -> str:
+        """Hash of everything that changes a rule answer besides the code."""
+        signature = json.dumps(
+            [
+                system_prompt,
+                user_prompt_template,
+                model_config.model_id,
+                model_config.params,
+                # Only pooled rules add it, so existing cache keys stay valid
+                *(
+                    [[backend["model_id"] for backend in model_config.backends]]
+                    if model_config.backends
+                    else []
+                ),
+                *([preprocessing] if preprocessing is not None else []),
+            ],
+            sort_keys=True,
+        )
+        return hashlib.sha256(signature.encode("utf-8")).hexdigest()[:16]
+
+    def _cache_key(self, owasp_id: str, canonical: CanonicalCode) -> str:
+        return f"{owasp_id}:{self.rule_signatures[owasp_id]}:{canonical.fingerprint}"
+
+    def _verdict_key(self, owasp_id: str) -> str:
+        """Rule of the near-duplicate index, a new prompt or model starts anew."""
+        return f"{owasp_id}:{self.rule_signatures[owasp_id]}"
+
+    def _unit_cache_key(self, owasp_id: str, unit: CodeUnit) -> str:
+        return f"{self._cache_key(owasp_id, unit.canonical)}:unit"
+
+    def _get_cached(self, owasp_id: str, canonical: CanonicalCode):
+        """Cached payload for a rule with its findings moved to the new lines."""
+        entry = self.cache.get(self._cache_key(owasp_id, canonical))
+        if entry is None:
+            return None
+        payload = entry["payload"]
+        return {
+            **payload,
+            "response": remap_findings(
+                payload["response"], entry["line_map"], canonical.line_map
+            ),
+            "metrics": {
+                "inputTokens": 0,
+                "outputTokens": 0,
+                "totalTokens": 0,
+                "latencyMs": 0,
+                "cacheHit": True,
+            },
+        }
+
+    def _set_cached(self, owasp_id: str, canonical: CanonicalCode, payload: dict):
+        self.cache.set(
+            self._cache_key(owasp_id, canonical),
+            {"payload": payload, "line_map": canonical.line_map},
+        )
+
+    def estimate_cost(
+        self,
+        code_snippet: str,
+        language: Optional[str] = None,
+        skip_cached: bool = False,
+    ) -> tuple[int, int]:
+        """Worst case `(rule_calls, tokens)` of evaluating a snippet.
+
+        Assumes no cache hit: prompt plus snippet in, `max_tokens` out, for
+        every routed rule (the verdict agents in two-phase mode). With
+        `skip_cached`, rules whose result for the whole snippet is cached are
+        not counted.
+        """
+        canonical = canonicalize(code_snippet) if skip_cached else None
+        calls, tokens = 0, 0
+        for owasp_id in self.rules_for(language):
+            verdict_id = f"{owasp_id}{VERDICT_SUFFIX}"
+            agent = self.verdict_agents.get(verdict_id)
+            cached_ids = [owasp_id, verdict_id] if agent else [owasp_id]
+            if canonical is not None and any(
+                self.cache.get(self._cache_key(agent_id, canonical)) is not None
+                for agent_id in cached_ids
+            ):
+                continue
+            calls += 1
+            tokens += self._call_tokens(agent or self.agents[owasp_id], code_snippet)
+        return calls, tokens
+
+    @staticmethod
+    def _call_tokens(agent: OwaspAgent, code_snippet: str) -> int:
+        """Worst case tokens of a rule call: prompt and snippet in, `max_tokens` out."""
+        params = dict(agent.model.get_config()).get("params") or {}
+        return (len(agent.system_prompt) + len(code_snippet)) // CHARS_PER_TOKEN + (
+            params.get("max_tokens", 0)
+        )
+
+    def run_inference(self, code_snippet: str, language: Optional[str] = None) -> list:
+        """Run inference for the OWASP rules of the snippet language."""
+        code_snippet = self.guardrail.check(code_snippet).code
+        language = language or self.resolve_language(code=code_snippet)
+        canonical = canonicalize(code_snippet)
+        units = split_units(code_snippet)
         results = []
-        for owasp_id, agent in self.agents.items():
-            print(f"Running agent for {owasp_id}")
-            response = agent.run_inference(code_snippet)
+        for owasp_id in self._routed_rules(language):
+            logger.debug("Running rule", extra={"rule": owasp_id})
+            response = self._get_cached(owasp_id, canonical)
+            if response is None:
+                response = self._evaluate_rule(
+                    owasp_id, self.agents[owasp_id], code_snippet, canonical, units
+                )
             results.append(response)
         return results
 
-    async def run_async_inference(self, code_snippet: str) -> list:
-        """Asynchronous execution to run multiple inferences concurrently."""
-        loop = asyncio.get_running_loop()
-        tasks = [
-            loop.run_in_executor(None, agent.run_inference, code_snippet)
-            for agent in self.agents.values()
+    async def run_async_inference(
+        self,
+        code_snippet: str,
+        guardrail_result: Optional[GuardrailResult] = None,
+        repository: Optional[str] = None,
+        language: Optional[str] = None,
+        lane: Optional[str] = None,
+    ) -> list:
+        """Asynchronous execution to run multiple inferences concurrently.
+
+        The snippet goes through the guardrail first unless the caller already
+        screened it and passes the result. The language, resolved from the code
+        when not given, selects the rules to run; with the repository it also selects
+        the statistics used to schedule them. The model calls are dispatched
+        in the priority `lane`, the default lane when None.
+        """
+        if guardrail_result is None:
+            guardrail_result = self.guardrail.check(code_snippet)
+        code_snippet = guardrail_result.code
+        language = language or self.resolve_language(code=code_snippet)
+        return await self.run_async_prepared(
+            code_snippet,
+            canonicalize(code_snippet),
+            split_units(code_snippet),
+            repository=repository,
+            language=language,
+            lane=lane,
+        )
+
+    async def run_async_prepared(
+        self,
+        code_snippet: str,
+        canonical: CanonicalCode,
+        units: list,
+        repository: Optional[str] = None,
+        language: Optional[str] = None,
+        lane: Optional[str] = None,
+    ) -> list:
+        """Run every rule on a snippet already screened, canonicalized and split.
+
+        Lets callers do the CPU bound preprocessing elsewhere, e.g. the repository
+        scanner does it in a process pool.
+        """
+        return await self._run_scheduled(
+            lambda owasp_id: self._run_async_rule(
+                owasp_id, self.agents[owasp_id], code_snippet, canonical, units, lane
+            ),
+            repository,
+            language,
+            canonical,
+            units,
+        )
+
+    async def _run_scheduled(
+        self,
+        run_rule,
+        repository: Optional[str],
+        language: Optional[str],
+        canonical: Optional[CanonicalCode] = None,
+        units: Optional[list] = None,
+    ) -> list:
+        """Start the routed rules in the scheduler order.
+
+        Rules failed by near-duplicates of the snippet go first, keeping the
+        scheduler order among them. Results keep the order of `rules_for(language)`.
+        """
+        agent_ids = self._routed_rules(language)
+        plan = self.scheduler.plan(agent_ids, repository, language)
+        if self.near_duplicates is not None and canonical is not None:
+            # Same granularity as `_evaluate_rule` indexes the verdicts
+            canonicals = (
+                [unit.canonical for unit in units] if len(units) >= 2 else [canonical]
+            )
+            # Verdicts of the full or of the verdict agent of a rule
+            keys = {
+                self._verdict_key(agent_id): owasp_id
+                for owasp_id in agent_ids
+                for agent_id in (owasp_id, f"{owasp_id}{VERDICT_SUFFIX}")
+                if agent_id in self.rule_signatures
+            }
+            suspects = {
+                keys[key]
+                for key in self.near_duplicates.suspect_rules(canonicals, list(keys))
+            }
+            plan.sort(key=lambda decision: decision.owasp_id not in suspects)
+        semaphore = asyncio.Semaphore(
+            self.scheduler.max_concurrent_rules or len(plan) or 1
+        )
+
+        async def run(owasp_id: str) -> dict:
+            # The semaphore is FIFO, so rules start in the order of the plan
+            async with semaphore:
+                result = await run_rule(owasp_id)
+            self.scheduler.record(owasp_id, result, repository, language)
+            return result
+
+        tasks = {
+            decision.owasp_id: asyncio.create_task(run(decision.owasp_id))
+            for decision in plan
+        }
+        try:
+            return [await tasks[owasp_id] for owasp_id in agent_ids]
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    async def run_async_verdicts(
+        self,
+        code_snippet: str,
+        guardrail_result: Optional[GuardrailResult] = None,
+        repository: Optional[str] = None,
+        language: Optional[str] = None,
+        lane: Optional[str] = None,
+    ) -> tuple[str, list]:
+        """First phase of the two-phase evaluation: verdicts for every rule.
+
+        Rules with a cached full result return it, the others only get the
+        vulnerable lines from the verdict agents. The evaluation is stored under
+        the returned id, so `run_async_details` can explain the failing rules,
+        and with `"details": "background"` that starts right away.
+        """
+        if guardrail_result is None:
+            guardrail_result = self.guardrail.check(code_snippet)
+        code_snippet = guardrail_result.code
+        language = language or self.resolve_language(code=code_snippet)
+        canonical = canonicalize(code_snippet)
+        units = split_units(code_snippet)
+        results = await self._run_scheduled(
+            lambda owasp_id: self._run_async_verdict(
+                owasp_id, code_snippet, canonical, units, lane
+            ),
+            repository,
+            language,
+            canonical,
+            units,
+        )
+        failed = [
+            owasp_id
+            for owasp_id, result in zip(self.rules_for(language), results)
+            if not result["pass"]
+        ]
+        evaluation_id = uuid.uuid4().hex
+        await self._off_loop(
+            self.evaluations,
+            self.evaluations.set,
+            f"{EVALUATION_KEY_PREFIX}{evaluation_id}",
+            {"code": code_snippet, "failed": failed},
+        )
+        if failed and self.two_phase_config.get("details") == "background":
+            self._start_background_details(failed, code_snippet, canonical, units)
+        return evaluation_id, results
+
+    def _start_background_details(
+        self, owasp_ids: list, code_snippet: str, canonical: CanonicalCode, units
+    ) -> None:
+        """Explain the failing rules ahead of the request for the details.
+
+        They run in the details lane with their own admission ticket; when the
+        backlog is full they are skipped and generated on demand instead.
+        """
+        try:
+            ticket = self.admission.admit(
+                self.details_lane,
+                len(owasp_ids),
+                sum(
+                    self._call_tokens(self.agents[owasp_id], code_snippet)
+                    for owasp_id in owasp_ids
+                ),
+            )
+        except OverloadedError as e:
+            logger.info("Background details skipped: %s", e)
+            return
+
+        async def run():
+            with ticket:
+                return await self._run_details(
+                    owasp_ids, code_snippet, canonical, units, self.details_lane
+                )
+
+        task = asyncio.create_task(run())
+        self._details_tasks.add(task)
+        task.add_done_callback(self._on_details_done)
+
+    async def _run_async_verdict(
+        self,
+        owasp_id: str,
+        code_snippet: str,
+        canonical: CanonicalCode,
+        units: list,
+        lane: Optional[str] = None,
+    ) -> dict:
+        cached = await self._off_loop(self.cache, self._get_cached, owasp_id, canonical)
+        if cached is not None:
+            return {**cached, "phase": "details"}
+        verdict_id = f"{owasp_id}{VERDICT_SUFFIX}"
+        result = await self._run_async_rule(
+            verdict_id,
+            self.verdict_agents[verdict_id],
+            code_snippet,
+            canonical,
+            units,
+            lane,
+        )
+        return {**result, "phase": "verdict"}
+
+    async def run_async_details(
+        self, evaluation_id: str, lane: Optional[str] = None
+    ) -> Optional[list]:
+        """Second phase: full description and fix of the failing rules.
+
+        Returns None when the evaluation is unknown or expired. Rules already
+        explained, or being explained in the background, are not requested again.
+        """
+        evaluation = await self._off_loop(
+            self.evaluations,
+            self.evaluations.get,
+            f"{EVALUATION_KEY_PREFIX}{evaluation_id}",
+        )
+        if evaluation is None:
+            return None
+        code_snippet = evaluation["code"]
+        return await self._run_details(
+            evaluation["failed"],
+            code_snippet,
+            canonicalize(code_snippet),
+            split_units(code_snippet),
+            lane,
+        )
+
+    async def _run_details(
+        self,
+        owasp_ids: list,
+        code_snippet: str,
+        canonical: CanonicalCode,
+        units: list,
+        lane: Optional[str] = None,
+    ) -> list:
+        return await asyncio.gather(
+            *(
+                self._run_async_rule(
+                    owasp_id,
+                    self.agents[owasp_id],
+                    code_snippet,
+                    canonical,
+                    units,
+                    lane,
+                )
+                for owasp_id in owasp_ids
+            )
+        )
+
+    def _on_details_done(self, task: asyncio.Task) -> None:
+        self._details_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(
+                "Background details failed",
+                exc_info=task.exception(),
+            )
+
+    async def _run_async_rule(
+        self,
+        owasp_id: str,
+        agent: OwaspAgent,
+        code_snippet: str,
+        canonical: CanonicalCode,
+        units: list,
+        lane: Optional[str] = None,
+    ) -> dict:
+        """Run one rule in the executor unless an equivalent snippet is cached.
+
+        When an equivalent snippet is already being evaluated, in this or in
+        another worker process, wait for its result instead of duplicating it.
+        Only actual model calls take a slot of the lane.
+        """
+        key = self._cache_key(owasp_id, canonical)
+        while True:
+            cached = await self._off_loop(
+                self.cache, self._get_cached, owasp_id, canonical
+            )
+            if cached is not None:
+                return cached
+            if await self._off_loop(self.inflight, self.inflight.claim, key):
+                break
+            await asyncio.sleep(self.inflight_poll_seconds)
+        try:
+            # The owner may have finished between the lookup and the claim
+            cached = await self._off_loop(
+                self.cache, self._get_cached, owasp_id, canonical
+            )
+            if cached is not None:
+                return cached
+            loop = asyncio.get_running_loop()
+            async with self.lanes.slot(lane):
+                # The rule thread logs with the correlation id of the request,
+                # and its samples go to the profile of the request if any
+                return await loop.run_in_executor(
+                    self.executor,
+                    contextvars.copy_context().run,
+                    tagged(self._evaluate_rule),
+                    owasp_id,
+                    agent,
+                    code_snippet,
+                    canonical,
+                    units,
+                )
+        finally:
+            await self._off_loop(self.inflight, self.inflight.release, key)
+
+    @staticmethod
+    async def _off_loop(store, function: Callable, *args):
+        """Call a method of a cache or in-flight registry.
+
+        Stores doing I/O (the SQLite backend) are called in the default
+        executor, so the event loop never waits for the database.
+        """
+        if not store.blocking:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def _evaluate_rule(
+        self,
+        owasp_id: str,
+        agent: OwaspAgent,
+        code_snippet: str,
+        canonical: CanonicalCode,
+        units: list,
+    ) -> dict:
+        """Evaluate one rule, only sending the units without cached findings.
+
+        With near-duplicate reuse enabled, units close enough to one that
+        passed the rule pass without a model call, and the verdicts of the
+        evaluated units are added to the index.
+        """
+        rule = self._verdict_key(owasp_id)
+        if len(units) < 2:
+            similarity = self._near_duplicate_pass(canonical, rule)
+            if similarity is not None:
+                return self._reused_pass(agent, similarity)
+            response = agent.run_inference(code_snippet)
+            self._set_cached(owasp_id, canonical, response)
+            self._add_near_duplicate(canonical, rule, response["pass"])
+            return response
+
+        unit_findings, missing, near_duplicates = {}, [], 0
+        for index, unit in enumerate(units):
+            entry = self.cache.get(self._unit_cache_key(owasp_id, unit))
+            if entry is not None:
+                unit_findings[index] = self._place_unit_findings(entry, unit)
+            elif self._near_duplicate_pass(unit.canonical, rule) is not None:
+                unit_findings[index] = []
+                near_duplicates += 1
+            else:
+                missing.append(index)
+
+        metrics = {
+            "inputTokens": 0,
+            "outputTokens": 0,
+            "totalTokens": 0,
+            "latencyMs": 0,
+            "cacheHit": True,
+        }
+        if missing:
+            delta_snippet, delta_lines = self._build_delta(units, missing)
+            response = agent.run_inference(delta_snippet)
+            metrics = response["metrics"]
+            new_findings = self._attribute_findings(
+                response["response"], units, delta_lines
+            )
+            if new_findings is None:
+                # Findings could not be attributed to units, return them whole
+                response["response"] = remap_line_fields(
+                    response["response"],
+                    lambda line: self._delta_to_source(line, units, delta_lines),
+                )
+                return response
+            for index in missing:
+                unit = units[index]
+                relative = new_findings.get(index, [])
+                self.cache.set(
+                    self._unit_cache_key(owasp_id, unit),
+                    {"findings": relative, "line_map": unit.canonical.line_map},
+                )
+                unit_findings[index] = self._place_unit_findings(
+                    {"findings": relative, "line_map": unit.canonical.line_map},
+                    unit,
+                )
+                self._add_near_duplicate(unit.canonical, rule, not relative)
+
+        blocks = sorted(
+            (block for blocks in unit_findings.values() for block in blocks),
+            key=lambda block: finding_line(block) or 0,
+        )
+        text = render_findings(blocks)
+        payload = {
+            "owasp_name": agent.owasp_name,
+            "response": text,
+            "pass": agent.is_pass(text),
+            "metrics": {
+                **metrics,
+                "unitsEvaluated": len(missing),
+                "unitsReused": len(units) - len(missing) - near_duplicates,
+                "unitsNearDuplicate": near_duplicates,
+            },
+        }
+        if not near_duplicates:
+            # A reused verdict is an estimate, only exact results are cached
+            self._set_cached(owasp_id, canonical, payload)
+        return payload
+
+    def _near_duplicate_pass(
+        self, canonical: CanonicalCode, rule: str
+    ) -> Optional[float]:
+        if self.near_duplicates is None:
+            return None
+        return self.near_duplicates.reusable_pass(canonical, rule)
+
+    def _add_near_duplicate(
+        self, canonical: CanonicalCode, rule: str, passed: bool
+    ) -> None:
+        if self.near_duplicates is not None:
+            self.near_duplicates.index.add(canonical, rule, passed)
+
+    @staticmethod
+    def _reused_pass(agent: OwaspAgent, similarity: float) -> dict:
+        """Payload of a rule passed by a near-duplicate, without a model call."""
+        return {
+            "owasp_name": agent.owasp_name,
+            "response": render_findings([]),
+            "pass": True,
+            "metrics": {
+                "inputTokens": 0,
+                "outputTokens": 0,
+                "totalTokens": 0,
+                "latencyMs": 0,
+                "cacheHit": True,
+                "nearDuplicate": round(similarity, 4),
+            },
+        }
+
+    @staticmethod
+    def _build_delta(units: list, missing: list) -> tuple[str, list]:
+        """Join the units to evaluate, tracking where every line comes from."""
+        chunks, delta_lines = [], []
+        for index in missing:
+            if chunks:
+                chunks.append("")
+                delta_lines.append(None)
+            unit_lines = units[index].code.split("\n")
+            chunks.extend(unit_lines)
+            delta_lines.extend(
+                (index, relative) for relative in range(1, len(unit_lines) + 1)
+            )
+        return "\n".join(chunks), delta_lines
+
+    @staticmethod
+    def _attribute_findings(
+        response: str, units: list, delta_lines: list
+    ) -> Optional[dict]:
+        """Group findings per unit with unit relative line numbers."""
+        blocks = split_findings(response)
+        if blocks is None:
+            return None
+        findings = {}
+        for block in blocks:
+            line = finding_line(block)
+            if line is None or not 1 <= line <= len(delta_lines):
+                return None
+            location = delta_lines[line - 1] or delta_lines[line - 2]
+            index = location[0]
+            offset = line - location[1]
+            findings.setdefault(index, []).append(
+                remap_line_fields(
+                    block,
+                    lambda value, offset=offset, size=len(units[index].lines): min(
+                        max(value - offset, 1), size
+                    ),
+                )
+            )
+        return findings
+
+    @staticmethod
+    def _delta_to_source(line: int, units: list, delta_lines: list) -> int:
+        if not 1 <= line <= len(delta_lines):
+            return line
+        index, relative = delta_lines[line - 1] or delta_lines[line - 2]
+        return units[index].lines[relative - 1]
+
+    @staticmethod
+    def _place_unit_findings(entry: dict, unit: CodeUnit) -> list:
+        """Move cached unit findings to the lines of the current snippet."""
+        return [
+            remap_line_fields(
+                remap_findings(block, entry["line_map"], unit.canonical.line_map),
+                lambda value: unit.lines[min(max(value, 1), len(unit.lines)) - 1],
+            )
+            for block in entry["findings"]
         ]
-        results = await asyncio.gather(*tasks)
-        # Flatten the list of results
-        # return [item for sublist in results for item in sublist]
-        return results
@@ -0,0 +1,58 @@
+import pytest
+
+from src import admission as admission_module
+from src.admission import AdmissionController, OverloadedError
+
+
+def test_idle_service_admits_any_size():
+    controller = AdmissionController(max_backlog_tokens=100, max_backlog_calls=1)
+    with controller.admit("interactive", calls=5, tokens=1000):
+        assert controller.stats()["backlog_calls"] == 5
+    assert controller.stats()["backlog_tokens"] == 0
+
+
+def test_full_backlog_sheds_with_default_retry_after():
+    controller = AdmissionController(max_backlog_calls=2, default_retry_after=7)
+    ticket = controller.admit("interactive", calls=2, tokens=10)
+    with pytest.raises(OverloadedError) as error:
+        controller.admit("interactive", calls=1, tokens=10)
+    assert error.value.retry_after == 7
+    assert controller.stats()["shed"] == {"interactive": 1}
+    ticket.release()
+    # Releasing twice returns the cost only once
+    ticket.release()
+    assert controller.stats()["backlog_calls"] == 0
+    controller.admit("interactive", calls=1, tokens=10)
+
+
+def test_lower_lanes_are_shed_first():
+    controller = AdmissionController(
+        max_backlog_calls=10, lane_shares={"interactive": 1.0, "bulk": 0.5}
+    )
+    controller.admit("interactive", calls=5, tokens=10)
+    with pytest.raises(OverloadedError):
+        controller.admit("bulk", calls=1, tokens=10)
+    controller.admit("interactive", calls=1, tokens=10)
+
+
+def test_retry_after_follows_the_drain_rate(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(admission_module.time, "monotonic", lambda: now[0])
+    controller = AdmissionController(
+        max_backlog_tokens=1000, max_wait_seconds=None, max_retry_after=60
+    )
+    controller.admit("interactive", calls=1, tokens=500).release()
+    now[0] = 10.0
+    controller.admit("interactive", calls=1, tokens=900)
+    with pytest.raises(OverloadedError) as error:
+        controller.admit("interactive", calls=1, tokens=400)
+    # 500 tokens drained in the 10 s window, 300 tokens over the limit
+    assert error.value.retry_after == 6
+
+
+def test_long_wait_is_shed():
+    controller = AdmissionController(max_wait_seconds=1)
+    controller.admit("interactive", calls=1, tokens=10).release()
+    controller.admit("interactive", calls=1, tokens=10_000)
+    with pytest.raises(OverloadedError, match="backlog wait too long"):
+        controller.admit("interactive", calls=1, tokens=10)
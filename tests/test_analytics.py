@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from src.analytics import AnalyticsStore, count_findings
+
+FINDING = """```yaml
+vulnerabilities_detected:
+  - line: 3
+    description: SQL built from user input
+    suggested_fix: Use bound parameters
+```"""
+CLEAN = "```yaml\nvulnerabilities_detected: []\n```"
+
+
+def result(name, passed, response, tokens=10, latency=100):
+    return {
+        "owasp_name": name,
+        "pass": passed,
+        "response": response,
+        "metrics": {
+            "inputTokens": tokens,
+            "outputTokens": 1,
+            "totalTokens": tokens + 1,
+            "latencyMs": latency,
+        },
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AnalyticsStore(str(tmp_path / "analytics.db"))
+    yield store
+    store.close()
+
+
+def test_count_findings():
+    assert count_findings(FINDING) == 1
+    assert count_findings(CLEAN) == 0
+    # Unparseable responses fall back to the suggested fixes
+    assert count_findings("suggested_fix: a\nsuggested_fix: b") == 2
+
+
+def test_rollups_are_incremental(store):
+    day = datetime(2025, 1, 2, tzinfo=timezone.utc)
+    store.record_evaluation(
+        [result("A03", False, FINDING), result("A02", True, CLEAN)],
+        "repo",
+        "alice",
+        day,
+    )
+    store.record_evaluation(
+        [result("A03", True, CLEAN), result("A02", True, CLEAN)],
+        "repo",
+        "bob",
+        day,
+    )
+
+    rules = {row["rule"]: row for row in store.query(group_by="rule")}
+    assert rules["A03"]["evaluations"] == 2
+    assert rules["A03"]["failures"] == 1
+    assert rules["A03"]["vulnerabilities"] == 1
+    assert rules["A03"]["pass_rate"] == 0.5
+    assert rules["A02"]["totalTokens"] == 22
+    assert store.summary() == {"evaluations": 2, "passed": 1, "pass_rate": 0.5}
+
+    users = store.query(group_by="user", user="bob")
+    assert [row["user"] for row in users] == ["bob"]
+    assert store.summary(start="2025-01-03")["evaluations"] == 0
+
+
+def test_query_rejects_unknown_columns(store):
+    with pytest.raises(ValueError):
+        store.query(group_by="owasp_name; DROP TABLE rule_daily_rollup")
@@ -0,0 +1,38 @@
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # The app builds its workflow and stores on import, relative to the cwd
+    monkeypatch.chdir(tmp_path)
+    for name, value in {
+        "AUTH0_DOMAIN": "example.auth0.com",
+        "AUTH0_AUDIENCE": "audience",
+        "AUTH0_ISSUER": "https://example.auth0.com/",
+        "AUTH0_ALGORITHMS": "RS256",
+        "CONFIG_PATH": "configs/configs.json",
+        "OPENAI_API_KEY": "sk-test",
+        "INTEGRITY_DB_PATH": str(tmp_path / "integrity.db"),
+        "ANALYTICS_DB_PATH": str(tmp_path / "analytics.db"),
+    }.items():
+        monkeypatch.setenv(name, value)
+    app_module = importlib.import_module("src.app")
+    app_module.app.dependency_overrides[app_module.auth.verify] = lambda: {
+        "sub": "developer",
+        "scope": "openid",
+    }
+    yield TestClient(app_module.app)
+    app_module.app.dependency_overrides.clear()
+
+
+def test_snippets_without_rules_are_skipped(client):
+    response = client.post(
+        "/evaluate", json={"code": "# Usage\n\nRun it.\n", "path": "README.md"}
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "skipped"
+    assert response.json()["result"] == []
+    assert response.json()["language"] == "markdown"
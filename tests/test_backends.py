@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from strands.models import Model
+
+from src.backends import Backend, BackendPool
+
+
+class FakeModel(Model):
+    def __init__(self, events=1, fail=False):
+        self.events = events
+        self.fail = fail
+
+    def update_config(self, **model_config):
+        pass
+
+    def get_config(self):
+        return {}
+
+    def structured_output(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def stream(self, messages, tool_specs=None, system_prompt=None, **kwargs):
+        if self.fail:
+            raise ConnectionError("backend down")
+        for index in range(self.events):
+            yield {"index": index}
+
+
+def pool(*models):
+    return BackendPool(
+        [Backend(f"backend-{index}", model) for index, model in enumerate(models)]
+    )
+
+
+async def collect(stream) -> list:
+    return [event async for event in stream]
+
+
+def test_failed_call_is_retried_on_another_backend():
+    backends = pool(FakeModel(fail=True), FakeModel(events=2))
+    events = asyncio.run(collect(backends.stream([])))
+    assert events == [{"index": 0}, {"index": 1}]
+    stats = {backend["name"]: backend for backend in backends.stats()}
+    assert stats["backend-0"]["failures"] == 1
+    assert all(backend["outstanding"] == 0 for backend in stats.values())
+
+
+def test_last_attempt_failure_is_raised():
+    backends = pool(FakeModel(fail=True), FakeModel(fail=True))
+    with pytest.raises(ConnectionError):
+        asyncio.run(collect(backends.stream([])))
+    assert [backend["outstanding"] for backend in backends.stats()] == [0, 0]
+
+
+def test_closed_stream_releases_its_backend():
+    backends = pool(FakeModel(events=3))
+
+    async def read_one():
+        stream = backends.stream([])
+        await stream.__anext__()
+        await stream.aclose()
+
+    asyncio.run(read_one())
+    assert backends.stats()[0]["outstanding"] == 0
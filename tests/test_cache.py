@@ -0,0 +1,99 @@
+import itertools
+import sqlite3
+
+from src import cache as cache_module
+from src.cache import (
+    InFlightRegistry,
+    ResultCache,
+    SQLiteInFlightRegistry,
+    SQLiteResultCache,
+    build_cache,
+)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = ResultCache(max_entries=2)
+    cache.set("a", {"n": 1})
+    cache.set("b", {"n": 2})
+    assert cache.get("a") == {"n": 1}
+    cache.set("c", {"n": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"n": 1}
+    assert cache.stats()["hits"] == 2
+
+
+def test_sqlite_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    # Further apart than the touch interval, so every hit updates the entry
+    clock = itertools.count(1000, 100)
+    monkeypatch.setattr(cache_module.time, "time", lambda: next(clock))
+    cache = SQLiteResultCache(
+        str(tmp_path / "cache.db"), max_entries=2, eviction_interval=1
+    )
+    cache.set("a", {"n": 1})
+    cache.set("b", {"n": 2})
+    # Reading `a` makes `b` the least recently used entry
+    assert cache.get("a") == {"n": 1}
+    cache.set("c", {"n": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"n": 1}
+    assert cache.get("c") == {"n": 3}
+
+
+def test_sqlite_cache_hits_within_the_touch_interval_do_not_write(tmp_path):
+    cache = SQLiteResultCache(str(tmp_path / "cache.db"), touch_interval_seconds=60)
+    cache.set("a", {"n": 1})
+    statements = []
+    cache._connect().set_trace_callback(statements.append)
+    assert cache.get("a") == {"n": 1}
+    assert not [s for s in statements if s.startswith("UPDATE")]
+    cache.touch_interval_seconds = -1
+    assert cache.get("a") == {"n": 1}
+    assert [s for s in statements if s.startswith("UPDATE")]
+
+
+def test_sqlite_cache_upgrades_existing_databases(tmp_path):
+    path = str(tmp_path / "cache.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+        )
+        connection.execute("INSERT INTO results VALUES ('a', '{\"n\": 1}', 1.0)")
+    cache = SQLiteResultCache(path)
+    assert cache.get("a") == {"n": 1}
+    cache.set("b", {"n": 2})
+    assert cache.stats()["entries"] == 2
+
+
+def test_sqlite_cache_expires_entries(tmp_path):
+    cache = SQLiteResultCache(str(tmp_path / "cache.db"), ttl_seconds=-1)
+    cache.set("a", {"n": 1})
+    assert cache.get("a") is None
+
+
+def test_inflight_claims_are_exclusive(tmp_path):
+    path = str(tmp_path / "cache.db")
+    for first, second in (
+        (InFlightRegistry(), None),
+        (SQLiteInFlightRegistry(path), SQLiteInFlightRegistry(path)),
+    ):
+        second = second or first
+        assert first.claim("key")
+        assert not second.claim("key")
+        first.release("key")
+        assert second.claim("key")
+
+
+def test_build_cache_marks_blocking_backends(tmp_path):
+    cache, inflight = build_cache({"backend": "memory"})
+    assert not cache.blocking and not inflight.blocking
+    cache, inflight = build_cache(
+        {"backend": "sqlite", "path": str(tmp_path / "cache.db")}
+    )
+    assert cache.blocking and inflight.blocking
+
+
+def test_build_cache_none_keeps_nothing():
+    cache, _ = build_cache({"backend": "none", "path": "cache.db", "ttl_seconds": 60})
+    cache.set("a", {"n": 1})
+    assert cache.get("a") is None
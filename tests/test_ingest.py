@@ -0,0 +1,105 @@
+import asyncio
+import gzip
+
+import pytest
+
+from src.ingest import (
+    DECODE_STEP_BYTES,
+    IngestLimits,
+    PayloadTooLargeError,
+    decoded_stream,
+    iter_ndjson,
+)
+
+
+class FakeRequest:
+    def __init__(self, body: bytes, encoding: str, chunk_bytes: int = 65536):
+        self.headers = {"content-encoding": encoding}
+        self.chunks = [
+            body[index : index + chunk_bytes]
+            for index in range(0, len(body), chunk_bytes)
+        ]
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+        yield b""
+
+
+def decode(request, limits=IngestLimits()) -> list:
+    async def collect():
+        return [piece async for piece in decoded_stream(request, limits)]
+
+    return asyncio.run(collect())
+
+
+def test_gzip_body_is_decoded_in_bounded_steps():
+    body = b"print('hello')\n" * 20000
+    pieces = decode(FakeRequest(gzip.compress(body), "gzip"))
+    assert b"".join(pieces) == body
+    assert max(map(len, pieces)) <= DECODE_STEP_BYTES
+
+
+def test_decoded_limit_stops_a_bomb():
+    bomb = gzip.compress(b"\0" * (50 * 1024 * 1024))
+    with pytest.raises(PayloadTooLargeError):
+        decode(FakeRequest(bomb, "gzip"), IngestLimits(max_decoded_bytes=1024 * 1024))
+
+
+@pytest.mark.parametrize("chunk_bytes", [7, 65536])
+def test_zstd_output_is_bounded_per_step(chunk_bytes):
+    zstandard = pytest.importorskip("zstandard")
+    body = b"a" * 300_000 + b"".join(b"%d\n" % n for n in range(50_000))
+    # Two frames, read across
+    compressed = zstandard.ZstdCompressor().compress(body[:1000])
+    compressed += zstandard.ZstdCompressor().compress(body[1000:])
+    pieces = decode(FakeRequest(compressed, "zstd", chunk_bytes))
+    assert b"".join(pieces) == body
+    assert max(map(len, pieces)) <= DECODE_STEP_BYTES
+
+
+def test_zstd_bomb_is_stopped_in_bounded_steps():
+    zstandard = pytest.importorskip("zstandard")
+    bomb = zstandard.ZstdCompressor(level=19).compress(b"\0" * (64 * 1024 * 1024))
+    with pytest.raises(PayloadTooLargeError):
+        decode(FakeRequest(bomb, "zstd"), IngestLimits(max_decoded_bytes=1024 * 1024))
+
+
+def test_ndjson_lines_are_bounded():
+    async def chunks():
+        yield b'{"path": "a.py", "code": "x"}\n{"path": "b.py",'
+        yield b' "code": "y"}\n'
+
+    async def collect(max_line_bytes):
+        return [item async for item in iter_ndjson(chunks(), max_line_bytes)]
+
+    assert [item["path"] for item in asyncio.run(collect(100))] == ["a.py", "b.py"]
+    with pytest.raises(PayloadTooLargeError):
+        asyncio.run(collect(10))
+
+
+def test_ndjson_line_without_newline_is_stopped_early():
+    received = []
+
+    async def chunks():
+        for _ in range(1000):
+            received.append(1)
+            yield b"x" * 64
+
+    async def collect():
+        return [item async for item in iter_ndjson(chunks(), 1024)]
+
+    with pytest.raises(PayloadTooLargeError):
+        asyncio.run(collect())
+    assert len(received) == 17
+
+
+def test_ndjson_long_complete_lines_are_rejected():
+    async def chunks():
+        yield b'{"code": "' + b"x" * 2048 + b'"}\n{"code": "y"}\n'
+
+    async def collect():
+        return [item async for item in iter_ndjson(chunks(), 1024)]
+
+    with pytest.raises(PayloadTooLargeError):
+        asyncio.run(collect())
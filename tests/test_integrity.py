@@ -0,0 +1,105 @@
+import sqlite3
+
+from src.integrity import (
+    INTEGRITY_SCHEMA,
+    FileNode,
+    IntegrityIndex,
+    failed_hunks,
+    parse_diff,
+    split_hunks,
+)
+
+DIFF = """diff --git a/app.py b/app.py
+--- a/app.py
++++ b/app.py
+@@ -1,2 +1,4 @@
+ import os
++import subprocess
+ 
++subprocess.run(os.environ["CMD"], shell=True)
+diff --git a/old.py b/old.py
+--- a/old.py
++++ /dev/null
+@@ -1 +0,0 @@
+-print("gone")
+"""
+
+
+def test_parse_diff_splits_added_runs_and_skips_deleted_files():
+    files = parse_diff(DIFF)
+    assert [file.path for file in files] == ["app.py"]
+    assert [(hunk.start_line, hunk.lines) for hunk in files[0].hunks] == [
+        (2, ["import subprocess"]),
+        (4, ['subprocess.run(os.environ["CMD"], shell=True)']),
+    ]
+
+
+def test_verify_reports_unevaluated_hunks(tmp_path):
+    index = IntegrityIndex(str(tmp_path / "integrity.db"))
+    files = parse_diff(DIFF)
+    index.record_evaluation("e1", files, True, rules="r1")
+    assert index.verify(files)["lookups"] == 1
+    pushed = parse_diff(DIFF.replace("+import subprocess", "+import shlex"))
+    report = index.verify(pushed)
+    assert not report["covered"]
+    assert [hunk["start_line"] for hunk in report["unevaluated"]] == [2]
+
+
+def test_retrying_the_same_rules_does_not_clear_a_failure(tmp_path):
+    # Regression: re-submitting until a flaky verdict passed overwrote the fail
+    index = IntegrityIndex(str(tmp_path / "integrity.db"))
+    files = split_hunks("eval(input())", "main.py")
+    index.record_evaluation("e1", files, False, rules="r1")
+    index.record_evaluation("e2", files, True, rules="r1")
+    report = index.verify(files)
+    assert not report["passed"]
+    assert report["evaluations"] == ["e1"]
+    index.record_evaluation("e3", files, True, rules="r2")
+    assert index.verify(files)["passed"]
+    index.record_evaluation("e4", files, False, rules="r2")
+    assert not index.verify(files)["passed"]
+
+
+def test_clean_hunks_evaluated_with_a_failing_one_pass(tmp_path):
+    # Regression: every hunk got the failure of the whole evaluation, and the
+    # same rules could never clear it
+    index = IntegrityIndex(str(tmp_path / "integrity.db"))
+    files = parse_diff(DIFF)
+    clean, vulnerable = files[0].hunks
+    finding = "vulnerabilities_detected:\n  - line: 8\n    description: Injection"
+    results = [{"pass": False, "response": finding}]
+    assert failed_hunks(files, results) == {vulnerable.hash}
+    index.record_evaluation(
+        "e1", files, False, rules="r1", failed=failed_hunks(files, results)
+    )
+    assert not index.verify(files)["passed"]
+    assert index.verify([FileNode("app.py", [clean])])["passed"]
+    assert not index.verify([FileNode("app.py", [vulnerable])])["passed"]
+
+
+def test_findings_without_a_hunk_line_fail_every_hunk():
+    files = parse_diff(DIFF)
+    hashes = {hunk.hash for hunk in files[0].hunks}
+    context = "vulnerabilities_detected:\n  - line: 5\n    description: Injection"
+    assert failed_hunks(files, [{"pass": False, "response": context}]) == hashes
+    assert failed_hunks(files, [{"pass": False, "response": "Injection"}]) == hashes
+    assert failed_hunks(files, [{"pass": True, "response": "ok"}]) == set()
+
+
+def test_evaluations_only_cover_their_repository(tmp_path):
+    index = IntegrityIndex(str(tmp_path / "integrity.db"))
+    files = split_hunks("print('hello')", "main.py")
+    index.record_evaluation("e1", files, True, repository="team/a", rules="r1")
+    assert index.verify(files, repository="team/a")["passed"]
+    assert not index.verify(files, repository="team/b")["covered"]
+    assert not index.verify(files)["covered"]
+
+
+def test_existing_indexes_are_upgraded(tmp_path):
+    path = str(tmp_path / "integrity.db")
+    with sqlite3.connect(path) as connection:
+        connection.executescript(INTEGRITY_SCHEMA.replace(",\n    rules TEXT", ""))
+    index = IntegrityIndex(path)
+    files = split_hunks("print('hello')", "main.py")
+    index.record_evaluation("e1", files, True, rules="r1")
+    assert index.verify(files)["passed"]
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from src.lanes import LaneFullError, LaneScheduler
+
+LANES = {
+    "interactive": {"priority": 0, "reserved": 1, "max_queue": 10},
+    "bulk": {"priority": 2, "reserved": 0, "max_concurrency": 2, "max_queue": 1},
+}
+
+
+def test_lanes_borrow_shared_slots_but_not_reserved_ones():
+    async def run():
+        lanes = LaneScheduler(total_concurrency=3, lanes=LANES)
+        assert lanes.shared == 2
+        # Bulk takes both shared slots, its cap stops it there
+        await lanes.acquire("bulk")
+        await lanes.acquire("bulk")
+        waiting = asyncio.create_task(lanes.acquire("bulk"))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        # The reserved interactive slot is still free
+        await lanes.acquire("interactive")
+        assert lanes.stats()["shared_in_use"] == 2
+        lanes.release("bulk")
+        await waiting
+        assert lanes.lanes["bulk"].running == 2
+
+    asyncio.run(run())
+
+
+def test_freed_slots_go_to_the_most_urgent_lane():
+    async def run():
+        lanes = LaneScheduler(total_concurrency=2, lanes=LANES)
+        # Its reserved slot and the shared one
+        await lanes.acquire("interactive")
+        await lanes.acquire("interactive")
+        order = []
+
+        async def call(name):
+            async with lanes.slot(name):
+                order.append(name)
+
+        bulk = asyncio.create_task(call("bulk"))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(call("interactive"))
+        await asyncio.sleep(0)
+        lanes.release("interactive")
+        await asyncio.gather(bulk, interactive)
+        assert order == ["interactive", "bulk"]
+
+    asyncio.run(run())
+
+
+def test_full_queues_reject_calls():
+    async def run():
+        lanes = LaneScheduler(total_concurrency=1, lanes=LANES)
+        await lanes.acquire("interactive")
+        queued = asyncio.create_task(lanes.acquire("bulk"))
+        await asyncio.sleep(0)
+        with pytest.raises(LaneFullError):
+            await lanes.acquire("bulk")
+        assert lanes.lanes["bulk"].rejected == 1
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert not lanes.lanes["bulk"].waiters
+
+    asyncio.run(run())
+
+
+def test_tokens_cannot_ask_for_a_more_urgent_lane():
+    lanes = LaneScheduler(total_concurrency=3, lanes=LANES, default="bulk")
+    assert lanes.resolve(None) == "bulk"
+    assert lanes.resolve(None, "openid lane:interactive") == "interactive"
+    with pytest.raises(PermissionError):
+        lanes.resolve("interactive")
+    with pytest.raises(ValueError):
+        LaneScheduler(total_concurrency=0, lanes=LANES)
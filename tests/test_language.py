@@ -0,0 +1,54 @@
+import asyncio
+import os
+
+import pytest
+
+from src.language import detect_language
+from src.workflow import OwaspWorkflow
+
+CONFIG_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "src", "configs", "configs.json"
+)
+
+
+@pytest.fixture
+def workflow(tmp_path, monkeypatch):
+    # The indexes of the workflow are created relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    return OwaspWorkflow(CONFIG_PATH)
+
+
+def test_extension_wins_over_the_code():
+    assert detect_language("app/models.PY", "<?php echo 1;") == "python"
+    assert detect_language("notes.unknown") is None
+
+
+def test_shebang_and_tokens():
+    assert detect_language(code="#!/usr/bin/env python3\nprint(1)") == "python"
+    assert detect_language(code="const fs = require('fs');\n") == "javascript"
+    assert detect_language(code="x") is None
+
+
+def test_code_looking_text_is_never_a_document():
+    code = "# Heading\n\n- item\nresult = compute(value);\n"
+    assert detect_language(code=code) != "markdown"
+
+
+def test_only_the_extension_may_skip_rules(workflow):
+    everything = workflow.rules_for(None)
+    assert workflow.resolve_language("README.md", "x") == "markdown"
+    # A client supplied or guessed language that drops rules is not trusted
+    assert workflow.resolve_language(None, "print(1)", "markdown") is None
+    assert workflow.resolve_language(None, "# Title\n\n- a\n- b\n") is None
+    assert workflow.rules_for(workflow.resolve_language(code="SELECT 1")) == everything
+    # A language whose route runs every rule can still be used
+    assert workflow.resolve_language(None, "x = 1", "python") == "python"
+
+
+def test_evaluations_without_rules_are_rejected(workflow):
+    assert workflow.rules_for("markdown") == []
+    with pytest.raises(ValueError):
+        asyncio.run(workflow.run_async_inference("# Title", language="markdown"))
+    with pytest.raises(ValueError):
+        workflow.run_inference("# Title", language="markdown")
@@ -0,0 +1,44 @@
+import json
+import logging
+import queue
+import sys
+
+from src.logs import DroppingQueueHandler, JsonFormatter, new_correlation_id
+
+
+def prepared(handler, **kwargs):
+    record = logging.makeLogRecord(
+        {"name": "src.test", "levelno": logging.ERROR, "levelname": "ERROR", **kwargs}
+    )
+    return handler.prepare(record)
+
+
+def test_prepare_keeps_exceptions_and_extra_fields():
+    handler = DroppingQueueHandler(queue.Queue())
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = prepared(
+            handler,
+            msg="Rule %s failed",
+            args=("A03",),
+            exc_info=sys.exc_info(),
+            rule="A03",
+        )
+    assert record.exc_info is None and record.args is None
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "Rule A03 failed"
+    assert entry["rule"] == "A03"
+    assert "ValueError: boom" in entry["exception"]
+
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    for _ in range(3):
+        handler.handle(logging.makeLogRecord({"msg": "event"}))
+    assert handler.dropped == 2
+
+
+def test_unsafe_correlation_ids_are_replaced():
+    assert new_correlation_id("req-1.2:3") == "req-1.2:3"
+    assert new_correlation_id("bad id\n") != "bad id\n"
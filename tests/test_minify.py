@@ -0,0 +1,106 @@
+from src.minify import minify
+
+CODE = """import os  # the module
+
+
+def run(user):
+    # Build the command
+    command = "ls " + user   
+
+    return os.system(command)
+"""
+
+
+def test_comments_and_blank_lines_are_dropped_with_their_lines_mapped():
+    minified = minify(CODE)
+    assert minified.text == (
+        "import os\n"
+        "def run(user):\n"
+        '    command = "ls " + user\n'
+        "    return os.system(command)"
+    )
+    assert minified.line_map == [1, 4, 6, 8]
+    assert minified.to_original(3) == 6
+    assert minified.metrics()["originalChars"] == len(CODE)
+
+
+def test_remap_moves_findings_to_the_original_lines():
+    response = "vulnerabilities_detected:\n  - line: 4\n    description: x"
+    assert "line: 8" in minify(CODE).remap(response)
+
+
+def test_blobs_and_large_literals_are_elided():
+    blob = "QUJD" * 100
+    text = "x " * 400
+    minified = minify(f'KEY = "{blob}"\nDOC = "{text}"\n', literal_prefix_chars=8)
+    assert f'"{blob[:8]}...[392 chars elided]"' in minified.text
+    assert "[792 chars elided]" in minified.text
+
+
+def test_literals_that_may_hold_user_input_are_kept():
+    query = "SELECT * FROM users WHERE name = '{name}' " * 20
+    minified = minify(f'QUERY = "{query}"\n')
+    assert query in minified.text
+
+
+def test_long_data_runs_keep_their_first_and_last_lines():
+    rows = "\n".join(f"    [{n}, {n * 2}, 'row']," for n in range(30))
+    minified = minify(f"TABLE = [\n{rows}\n]\nprint(TABLE)\n", max_data_lines=5)
+    lines = minified.text.splitlines()
+    assert lines[1:4] == [
+        "    [0, 0, 'row'],",
+        "    [1, 2, 'row'],",
+        "    [2, 4, 'row'],",
+    ]
+    assert lines[4] == "    ... [27 lines of data elided]"
+    assert lines[5] == "]"
+    assert minified.line_map[4] == 5
+    assert lines[-1] == "print(TABLE)"
+
+
+GO = """package main
+
+func find(db *sql.DB, id string) {
+	rows := db.Query(`SELECT name FROM users`)
+	// Look the user up, the id comes from `r.URL`
+	query := "SELECT * FROM users WHERE id = " + id
+	db.Query(query) // the sink
+	_ = rows
+}
+"""
+JAVASCRIPT = """function find(id) {
+  const total = count(id)
+  // the user `id` is not escaped
+  return db.query("SELECT * FROM users WHERE id = " + id)
+}
+"""
+
+
+def test_go_comments_are_dropped_and_backticks_do_not_hide_code():
+    minified = minify(GO, language="go")
+    assert "Look the user up" not in minified.text
+    assert "the sink" not in minified.text
+    assert 'query := "SELECT * FROM users WHERE id = " + id' in minified.text
+    assert "db.Query(query)" in minified.text
+    assert "db.Query(`SELECT name FROM users`)" in minified.text
+
+
+def test_javascript_comments_after_identifiers_are_dropped():
+    minified = minify(JAVASCRIPT)
+    assert "not escaped" not in minified.text
+    assert 'db.query("SELECT * FROM users WHERE id = " + id)' in minified.text
+    assert minified.line_map == [1, 2, 4, 5]
+
+
+def test_backticks_are_plain_tokens_outside_javascript_and_go():
+    code = "x = 1  # `cmd`\nos.system(f'rm {path}')\nprint('`')\n"
+    minified = minify(code, language="python")
+    assert minified.text == "x = 1\nos.system(f'rm {path}')\nprint('`')"
+    # Python floor division at the start of a continuation line is code
+    assert "// 2" in minify("total = (count\n    // 2)\n", language="python").text
+
+
+def test_literals_spanning_code_lines_are_never_elided():
+    code = "query = `" + "x " * 400 + "\nrows := db.Query(query)\n`\n"
+    minified = minify(code, language="go", literal_prefix_chars=8)
+    assert "db.Query(query)" in minified.text
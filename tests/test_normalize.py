@@ -0,0 +1,56 @@
+from src.normalize import canonicalize, map_line, remap_findings
+
+PYTHON = '''def add(a, b):
+    """Sum two numbers."""
+    # plain addition
+    return a + b
+'''
+PYTHON_REFORMATTED = """def add(a, b):
+
+
+
+    return a + b  # same code, other layout
+"""
+
+
+def test_python_fingerprint_ignores_comments_and_docstrings():
+    original = canonicalize(PYTHON)
+    reformatted = canonicalize(PYTHON_REFORMATTED)
+    assert original.method == "ast"
+    assert original.fingerprint == reformatted.fingerprint
+    assert original.line_map == [1, 4]
+    assert reformatted.line_map == [1, 5]
+
+
+def test_python_fingerprint_sees_code_changes():
+    assert (
+        canonicalize(PYTHON).fingerprint
+        != canonicalize(PYTHON.replace("a + b", "a - b")).fingerprint
+    )
+
+
+def test_token_fingerprint_ignores_whitespace_and_comments():
+    first = canonicalize("function f(x) {\n  /* note */\n  return x; // done\n}\n")
+    second = canonicalize("function f(x) {\n\n      return x;\n}")
+    assert first.method == second.method == "tokens"
+    assert first.fingerprint == second.fingerprint
+    assert first.line_map == [1, 3, 4]
+    assert second.line_map == [1, 3, 4]
+
+
+def test_token_fingerprint_keeps_strings_and_floor_division():
+    assert (
+        canonicalize("x = 'a # b' +").fingerprint
+        != canonicalize("x = 'a' +").fingerprint
+    )
+    # `//` after an operand is a division, not a comment
+    assert "/ /" in canonicalize("y = a // b +").text
+
+
+def test_remap_findings_moves_lines_between_equivalent_snippets():
+    source = canonicalize(PYTHON_REFORMATTED).line_map
+    target = canonicalize(PYTHON).line_map
+    response = "vulnerabilities_detected:\n  - line: 5\n    description: x"
+    assert "line: 4" in remap_findings(response, source, target)
+    assert map_line(1, source, target) == 1
+    assert remap_findings(response, target, target) == response
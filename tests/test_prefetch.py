@@ -0,0 +1,124 @@
+import asyncio
+import contextlib
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+from src.guardrails import GuardrailResult
+from src.prefetch import CacheWarmer, Prefetcher, TokenBucket
+
+CODE = "import os\nos.system(input())\n"
+
+
+class FakeWorkflow:
+    """Just what the prefetcher uses, `cached` snippets cost no calls."""
+
+    two_phase_enabled = False
+
+    def __init__(self, cached=()):
+        self.cached = set(cached)
+        self.lanes = SimpleNamespace(lanes={"prefetch": None})
+        self.admission = SimpleNamespace(admit=self.admit)
+        self.guardrail = SimpleNamespace(check=GuardrailResult)
+        self.admitted = []
+        self.evaluated = []
+
+    def rules_for(self, language):
+        return ["A03_Injection"] if language == "python" else []
+
+    def estimate_cost(self, code, language=None, skip_cached=False):
+        if skip_cached and code in self.cached:
+            return 0, 0
+        return 1, 10
+
+    def admit(self, lane, calls, tokens):
+        self.admitted.append((lane, calls, tokens))
+        return contextlib.nullcontext()
+
+    async def run_async_inference(self, code, guardrail_result, **kwargs):
+        self.evaluated.append(code)
+
+
+def git(path, *args):
+    subprocess.run(["git", "-C", str(path), *args], check=True, capture_output=True)
+
+
+@pytest.fixture
+def clone(tmp_path):
+    git(tmp_path, "init", "--quiet")
+    git(tmp_path, "config", "user.email", "test@example.com")
+    git(tmp_path, "config", "user.name", "test")
+    (tmp_path / "app.py").write_text(CODE)
+    (tmp_path / "util.py").write_text("def double(x):\n    return 2 * x\n")
+    (tmp_path / "README.md").write_text("# Docs\n")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "--quiet", "-m", "first")
+    return tmp_path
+
+
+def test_bucket_refills_at_its_rate_up_to_the_burst():
+    bucket = TokenBucket(rate=2, burst=10)
+    asyncio.run(bucket.take(10))
+    assert bucket.level() == pytest.approx(0, abs=0.5)
+    # Three seconds ago, as far as the bucket knows
+    bucket.updated -= 3
+    assert bucket.level() == pytest.approx(6, abs=0.5)
+    bucket.updated -= 100
+    assert bucket.level() == 10
+
+
+def test_bucket_denies_spending_beyond_its_tokens():
+    async def main():
+        bucket = TokenBucket(rate=1, burst=10)
+        await bucket.take(8)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(bucket.take(5), 0.05)
+        # The denied take spent nothing
+        assert bucket.level() == pytest.approx(2, abs=0.5)
+        # A cost above the burst waits for a full bucket only
+        bucket.updated -= 8
+        await asyncio.wait_for(bucket.take(50), 1)
+        assert bucket.level() == pytest.approx(0, abs=0.5)
+
+    asyncio.run(main())
+
+
+def test_cached_snippets_skip_the_bucket_and_the_model():
+    async def main():
+        workflow = FakeWorkflow(cached=[CODE])
+        prefetcher = Prefetcher(workflow, tokens_per_second=1, burst_tokens=10)
+        prefetcher.start()
+        await prefetcher.submit(CODE, GuardrailResult(CODE), language="python")
+        await prefetcher.submit("print(1)\n", GuardrailResult("print(1)\n"))
+        await asyncio.wait_for(prefetcher.queue.join(), 1)
+        await prefetcher.stop()
+        return workflow, prefetcher
+
+    workflow, prefetcher = asyncio.run(main())
+    assert workflow.evaluated == ["print(1)\n"]
+    assert workflow.admitted == [("prefetch", 1, 10)]
+    assert prefetcher.counters["warm"] == 1
+    assert prefetcher.counters["prefetched"] == 1
+    assert prefetcher.bucket.level() < 1
+
+
+def test_warming_queues_only_files_changed_since_the_last_warmed_commit(clone):
+    async def main():
+        prefetcher = Prefetcher(FakeWorkflow())
+        warmer = CacheWarmer(prefetcher)
+        queued = [await warmer.warm(str(clone), branch="HEAD")]
+        paths = [prefetcher.queue.get_nowait().path for _ in range(queued[0])]
+        # Same commit, nothing to read
+        queued.append(await warmer.warm(str(clone), branch="HEAD"))
+        (clone / "util.py").write_text("def triple(x):\n    return 3 * x\n")
+        git(clone, "commit", "--quiet", "-am", "second")
+        queued.append(await warmer.warm(str(clone), branch="HEAD"))
+        paths.append(prefetcher.queue.get_nowait().path)
+        return queued, paths, warmer
+
+    queued, paths, warmer = asyncio.run(main())
+    assert queued == [2, 0, 1]
+    assert sorted(paths[:2]) == ["app.py", "util.py"]
+    assert paths[2] == "util.py"
+    assert warmer.warmed[str(clone)]["queued"] == 1
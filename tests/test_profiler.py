@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from src import profiler
+from src.profiler import StackSampler, current_profile, tagged
+
+
+@pytest.fixture
+def phases(monkeypatch):
+    # The functions of this file stand for a phase of the package
+    monkeypatch.setattr(profiler, "PACKAGE_DIR", os.path.dirname(__file__))
+    monkeypatch.setattr(
+        profiler, "PACKAGE_PHASES", {("test_profiler.py", "parse"): "parsing"}
+    )
+
+
+def parse(seconds: float) -> int:
+    deadline, count = time.perf_counter() + seconds, 0
+    while time.perf_counter() < deadline:
+        count += 1
+    return count
+
+
+def run_tagged(profile, function, *args):
+    """Run a function in an executor thread as a rule call of the request."""
+    token = current_profile.set(profile)
+    try:
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(tagged(function), *args).result()
+    finally:
+        current_profile.reset(token)
+
+
+def test_executor_samples_go_to_the_phase_of_the_request(phases):
+    sampler = StackSampler(interval_ms=1)
+    profile = sampler.start_request()
+    other = sampler.start_request()
+    run_tagged(profile, parse, 0.2)
+    summary = sampler.summary(profile)
+    sampler.finish_request(profile)
+    sampler.finish_request(other)
+    assert summary["phases_ms"]["parsing"] > 0
+    assert summary["top_functions"][0]["function"].startswith("parse (")
+    assert summary["executor_queue_ms"]["calls"] == 1
+    # Another profiled request does not get the samples of this one
+    assert other.samples == 0
+
+
+def test_finish_request_stops_attributing_and_sampling(phases):
+    sampler = StackSampler(interval_ms=1)
+    profile = sampler.start_request()
+    # Keeps the sampler running after the request finished
+    other = sampler.start_request()
+    started, release = threading.Event(), threading.Event()
+
+    def work():
+        started.set()
+        release.wait(5)
+        return parse(0.05)
+
+    thread = threading.Thread(target=run_tagged, args=(profile, work))
+    thread.start()
+    assert started.wait(5)
+    sampler.finish_request(profile)
+    samples = profile.samples
+    release.set()
+    thread.join(5)
+    # The executor thread outlived the request, its work is not counted
+    assert profile.samples == samples
+    assert profiler._thread_profiles == {}
+    assert other.samples == 0
+    sampler.finish_request(other)
+    deadline = time.perf_counter() + 5
+    while sampler._thread is not None and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    assert sampler._thread is None
+
+
+def test_loop_samples_only_go_to_the_request_owning_the_task(monkeypatch):
+    sampler = StackSampler()
+    sampler.loop = asyncio.new_event_loop()
+    profile, other = sampler.start_request(), sampler.start_request()
+    token = current_profile.set(profile)
+    context = contextvars.copy_context()
+    current_profile.reset(token)
+    task = SimpleNamespace(get_context=lambda: context)
+    monkeypatch.setattr(profiler.asyncio, "current_task", lambda loop: task)
+    assert sampler._loop_profiles() == [profile]
+    # Without Task.get_context the owner is unknown, no request gets them
+    monkeypatch.setattr(
+        profiler.asyncio, "current_task", lambda loop: SimpleNamespace()
+    )
+    assert sampler._loop_profiles() == []
+    assert profile.loop_attribution == other.loop_attribution == "unavailable"
+    sampler.finish_request(profile)
+    sampler.finish_request(other)
+    sampler.loop.close()
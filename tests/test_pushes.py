@@ -0,0 +1,116 @@
+import asyncio
+
+from src.pushes import (
+    attribute_findings,
+    evaluate_range,
+    net_hunks,
+    pack_hunks,
+    plan_range,
+)
+
+FIRST = """diff --git a/app.py b/app.py
+new file mode 100644
+--- /dev/null
++++ b/app.py
+@@ -0,0 +1,3 @@
++import os
++password = "hunter2"
++print(password)
+"""
+SECOND = """diff --git a/app.py b/app.py
+--- a/app.py
++++ b/app.py
+@@ -1,3 +1,3 @@
+ import os
+-password = "hunter2"
++password = os.environ["PASSWORD"]
+ print(password)
+"""
+RENAME = """diff --git a/app.py b/main.py
+similarity index 100%
+rename from app.py
+rename to main.py
+"""
+DOCS = """diff --git a/README.md b/README.md
+--- a/README.md
++++ b/README.md
+@@ -1 +1,2 @@
+ # App
++Set PASSWORD before running it.
+"""
+FINDING = """vulnerabilities_detected:
+  - line: 3
+    description: Hardcoded secret"""
+
+
+def resolve_language(path, code):
+    return "python" if path.endswith(".py") else "markdown"
+
+
+class FakeWorkflow:
+    two_phase_enabled = False
+    resolve_language = staticmethod(resolve_language)
+
+    def rules_for(self, language):
+        return ["A02"] if language == "python" else []
+
+    async def run_async_inference(self, code, **kwargs):
+        failed = "hunter2" in code
+        return [
+            {
+                "owasp_name": "A02",
+                "pass": not failed,
+                "response": FINDING if failed else "vulnerabilities_detected: []",
+                "metrics": {"totalTokens": 10},
+            }
+        ]
+
+
+def test_net_hunks_drop_superseded_lines_and_follow_renames():
+    hunks, superseded = net_hunks([("c1", FIRST), ("c2", SECOND), ("c3", RENAME)])
+    assert superseded == {"c1": 1}
+    assert [(hunk.path, hunk.hunk.start_line) for hunk in hunks] == [("main.py", 1)]
+    assert hunks[0].hunk.lines[1] == 'password = os.environ["PASSWORD"]'
+    assert hunks[0].commits == ["c1", "c2"]
+
+
+def test_pack_hunks_evaluates_each_distinct_hunk_once_per_language():
+    hunks, _ = net_hunks([("c1", FIRST), ("c2", FIRST.replace("app.py", "copy.py"))])
+    docs, _ = net_hunks([("c3", DOCS)])
+    snippets = pack_hunks(hunks + docs, resolve_language)
+    assert [snippet.language for snippet in snippets] == ["python", "markdown"]
+    assert snippets[0].code.count("hunter2") == 1
+    assert len(pack_hunks(hunks + hunks[:1], resolve_language, max_lines=2)) == 1
+    many, _ = net_hunks([("c1", FIRST), ("c2", SECOND.replace("app.py", "b.py"))])
+    assert len(pack_hunks(many, resolve_language, max_lines=3)) == 2
+
+
+def test_attribute_findings_moves_lines_to_their_hunk():
+    docs, _ = net_hunks([("c0", DOCS.replace("README.md", "notes.py"))])
+    hunks, _ = net_hunks([("c1", FIRST)])
+    snippet = pack_hunks(docs + hunks, resolve_language)[0]
+    # Line 3 of the snippet is the first line of the second hunk, after the
+    # separator line
+    findings = attribute_findings(
+        snippet, [{"owasp_name": "A02", "pass": False, "response": FINDING}]
+    )
+    assert list(findings) == [hunks[0].hunk.hash]
+    assert findings[hunks[0].hunk.hash][0]["line"] == 1
+    unsplit = attribute_findings(
+        snippet, [{"owasp_name": "A02", "pass": False, "response": "Insecure"}]
+    )
+    assert set(unsplit) == {docs[0].hunk.hash, hunks[0].hunk.hash}
+
+
+def test_evaluate_range_skips_hunks_without_rules():
+    commits = [("c1", FIRST), ("c2", DOCS)]
+    plan = plan_range(FakeWorkflow(), commits)
+    assert [hunk.path for hunk in plan.evaluated_hunks()] == ["app.py"]
+    report = asyncio.run(evaluate_range(FakeWorkflow(), plan))
+    assert not report["passed"]
+    first, docs = report["commits"]
+    assert first["status"] == "failed"
+    assert first["hunks"][0]["findings"][0]["line"] == 3
+    assert report["failed_hunks"] == {first["hunks"][0]["hash"]}
+    assert docs["hunks"][0]["status"] == "skipped"
+    assert report["summary"]["ruleCalls"] == 1
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from strands.models import Model
+
+from src.replay import CassetteMissError, CassetteStore, RecordReplayModel
+
+MESSAGES = [{"role": "user", "content": [{"text": "eval(input())"}]}]
+
+
+class FakeModel(Model):
+    def __init__(self):
+        self.calls = 0
+
+    def update_config(self, **model_config):
+        pass
+
+    def get_config(self):
+        return {"model_id": "fake"}
+
+    def structured_output(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def stream(self, messages, tool_specs=None, system_prompt=None, **kwargs):
+        self.calls += 1
+        yield {"contentBlockDelta": {"delta": {"text": "vulnerabilities_detected: []"}}}
+        yield {"messageStop": {"stopReason": "end_turn"}}
+
+
+async def collect(model, messages=MESSAGES, system_prompt="A03") -> list:
+    return [event async for event in model.stream(messages, None, system_prompt)]
+
+
+def test_recorded_calls_are_replayed_without_the_model(tmp_path):
+    store = CassetteStore(str(tmp_path / "cassettes" / "rules.db"))
+    live = FakeModel()
+    recorded = asyncio.run(collect(RecordReplayModel(live, store, mode="record")))
+    assert live.calls == 1 and len(store) == 1
+
+    offline = FakeModel()
+    replayed = asyncio.run(collect(RecordReplayModel(offline, store, mode="replay")))
+    assert replayed == recorded
+    assert offline.calls == 0
+
+
+def test_missing_cassette_entries(tmp_path):
+    store = CassetteStore(str(tmp_path / "rules.db"))
+    model = FakeModel()
+    asyncio.run(collect(RecordReplayModel(model, store, mode="record")))
+    # Another system prompt is another request
+    with pytest.raises(CassetteMissError):
+        asyncio.run(
+            collect(RecordReplayModel(model, store, mode="replay"), system_prompt="A01")
+        )
+    # Auto mode records what is missing and replays the rest
+    auto = RecordReplayModel(model, store, mode="auto")
+    asyncio.run(collect(auto, system_prompt="A01"))
+    asyncio.run(collect(auto, system_prompt="A01"))
+    assert model.calls == 2 and len(store) == 2
+
+
+def test_invalid_modes_are_rejected(tmp_path):
+    store = CassetteStore(str(tmp_path / "rules.db"))
+    with pytest.raises(ValueError):
+        RecordReplayModel(FakeModel(), store, mode="live")
+    with pytest.raises(ValueError):
+        RecordReplayModel(FakeModel(), store, latency="slow")
@@ -0,0 +1,58 @@
+from src.retrieval import PromptIndex, split_prompt, tokenize
+
+PROMPT = """## Context
+You review code for injection flaws.
+
+### SQL
+Checks on database access:
+- Queries built by concatenating user input into SQL
+- Cursor execute calls with formatted strings
+
+### Commands
+- Shell commands run through subprocess with user input
+
+## Response Format
+Answer in YAML.
+"""
+
+
+def test_tokenize_splits_identifiers_and_drops_stopwords():
+    terms = tokenize("def executeQuery(user_input): return self.SQLInjection")
+    assert {"executequery", "execute", "query", "user_input", "user", "input"} <= set(
+        terms
+    )
+    assert {"sql", "injection"} <= set(terms)
+    assert "def" not in terms and "self" not in terms
+
+
+def test_split_prompt_keeps_core_sections_and_one_passage_per_item():
+    headings, blocks = split_prompt(PROMPT)
+    assert headings == ["### SQL\nChecks on database access:", "### Commands"]
+    core = [block.text for block in blocks if block.section is None]
+    assert core[0].startswith("## Context") and core[-1].startswith("## Response")
+    items = [block for block in blocks if block.section is not None]
+    assert [block.section for block in items] == [0, 0, 1]
+
+
+def test_render_keeps_the_passages_relevant_to_the_code(tmp_path):
+    index = PromptIndex(str(tmp_path / "index"), {"injection": PROMPT})
+    assert index.stats()["passages"] == 3
+    rendered = index.render(
+        "injection", "cursor.execute('SELECT * FROM t WHERE id=' + id)", top_k=1
+    )
+    assert "Cursor execute" in rendered and "### SQL" in rendered
+    assert "subprocess" not in rendered and "### Commands" not in rendered
+    assert rendered.startswith("## Context") and rendered.endswith("Answer in YAML.")
+
+
+def test_index_is_reused_from_disk(tmp_path):
+    path = str(tmp_path / "index")
+    first = PromptIndex(path, {"injection": PROMPT})
+    meta = (tmp_path / "index.json").read_text()
+    second = PromptIndex(path, {"injection": PROMPT})
+    assert (tmp_path / "index.json").read_text() == meta
+    code = "subprocess.run(command, shell=True)"
+    assert first.search("injection", code, 2) == second.search("injection", code, 2)
+    # Other prompts invalidate the index
+    PromptIndex(path, {"injection": PROMPT.replace("YAML", "JSON")})
+    assert (tmp_path / "index.json").read_text() != meta
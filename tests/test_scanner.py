@@ -0,0 +1,74 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from src import scanner
+from src.scanner import chunk_code, scan_repository, walk_files
+
+
+class FakeWorkflow:
+    evaluation_config = {"guardrail": {}}
+
+    def rules_for(self, language):
+        return [] if language == "markdown" else ["A03"]
+
+    async def run_async_prepared(self, code, canonical, units, language=None):
+        return [{"owasp_name": "A03", "pass": True, "response": "", "metrics": {}}]
+
+
+def thread_pool(max_workers=None, mp_context=None, initializer=None, initargs=()):
+    # The pool workers spawn fresh interpreters, where patches do not apply
+    return ThreadPoolExecutor(max_workers, initializer=initializer, initargs=initargs)
+
+
+def write_tree(root):
+    (root / ".gitignore").write_text("build/\n*.min.js\n")
+    (root / "build").mkdir()
+    (root / "build" / "out.py").write_text("print('built')\n")
+    (root / "app.py").write_text("import os\nprint(os.getcwd())\n")
+    (root / "bad.py").write_text("print('bad')\n")
+    (root / "lib.min.js").write_text("var a=1;\n")
+    (root / "README.md").write_text("# Docs\n")
+
+
+def test_walk_files_honours_gitignore(tmp_path):
+    write_tree(tmp_path)
+    paths = [path for path, _ in walk_files(str(tmp_path))]
+    assert "build/out.py" not in paths and "lib.min.js" not in paths
+    assert {"app.py", "bad.py"} <= set(paths)
+
+
+def test_chunk_code_cuts_between_units():
+    code = "\n".join(f"def f{index}():\n    return {index}\n" for index in range(6))
+    chunks = chunk_code(code, max_chunk_lines=5)
+    assert all(text.startswith("def ") for _, text in chunks)
+    assert [start for start, _ in chunks] == [1, 4, 7, 10, 13, 16]
+
+
+def test_preprocessing_errors_do_not_stop_the_scan(tmp_path, monkeypatch):
+    root = tmp_path / "repo"
+    root.mkdir()
+    write_tree(root)
+    original = scanner.preprocess_file
+
+    def preprocess_file(root, relative, *args):
+        if relative == "bad.py":
+            raise UnicodeError("cannot decode")
+        return original(root, relative, *args)
+
+    monkeypatch.setattr(scanner, "ProcessPoolExecutor", thread_pool)
+    monkeypatch.setattr(scanner, "preprocess_file", preprocess_file)
+    output, checkpoint = tmp_path / "scan.jsonl", tmp_path / "scan.checkpoint"
+    stats = asyncio.run(
+        scan_repository(FakeWorkflow(), str(root), str(output), str(checkpoint))
+    )
+    records = {
+        record["path"]: record
+        for record in map(json.loads, output.read_text().splitlines())
+    }
+    assert records["app.py"]["status"] == "evaluated"
+    assert records["bad.py"]["status"] == "error"
+    assert records["bad.py"]["stage"] == "preprocessing"
+    assert stats["error"] == 1 and stats["unrouted"] == 1
+    # A resumed scan does not retry a file that fails the same way every time
+    assert "bad.py" in checkpoint.read_text().split()
@@ -0,0 +1,57 @@
+from src.scheduler import RuleScheduler
+
+
+def result(passed, latency=1000, cache_hit=False):
+    return {
+        "pass": passed,
+        "metrics": {"latencyMs": latency, "totalTokens": 10, "cacheHit": cache_hit},
+    }
+
+
+def test_rules_without_history_use_the_prior():
+    scheduler = RuleScheduler(prior_hit_rate=0.5, prior_latency_ms=5000)
+    decisions = scheduler.plan(["A01", "A02"])
+    assert [decision.scope for decision in decisions] == ["prior", "prior"]
+    assert decisions[0].priority == 0.1
+    assert len(scheduler.decisions) == 1
+
+
+def test_failing_fast_rules_go_first():
+    scheduler = RuleScheduler(min_samples=2)
+    for _ in range(2):
+        scheduler.record("A01", result(True, latency=500))
+        scheduler.record("A02", result(False, latency=2000))
+        scheduler.record("A03", result(False, latency=1000))
+    order = [decision.owasp_id for decision in scheduler.preview(["A01", "A02", "A03"])]
+    assert order == ["A03", "A02", "A01"]
+
+
+def test_most_specific_scope_with_enough_samples_wins():
+    scheduler = RuleScheduler(min_samples=2)
+    for _ in range(2):
+        scheduler.record("A03", result(False), repository="repo", language="python")
+    scheduler.record("A03", result(True), repository="other", language="python")
+    assert scheduler.preview(["A03"], "repo", "python")[0].scope == "repo/python"
+    # One sample is not enough, the language scope has three
+    decision = scheduler.preview(["A03"], "other", "python")[0]
+    assert decision.scope == "*/python"
+    assert decision.samples == 3
+
+
+def test_cache_hits_do_not_update_latency():
+    scheduler = RuleScheduler(min_samples=1)
+    scheduler.record("A01", result(False, latency=1000))
+    scheduler.record("A01", result(False, latency=1, cache_hit=True))
+    stats = scheduler.snapshot(repository="*", language="*")[0]
+    assert stats["samples"] == 2
+    assert stats["timed_samples"] == 1
+    assert stats["latency_ms"] == 1000
+
+
+def test_statistics_are_bounded_by_least_recent_update():
+    scheduler = RuleScheduler(max_entries=3)
+    for repository in ("first", "second", "third"):
+        scheduler.record("A01", result(False), repository=repository)
+    repositories = {row["repository"] for row in scheduler.snapshot()}
+    # The global scope is refreshed by every result
+    assert repositories == {"*", "second", "third"}
@@ -0,0 +1,70 @@
+from src.findings import finding_line, render_findings, split_findings
+from src.segment import split_units
+
+PYTHON = """import os
+
+
+@decorator
+def read(path):
+    return open(path).read()
+
+
+class Store:
+    def get(self):
+        return os.getcwd()
+"""
+JAVASCRIPT = """const fs = require("fs");
+
+function read(path) {
+  return fs.readFileSync(path);
+}
+
+export async function write(path, data) {
+  fs.writeFileSync(path, data);
+}
+"""
+RESPONSE = """```yaml
+vulnerabilities_detected:
+  - line: 5
+    description: Path traversal
+    suggested_fix: |
+      Resolve the path first
+
+  - line: [10, 11]
+    description: Leaks the working directory
+```"""
+
+
+def test_python_units_keep_decorators_and_module_remainder():
+    units = split_units(PYTHON)
+    assert [unit.name for unit in units] == ["<module>", "read", "Store"]
+    assert units[1].lines == [4, 5, 6]
+    assert units[1].code.startswith("@decorator")
+    assert units[2].lines[0] == 9
+
+
+def test_heuristic_units_split_at_declarations():
+    units = split_units(JAVASCRIPT)
+    assert [unit.lines[0] for unit in units] == [1, 3, 7]
+    assert units[2].name.startswith("export async function write")
+    assert all(unit.canonical.method == "tokens" for unit in units)
+
+
+def test_unchanged_units_keep_their_fingerprint():
+    edited = PYTHON.replace("os.getcwd()", "os.getcwd() + '/'")
+    before = {unit.name: unit.canonical.fingerprint for unit in split_units(PYTHON)}
+    after = {unit.name: unit.canonical.fingerprint for unit in split_units(edited)}
+    assert before["read"] == after["read"]
+    assert before["Store"] != after["Store"]
+
+
+def test_split_and_render_findings_round_trip():
+    blocks = split_findings(RESPONSE)
+    assert len(blocks) == 2
+    assert [finding_line(block) for block in blocks] == [5, 10]
+    assert split_findings(render_findings(blocks)) == blocks
+    assert split_findings(render_findings([])) == []
+
+
+def test_split_findings_rejects_unknown_formats():
+    assert split_findings("No issues found") is None
@@ -0,0 +1,95 @@
+import threading
+
+from src import similarity
+from src.normalize import canonicalize
+from src.similarity import NearDuplicateIndex, NearDuplicatePolicy
+
+CODE = """def load(path):
+    with open(path) as handle:
+        rows = [line.split(",") for line in handle]
+    return {row[0]: row[1:] for row in rows if row}
+"""
+EDITED = CODE.replace("return {", "result = {") + "    return result\n"
+
+
+def test_near_duplicates_reuse_only_passes_of_the_same_rule_version():
+    index = NearDuplicateIndex(max_entries=16)
+    policy = NearDuplicatePolicy(index, reuse=True, reuse_threshold=0.5)
+    index.add(canonicalize(CODE), "A03:v1", True)
+    index.add(canonicalize(CODE), "A01:v1", False)
+    assert policy.reusable_pass(canonicalize(EDITED), "A03:v1") is not None
+    assert policy.reusable_pass(canonicalize(EDITED), "A03:v2") is None
+    assert policy.reusable_pass(canonicalize(EDITED), "A01:v1") is None
+    assert policy.suspect_rules([canonicalize(EDITED)], ["A01:v1", "A03:v1"]) == [
+        "A01:v1"
+    ]
+
+
+def test_reuse_is_off_unless_enabled():
+    index = NearDuplicateIndex(max_entries=16)
+    index.add(canonicalize(CODE), "A03:v1", True)
+    policy = NearDuplicatePolicy(index)
+    assert policy.reusable_pass(canonicalize(CODE), "A03:v1") is None
+
+
+def test_outdated_rule_versions_give_up_their_bits(monkeypatch):
+    monkeypatch.setattr(similarity, "MAX_RULES", 2)
+    index = NearDuplicateIndex(max_entries=16)
+    canonical = canonicalize(CODE)
+    index.add(canonical, "A03:v1", True)
+    index.add(canonical, "A01:v1", False)
+    index.add(canonical, "A03:v1", True)
+    index.add(canonical, "A01:v2", True)
+    entry = index.query(canonical)[1]
+    assert index.rules == ["A03:v1", "A01:v2"]
+    assert index.verdict(entry, "A01:v2") is True
+    assert index.verdict(entry, "A01:v1") is None
+    assert index.verdict(entry, "A03:v1") is True
+
+
+def test_index_is_saved_and_loaded(tmp_path):
+    path = str(tmp_path / "index.npz")
+    index = NearDuplicateIndex(path=path, max_entries=16)
+    index.add(canonicalize(CODE), "A03:v1", False)
+    index.save()
+    loaded = NearDuplicateIndex(path=path, max_entries=16)
+    entry = loaded.query(canonicalize(CODE))[1]
+    assert loaded.verdict(entry, "A03:v1") is False
+
+
+def test_saves_of_processes_sharing_a_path_are_merged(tmp_path):
+    path = str(tmp_path / "index.npz")
+    first = NearDuplicateIndex(path=path, max_entries=16)
+    second = NearDuplicateIndex(path=path, max_entries=16)
+    first.add(canonicalize(CODE), "A03:v1", False)
+    second.add(canonicalize(EDITED), "A01:v1", True)
+    second.add(canonicalize(CODE), "A01:v1", True)
+    first.save()
+    second.save()
+    loaded = NearDuplicateIndex(path=path, max_entries=16)
+    assert loaded.count == 2
+    entry = loaded.query(canonicalize(CODE))[1]
+    assert loaded.verdict(entry, "A03:v1") is False
+    assert loaded.verdict(entry, "A01:v1") is True
+    edited = loaded.query(canonicalize(EDITED))[1]
+    assert loaded.verdict(edited, "A01:v1") is True
+    assert loaded.verdict(edited, "A03:v1") is None
+
+
+def test_periodic_saves_run_in_the_background(tmp_path):
+    index = NearDuplicateIndex(path=str(tmp_path / "index.npz"), save_interval=1)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def save():
+        calls.append(threading.current_thread().name)
+        started.set()
+        release.wait(5)
+
+    index.save = save
+    index.add(canonicalize(CODE), "A03:v1", True)
+    assert started.wait(5)
+    # A flush in progress is not started again
+    index.add(canonicalize(EDITED), "A03:v1", True)
+    release.set()
+    assert calls == ["near-duplicate-flush"]
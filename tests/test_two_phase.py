@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+import pytest
+from strands.models import Model
+
+from src.workflow import VERDICT_SUFFIX, OwaspWorkflow
+
+CONFIG_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "src", "configs", "configs.json"
+)
+CODE = "import os\nos.system(input())\n"
+FINDING = "vulnerabilities_detected:\n  - line: 2\n    description: Command injection"
+CLEAN = "vulnerabilities_detected: []"
+FAILING_RULE = "A03_Injection"
+
+
+class FakeModel(Model):
+    def __init__(self, response, lanes):
+        self.response = response
+        self.lanes = lanes
+        self.lanes_used = []
+
+    def update_config(self, **model_config):
+        pass
+
+    def get_config(self):
+        return {"params": {"max_tokens": 100}}
+
+    def structured_output(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def stream(self, messages, tool_specs=None, system_prompt=None, **kwargs):
+        self.lanes_used.append(
+            [name for name, lane in self.lanes.lanes.items() if lane.running]
+        )
+        yield {"messageStart": {"role": "assistant"}}
+        yield {"contentBlockDelta": {"delta": {"text": self.response}}}
+        yield {"contentBlockStop": {}}
+        yield {"messageStop": {"stopReason": "end_turn"}}
+
+
+@pytest.fixture
+def workflow(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    workflow = OwaspWorkflow(
+        CONFIG_PATH,
+        overrides={
+            "two_phase": {"enabled": True, "details": "background"},
+            # Small enough for the rule results to churn through it
+            "cache": {"backend": "memory", "max_entries": 2},
+            "prompt_retrieval": {"enabled": False},
+            "near_duplicates": {"enabled": False, "path": None},
+        },
+    )
+    agents = {**workflow.agents, **workflow.verdict_agents}
+    for agent_id, agent in agents.items():
+        # Only the injection rule fails, in both phases
+        failed = agent_id.startswith(FAILING_RULE)
+        agent.model = FakeModel(FINDING if failed else CLEAN, workflow.lanes)
+    return workflow
+
+
+async def verdicts_and_details(workflow):
+    evaluation_id, results = await workflow.run_async_verdicts(
+        CODE, language="python", lane="interactive"
+    )
+    await asyncio.gather(*workflow._details_tasks)
+    return evaluation_id, results
+
+
+def test_background_details_run_in_their_own_lane(workflow):
+    evaluation_id, results = asyncio.run(verdicts_and_details(workflow))
+    assert {result["phase"] for result in results} == {"verdict"}
+    assert [result["pass"] for result in results].count(False) == 1
+    assert workflow.agents[FAILING_RULE].model.lanes_used == [[workflow.details_lane]]
+    verdict_model = workflow.verdict_agents[f"{FAILING_RULE}{VERDICT_SUFFIX}"].model
+    assert verdict_model.lanes_used[0] == ["interactive"]
+    # The admission ticket of the details is returned once they finish
+    assert workflow.admission.backlog_calls == 0
+    assert workflow.admission.admitted[workflow.details_lane] == 1
+
+
+def test_details_outlive_the_churn_of_the_result_cache(workflow):
+    evaluation_id, _ = asyncio.run(verdicts_and_details(workflow))
+    # Another evaluation stores more rule results than the cache holds
+    asyncio.run(workflow.run_async_verdicts("print(1)\n", language="python"))
+    assert workflow.cache.stats()["entries"] == 2
+    details = asyncio.run(workflow.run_async_details(evaluation_id))
+    assert [result["owasp_name"] for result in details] == [
+        workflow.agents[FAILING_RULE].owasp_name
+    ]
+    assert asyncio.run(workflow.run_async_details("unknown")) is None